@@ -7,6 +7,7 @@ from sqlalchemy import create_engine
 from sqlalchemy_utils.functions import database_exists
 
 from DataApp.ConfigManager import Config
+from DataManagement.MatchDatabase import upgrade_picture_table
 from loguru import logger
 import sys
 
@@ -62,6 +63,9 @@ class AppManager:
         db_url = self.db_url()
         logger.debug("Connecting to the database")
         self.db_engine = create_engine(db_url)
+        # the tables of older databases miss the newer columns
+        if database_exists(self.db_engine.url):
+            upgrade_picture_table(self.db_engine)
 
 
     def check_db_exists(self) -> None:
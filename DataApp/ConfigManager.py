@@ -97,6 +97,8 @@ class Config:
         self.use_database = True
         self.output_dir = "data"
         self.db = None
+        self.model_path = "../models/cnn_dataset_230611_allwood_not_board2.h5"
+        self.model_backend = "auto"
 
         self._config = configparser.ConfigParser()
         self._config.read("config.ini")
@@ -133,6 +135,18 @@ class Config:
         self.output_dir = \
             self._config["General"]["output_dir"]
 
+        # the label prediction model, keras, tflite or onnx (auto: from the
+        # extension of the file)
+        if "Model" in self._config:
+            self.model_path = \
+                self._config["Model"].get("path", self.model_path)
+            self.model_backend = \
+                self._config["Model"].get("backend", self.model_backend)
+        self.model_path = \
+            self._config_from_env.get("model_path", self.model_path)
+        self.model_backend = \
+            self._config_from_env.get("model_backend", self.model_backend)
+        logger.debug(f"Model {self.model_path}, backend {self.model_backend}")
 
         if self.use_database:
             logger.debug("Database is enabled, importing db config")
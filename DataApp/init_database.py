@@ -1,10 +1,12 @@
 """ this script create the database following  the configuration files """
+import click
 from loguru import logger
 from sqlalchemy_utils import database_exists, create_database, drop_database
 
 from  DataApp.AppManager import AppManager
 
-from DataManagement.MatchDatabase import Base
+from DataManagement.MatchDatabase import Base, upgrade_picture_table
+from MatchManager.MatchManager import MatchManager
 
 
 def init_db():
@@ -38,14 +40,39 @@ def init_db():
     logger.debug(f"db_engine: {db_engine}")
 
     Base.metadata.create_all(db_engine)
+    upgrade_picture_table(db_engine)
     logger.info("Database initialized")
 
 
 
 
 
+def pack_boards():
+    """ convert the boards of the pictures stored as text only to the
+    packed format, in the existing database """
+    app_manager = AppManager()
+    # the connection adds the packed board column if it is missing
+    app_manager.init_db_connection()
+    n_converted = MatchManager(app_manager.db_engine).pack_board_status()
+    logger.info(f"{n_converted} pictures converted")
+    return n_converted
+
+
+@click.command()
+@click.option("--pack-boards", "pack_only", is_flag=True,
+              help="do not initialize the database, only convert the boards "
+                   "of the existing pictures stored as text to the packed "
+                   "format")
+def main(pack_only):
+    """ create the database, or convert its old boards with --pack-boards """
+    if pack_only:
+        pack_boards()
+    else:
+        init_db()
+
+
 if __name__ == "__main__":
-    init_db()
+    main()
 
 
 
@@ -34,9 +34,11 @@ from streamlit.runtime.uploaded_file_manager import UploadedFile
 
 from DataApp.AppManager import AppManager
 from MatchManager.MatchManager import MatchManager
+from SchellingModel.BoardEncoding import encode_board
 from VisualDetector.ImageLabelPrediction import detect_labels_fast
 from VisualDetector.ImagePreprocessing import prepare_img_for_boundary, \
-    find_largest_box, correct_perspective
+    find_largest_box, correct_perspective, downscale, upscale_box, \
+    refine_box_corners
 from VisualDetector.VisualUtils import overlap_matrix_to_picture, \
     overlap_bool_matrix_to_picture
 
@@ -340,6 +342,16 @@ def starting_page(): #TODO: rename
                     _('times you repeate increase thickness'),
                     min_value=0,
                     value=1)
+            # the boundary on the full photo is slow, it can be looked for
+            # on a smaller copy and the corners mapped back. The parameters
+            # above are tuned on full photos, keep them until
+            # benchmarks/bench_boundary.py is run on real uploads
+            detection_side = st.number_input(
+                    _('detection size (0 for the full image)'),
+                    min_value=0,
+                    value=0, step=128)
+            refine_corners = st.checkbox(_('refine the corners'),
+                                         value=False)
         # small form for changes in grid size
         cols = sb_container.columns(3, )
         with cols[0]:
@@ -416,7 +428,9 @@ def starting_page(): #TODO: rename
                 #st.image(img, caption=_('Uploaded Image.'),
                          #use_column_width=True, )
 
-            threshold_img = prepare_img_for_boundary(img, False,
+            boundary_img, scale = downscale(img, detection_side) \
+                if detection_side > 0 else (img, (1.0, 1.0))
+            threshold_img = prepare_img_for_boundary(boundary_img, False,
                                                      blurry_kernel_size,
                                                      adaptive_threshold_mode,
                                                      dilate_kernel_size,
@@ -429,13 +443,20 @@ def starting_page(): #TODO: rename
 
             largest_boxes = find_largest_box(threshold_img,
                                              return_first_n_boxes=3)
+            if boundary_img is not img:
+                largest_boxes = [upscale_box(box, scale)
+                                 for box in largest_boxes]
+            if refine_corners:
+                largest_boxes = [refine_box_corners(img, box)
+                                 for box in largest_boxes]
             st.session_state["largest_box"] = largest_boxes
             # in col2 show the image img with the largest box drawn
             img2 = img.copy()
 
             for ix, box in enumerate(largest_boxes):
                 # print(ix, box)
-                cv2.drawContours(img2, [box], 0, box_colors[ix], 15)
+                cv2.drawContours(img2, [np.int32(np.round(box))], 0,
+                                 box_colors[ix], 15)
 
             #with col2:
                 #st.image(img2, caption=_('Largest box.'),
@@ -489,12 +510,12 @@ def second_page():
     # print(grid_x, grid_y, largest_box)
     img_corrected = correct_perspective(img, largest_box, (grid_x, grid_y))
     board = detect_labels_fast(img_corrected, grid_x, grid_y,
-                               #model="../models/cnn_dataset_1.h5")
-                               #model="../models/cnn_dataset_evento_2000.h5")
-                               #model="../models/cnn_dataset_230509_plastica_luce.h5")
-                                model="../models/cnn_dataset_230611_allwood_not_board2.h5")
+                               model=app_manager.config.model_path,
+                               backend=app_manager.config.model_backend)
 
-    wrong_moods = board.find_wrong_position()
+    # all the metrics of the board in one pass
+    analysis = board.analyze()
+    wrong_moods = analysis.wrong_moods
     if show_labels:
         cols2 = st.columns(2, )
         with cols2[1]:
@@ -504,10 +525,10 @@ def second_page():
                         "`Emp`: Empty"))
 
             annotated_img = \
-                overlap_matrix_to_picture(img_corrected, board.to_str_matrix())
+                overlap_matrix_to_picture(img_corrected, analysis.labels)
             st.image(annotated_img, caption=_('Labelled Image.'))
         with cols2[0]:
-            st.write(f"{_('Number of wrong moods')}: {np.sum(wrong_moods)}")
+            st.write(f"{_('Number of wrong moods')}: {analysis.n_wrong_moods}")
 
             wrong_image = \
                 overlap_bool_matrix_to_picture(img_corrected, wrong_moods)
@@ -516,7 +537,7 @@ def second_page():
     else:
         #st.markdown(f"Number of wrong moods: {np.sum(wrong_moods)}\n"
                     #f"please flip the coin marked with an `X` to the correct ")
-        st.markdown(f""+_('Number of wrong moods')+f": {np.sum(wrong_moods)}\n")
+        st.markdown(f""+_('Number of wrong moods')+f": {analysis.n_wrong_moods}\n")
         st.markdown(_('please flip the coin marked with an `X` to reach a correct state'))
 
         wrong_image = \
@@ -539,9 +560,9 @@ def second_page():
 
         number_string = _("I counted {number} agents in the board")
         st.markdown(
-            "\n\n\n" + number_string.format(number=board.count_agents_teams()))
+            "\n\n\n" + number_string.format(number=analysis.counts))
 
-        happiness = board.happyness()
+        happiness = analysis.happiness
         happyness_string ="\n\n\n" + _("The happyness is:")+"\n"
         for t,v in happiness.items():
             aux_happyness_string =_("\n   {t}: {v:.1%}\n")
@@ -549,7 +570,7 @@ def second_page():
 
         st.markdown(happyness_string)
 
-        segregation = board.segregation()
+        segregation = analysis.segregation
         if segregation >= 0:
             segregation_string=_("The segregation index is:")
             st.markdown(segregation_string + f"\n   {segregation:.1%}")
@@ -565,8 +586,9 @@ def second_page():
                          img_box = img_metadata.img_box,
                          segregation=segregation,
                          happiness=happiness,
-                         board_status_str=np.array2string(board.to_str_matrix(),
-                                                          separator=","),
+                         board_codes=analysis.codes,
+                         code_labels=analysis.code_labels,
+                         board_packed=encode_board(board),
                               )
 
 
@@ -232,6 +232,16 @@ def game_page():
             _(' Timer'))  # Placeholder: Should show time left for corresponding board.
         col4.text(
            [gp.game.game_dynamics.name for gp in board.games_per_board])  # Placeholder: Should show time left for corresponding board.
+        open_game = mm.get_open_game(board)
+        if open_game is not None:
+            try:
+                moves = mm.move_counts(open_game)
+            except ValueError as e:
+                logger.warning(f"board {board.name}: {e}")
+            else:
+                if moves.size > 0:
+                    col3.text(_('Moves') + f": {moves[-1]} "
+                              f"({moves.sum()} " + _('total') + ")")
 
     print(mm.extract_current_timeseries())
 
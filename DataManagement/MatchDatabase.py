@@ -21,7 +21,8 @@ The ORM uses sqlalchemy."""
 import datetime, uuid
 
 from sqlalchemy import create_engine, Column, Integer, String, ForeignKey, \
-    DateTime, Float, event, UniqueConstraint, Text
+    DateTime, Float, event, UniqueConstraint, Text, LargeBinary, inspect, \
+    text
 from sqlalchemy.orm import relationship, backref, validates, Session
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.sql import func
@@ -215,6 +216,8 @@ class Picture(Base):
     picture_segregation = Column(Float, nullable=True)
     picture_happiness_per_team = Column(String, nullable=True)
     picture_table_status = Column(String, nullable=True)
+    # the board in the packed binary format of SchellingModel.BoardEncoding
+    picture_board_packed = Column(LargeBinary, nullable=True)
 
     # each picture can be part of a game per board
     game_per_board_id = Column(Integer, ForeignKey('game_per_board.id'),
@@ -222,6 +225,25 @@ class Picture(Base):
     game_per_board = relationship('GamePerBoard', back_populates='pictures')
 
 
+def upgrade_picture_table(db_engine):
+    """ add the columns introduced after the creation of the database
+
+    create_all does not alter existing tables, so databases created before
+    the packed board column need it to be added by hand. A database without
+    the table is left to create_all.
+    """
+    inspector = inspect(db_engine)
+    if not inspector.has_table(Picture.__tablename__):
+        return
+    columns = [c["name"] for c in
+               inspector.get_columns(Picture.__tablename__)]
+    if "picture_board_packed" not in columns:
+        packed_type = LargeBinary().compile(dialect=db_engine.dialect)
+        with db_engine.begin() as connection:
+            connection.execute(text(
+                f"ALTER TABLE {Picture.__tablename__} "
+                f"ADD COLUMN picture_board_packed {packed_type}"))
+
 
 # if __name__ == '__main__':
 #     import click
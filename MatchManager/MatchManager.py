@@ -4,11 +4,15 @@ of matches and games.
 from typing import List
 from loguru import logger
 import datetime
+import sys
+import numpy as np
 
 from sqlalchemy.orm import sessionmaker
 
 from DataManagement.MatchDatabase import Match, Game, Board, SGdynamics
 from DataManagement.MatchDatabase import GamePerBoard, Picture
+from SchellingModel.BoardEncoding import board_str_to_packed, decode_boards
+from SchellingModel.BoardBatch import BoardBatch
 
 
 class MatchManager:
@@ -182,8 +186,23 @@ class MatchManager:
                       img_box,
                       segregation,
                       happiness,
-                      board_status_str=""):
-        """ save the image in the database """
+                      board_status_str="",
+                      board_codes=None,
+                      code_labels=None,
+                      board_packed=None):
+        """ save the image in the database
+
+        The board status can be given either as a string, or as a matrix of
+        cell codes together with the label of each code (see
+        SchellingBoard.to_codes and SchellingBoard.code_labels).
+        board_packed is the board serialized by BoardEncoding.encode_board.
+        """
+        if board_codes is not None:
+            # threshold avoids numpy summarizing large boards with "..."
+            board_status_str = np.array2string(
+                np.asarray(code_labels)[board_codes], separator=",",
+                threshold=sys.maxsize)
+
         board = self.get_board(board_name)
         game = self.get_open_game(board)
 
@@ -197,12 +216,107 @@ class MatchManager:
                         picture_segregation=segregation,
                         picture_happiness_per_team=str(happiness),
                         picture_table_status=board_status_str,
+                        picture_board_packed=board_packed,
                         )
         game.pictures.append(pic)
         #self.db_session.add(pic)
         self.db_session.commit()
 
 
+    def pack_board_status(self, team_names=["B", "R"],
+                          mood_map={"H": 1, "S": -1},
+                          commit_every=500) -> int:
+        """ fill the packed board of the pictures stored only as text
+
+        Boards whose text was summarized by numpy ("...") can not be
+        recovered and are skipped, as well as the malformed ones.
+
+        Args:
+            commit_every: number of conversions committed at once, so that
+                          a failure does not lose the previous ones
+
+        Returns:
+            int: the number of converted pictures
+        """
+        pictures = self.db_session.query(Picture). \
+            filter(Picture.picture_board_packed.is_(None)). \
+            filter(Picture.picture_table_status.isnot(None)). \
+            all()
+
+        n_converted = 0
+        for pic in pictures:
+            if not pic.picture_table_status:
+                continue
+            try:
+                packed = board_str_to_packed(pic.picture_table_status,
+                                             team_names, mood_map)
+            except ValueError as e:
+                logger.warning(f"picture {pic.picture_id} has a malformed "
+                               f"board, it can not be converted: {e}")
+                continue
+            if packed is None:
+                logger.warning(f"picture {pic.picture_id} has a summarized "
+                               f"board, it can not be converted")
+                continue
+            pic.picture_board_packed = packed
+            n_converted += 1
+            if n_converted % commit_every == 0:
+                self.db_session.commit()
+
+        self.db_session.commit()
+        logger.info(f"{n_converted} boards converted to the packed format")
+        return n_converted
+
+    @staticmethod
+    def _sorted_pictures(game_per_board):
+        return sorted(game_per_board.pictures,
+                      key=lambda pic: pic.picture_upload_time or
+                      datetime.datetime.min)
+
+    def board_batch(self, game_per_board, **kwargs) -> BoardBatch:
+        """ return the packed boards of the pictures of a game as a batch
+
+        The pictures without a packed board are left out.
+
+        Args:
+            game_per_board: GamePerBoard object
+            **kwargs: passed to BoardEncoding.decode_boards
+
+        Returns:
+            BoardBatch object or None if no picture has a packed board
+        """
+        blobs = [pic.picture_board_packed
+                 for pic in self._sorted_pictures(game_per_board)
+                 if pic.picture_board_packed is not None]
+        if len(blobs) == 0:
+            return None
+        return decode_boards(blobs, **kwargs)
+
+    def move_counts(self, game_per_board) -> np.ndarray:
+        """ return the number of moves between consecutive pictures of a game
+
+        A picture without a packed board breaks the sequence: the moves
+        across it are not counted.
+
+        Returns:
+            np.ndarray: one entry per pair of consecutive pictures that both
+                        have a packed board
+        """
+        batch = self.board_batch(game_per_board)
+        if batch is None or len(batch) < 2:
+            return np.zeros(0, dtype=np.int_)
+
+        # the places of the packed boards among all the pictures
+        packed = np.flatnonzero([
+            pic.picture_board_packed is not None
+            for pic in self._sorted_pictures(game_per_board)])
+        consecutive = np.diff(packed) == 1
+        if not consecutive.all():
+            logger.warning(f"{np.count_nonzero(~consecutive)} pairs of "
+                           f"pictures are not consecutive, their moves are "
+                           f"not counted")
+        return batch.diff().total_moves[consecutive]
+
     def extract_current_timeseries(self):
         """ extract the current timeseries from the database
 
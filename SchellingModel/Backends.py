@@ -0,0 +1,293 @@
+# Copyright (C) 2022-present Associació Heuristica <info@heuristica.barcelona>
+#                      and   Dimitri Marinelli <dimi.marin@proton.me>
+#
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# A copy of the GNU Affero General Public License is in the LICENSE file
+# in the source code repository.
+
+""" Compute backends of the board kernels
+
+SchellingBoard and BoardBatch never call the kernels directly, they ask
+get_backend() for them. The backends are:
+
+    numpy   the array kernels of SchellingModel.Kernels
+    numba   the same kernels as compiled loops, one pass over the board
+            without temporary arrays. Used only if numba is installed.
+    tiled   the numpy kernels on tiles of large boards, in a pool of
+            processes, see SchellingModel.Tiling. Never selected by default.
+
+The backend is chosen the first time it is needed: the SCHELLING_BACKEND
+environment variable if set, otherwise numba when installed and numpy
+otherwise. set_backend changes it at runtime.
+"""
+import os
+
+import numpy as np
+from loguru import logger
+
+from typing import Dict, Union, Sequence
+import numpy.typing as npt
+
+from SchellingModel import Kernels
+from SchellingModel.Kernels import MOORE_KERNEL, BOUNDARIES, \
+    THRESHOLD_TOLERANCE
+from SchellingModel.Tiling import TiledBackend
+from SchellingModel.HappinessRules import is_rule
+
+try:
+    import numba
+except ImportError:
+    numba = None
+
+
+class NumpyBackend:
+    """ The kernels of SchellingModel.Kernels """
+    name = "numpy"
+
+    def neighbour_counts(self, masks: npt.ArrayLike,
+                         kernel: npt.ArrayLike = MOORE_KERNEL,
+                         boundary: str = "constant") -> np.ndarray:
+        return Kernels.neighbour_counts(masks, kernel, boundary)
+
+    def happy_mask(self, neighbours: npt.ArrayLike,
+                   team_index: npt.ArrayLike,
+                   threshold: Union[float, Sequence[float]] = 0.5
+                   ) -> np.ndarray:
+        return Kernels.happy_mask(neighbours, team_index, threshold)
+
+    def link_counts(self, teams: npt.ArrayLike, empty_value: int = 0,
+                    occupied: npt.ArrayLike = None,
+                    kernel: npt.ArrayLike = MOORE_KERNEL,
+                    boundary: str = "constant"):
+        return Kernels.link_counts(teams, empty_value, occupied, kernel,
+                                   boundary)
+
+    def close(self):
+        pass
+
+
+def _jit(func):
+    """Compile func with numba, or leave it as plain Python without numba"""
+    if numba is None:
+        return func
+    return numba.njit(parallel=True, cache=True)(func)
+
+
+prange = numba.prange if numba is not None else range
+
+
+@_jit
+def _neighbour_counts_loop(masks, kernel, wrap, out):
+    n_boards, height, width = masks.shape
+    k_height, k_width = kernel.shape
+    r_y, r_x = k_height // 2, k_width // 2
+    for row in prange(n_boards * height):
+        b = row // height
+        y = row % height
+        for x in range(width):
+            total = 0
+            for i in range(k_height):
+                # a convolution flips the kernel
+                yy = y + r_y - i
+                if wrap:
+                    yy = yy % height
+                elif yy < 0 or yy >= height:
+                    continue
+                for j in range(k_width):
+                    if kernel[i, j] == 0:
+                        continue
+                    xx = x + r_x - j
+                    if wrap:
+                        xx = xx % width
+                    elif xx < 0 or xx >= width:
+                        continue
+                    if masks[b, yy, xx]:
+                        total += int(kernel[i, j])
+            out[b, y, x] = total
+
+
+@_jit
+def _happy_mask_loop(neighbours, team_index, thresholds, exact, out):
+    n_boards, n_teams, height, width = neighbours.shape
+    for row in prange(n_boards * height):
+        b = row // height
+        y = row % height
+        for x in range(width):
+            team = team_index[b, y, x]
+            if team == 0:
+                out[b, y, x] = False
+                continue
+            total = 0
+            for t in range(n_teams):
+                total += int(neighbours[b, t, y, x])
+            mine = int(neighbours[b, team - 1, y, x])
+            if exact:
+                out[b, y, x] = mine >= total - mine
+            else:
+                out[b, y, x] = mine >= thresholds[team - 1] * total - \
+                    THRESHOLD_TOLERANCE
+
+
+@_jit
+def _link_counts_loop(teams, occupied, offsets, wrap, links, mixed_links):
+    # links and mixed_links are (n_boards, height), one entry per row so
+    # that the parallel rows never write to the same place
+    n_boards, height, width = teams.shape
+    for row in prange(n_boards * height):
+        b = row // height
+        y = row % height
+        for x in range(width):
+            if not occupied[b, y, x]:
+                continue
+            for k in range(offsets.shape[0]):
+                yy = y + offsets[k, 0]
+                xx = x + offsets[k, 1]
+                if wrap:
+                    yy = yy % height
+                    xx = xx % width
+                elif yy < 0 or yy >= height or xx < 0 or xx >= width:
+                    continue
+                if occupied[b, yy, xx]:
+                    links[b, y] += 1
+                    if teams[b, yy, xx] != teams[b, y, x]:
+                        mixed_links[b, y] += 1
+
+
+class NumbaBackend(NumpyBackend):
+    """ The kernels as loops compiled by numba
+
+    Without numba the loops run as plain Python, which is correct but very
+    slow; get_backend never selects this backend in that case.
+    """
+    name = "numba"
+
+    def neighbour_counts(self, masks: npt.ArrayLike,
+                         kernel: npt.ArrayLike = MOORE_KERNEL,
+                         boundary: str = "constant") -> np.ndarray:
+        _check_boundary(boundary)
+        masks = np.asarray(masks, dtype=bool)
+        kernel = np.ascontiguousarray(kernel, dtype=np.int64)
+        dtype = np.min_scalar_type(max(int(kernel.sum()), 1))
+
+        stack = np.ascontiguousarray(masks.reshape((-1,) + masks.shape[-2:]))
+        counts = np.empty(stack.shape, dtype=dtype)
+        _neighbour_counts_loop(stack, kernel, boundary == "wrap", counts)
+        return counts.reshape(masks.shape)
+
+    def happy_mask(self, neighbours: npt.ArrayLike,
+                   team_index: npt.ArrayLike,
+                   threshold: Union[float, Sequence[float]] = 0.5
+                   ) -> np.ndarray:
+        if is_rule(threshold):
+            # a rule is already a single gather
+            return Kernels.happy_mask(neighbours, team_index, threshold)
+
+        neighbours = np.asarray(neighbours)
+        team_index = np.asarray(team_index)
+        n_teams = neighbours.shape[-3]
+
+        thresholds = np.broadcast_to(np.asarray(threshold, dtype=float),
+                                     (n_teams,)).copy()
+        exact = bool(np.all(thresholds == 0.5))
+
+        stack = np.ascontiguousarray(
+            neighbours.reshape((-1,) + neighbours.shape[-3:]))
+        team_stack = np.ascontiguousarray(
+            team_index.reshape((-1,) + team_index.shape[-2:]),
+            dtype=np.int64)
+        happy = np.empty(team_stack.shape, dtype=bool)
+        _happy_mask_loop(stack, team_stack, thresholds, exact, happy)
+        return happy.reshape(team_index.shape)
+
+    def link_counts(self, teams: npt.ArrayLike, empty_value: int = 0,
+                    occupied: npt.ArrayLike = None,
+                    kernel: npt.ArrayLike = MOORE_KERNEL,
+                    boundary: str = "constant"):
+        _check_boundary(boundary)
+        teams = np.asarray(teams)
+        if occupied is None:
+            occupied = teams != empty_value
+
+        offsets = np.array(Kernels._half_kernel_offsets(np.asarray(kernel)),
+                           dtype=np.int64).reshape(-1, 2)
+
+        team_stack = np.ascontiguousarray(
+            teams.reshape((-1,) + teams.shape[-2:]))
+        occupied_stack = np.ascontiguousarray(
+            np.asarray(occupied).reshape(team_stack.shape))
+        links = np.zeros(team_stack.shape[:2], dtype=np.int64)
+        mixed_links = np.zeros(team_stack.shape[:2], dtype=np.int64)
+        _link_counts_loop(team_stack, occupied_stack, offsets,
+                          boundary == "wrap", links, mixed_links)
+
+        links = links.sum(axis=1).reshape(teams.shape[:-2])
+        mixed_links = mixed_links.sum(axis=1).reshape(teams.shape[:-2])
+        if teams.ndim == 2:
+            return int(links), int(mixed_links)
+        return links, mixed_links
+
+
+def _check_boundary(boundary):
+    if boundary not in BOUNDARIES:
+        raise ValueError(f"boundary should be one of {BOUNDARIES}")
+
+
+BACKENDS = {"numpy": NumpyBackend, "numba": NumbaBackend,
+            "tiled": TiledBackend}
+
+_backend = None
+
+
+def available_backends() -> Dict[str, type]:
+    """Return the backends that can run in this environment"""
+    return {name: backend for name, backend in BACKENDS.items()
+            if name != "numba" or numba is not None}
+
+
+def set_backend(name: str = "auto", **options) -> NumpyBackend:
+    """Select the backend used by all the boards
+
+    Args:
+        name (str, optional): "numpy", "numba", "tiled" or "auto", the
+                                fastest of numpy and numba. Defaults to
+                                "auto".
+        **options: passed to the backend, e.g. n_workers and tile_size of
+                    the tiled backend.
+
+    Returns:
+        the selected backend
+    """
+    global _backend
+
+    available = available_backends()
+    if name == "auto":
+        name = "numba" if "numba" in available else "numpy"
+    if name not in BACKENDS:
+        raise ValueError(f"unknown backend {name}, use one of "
+                         f"{list(BACKENDS)} or auto")
+    if name not in available:
+        raise ImportError(f"the {name} backend is not available, "
+                          f"is {name} installed?")
+
+    if _backend is not None:
+        _backend.close()
+    _backend = available[name](**options)
+    logger.debug(f"using the {name} backend")
+    return _backend
+
+
+def get_backend() -> NumpyBackend:
+    """Return the current backend, selecting it the first time"""
+    if _backend is None:
+        return set_backend(os.environ.get("SCHELLING_BACKEND", "auto"))
+    return _backend
@@ -0,0 +1,253 @@
+# Copyright (C) 2022-present Associació Heuristica <info@heuristica.barcelona>
+#                      and   Dimitri Marinelli <dimi.marin@proton.me>
+#
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# A copy of the GNU Affero General Public License is in the LICENSE file
+# in the source code repository.
+
+""" Analysis of many boards of the same shape at once
+
+A BoardBatch stacks N boards into (N, H, W) arrays, e.g. all the pictures
+of a match, and computes the metrics of SchellingBoard for all of them with
+batched convolutions and reductions.
+"""
+import numpy as np
+
+from typing import List, Dict, Sequence, Union
+import numpy.typing as npt
+
+from SchellingModel.SchellingGame import SchellingBoard, BoardDiff, \
+    diff_boards
+from SchellingModel.Kernels import BOUNDARIES, team_masks, \
+    neighbourhood_kernel
+from SchellingModel.Backends import get_backend
+
+
+class BoardBatch:
+    def __init__(self,
+                 teams: npt.ArrayLike,
+                 moods: npt.ArrayLike = None,
+                 team_names: List = ["B", "R"],
+                 mood_map: Dict = {"H": 1, "S": -1},
+                 empty_value: int = 0,
+                 threshold: Union[float, Sequence[float]] = 0.5,
+                 boundary: str = "constant",
+                 neighbourhood: str = "moore",
+                 radius: int = 1,
+                 ) -> None:
+        """ A stack of boards of the Schelling game
+
+        Args:
+            teams (npt.ArrayLike): a 3D array (N, H, W) of teams, teams are
+                                    represented by integer numbers. 0 is empty
+            moods (npt.ArrayLike, optional): a 3D array (N, H, W) of moods.
+            team_names (List, optional): A list representing the team names.
+                                            Defaults to ["B", "R"].
+            mood_map (Dict, optional): The mapping between the status of each
+                    agent and an integer value. Defaults to {"H": 1, "S": -1}.
+            empty_value (int, optional): the integer representing an empty
+                                            cell. Defaults to 0.
+            threshold (float or Sequence[float], optional): minimum fraction
+                    of neighbours of the same team to be happy, as in
+                    SchellingBoard. Defaults to 0.5.
+            boundary (str, optional): "constant" or "wrap", as in
+                    SchellingBoard. Defaults to "constant".
+            neighbourhood (str, optional): "moore" or "von_neumann".
+            radius (int, optional): radius of the neighbourhood.
+        """
+        teams = np.asarray(teams)
+        if teams.ndim != 3:
+            raise ValueError("teams should be a 3D array (N, H, W)")
+
+        if moods is not None:
+            moods = np.asarray(moods)
+            assert teams.shape == moods.shape, \
+                "teams and moods should have the same shape"
+
+        self.teams = teams
+        self.moods = moods
+        self.team_names = team_names
+        self.mood_map = mood_map
+        self.empty_value = empty_value
+        self.threshold = threshold
+
+        if boundary not in BOUNDARIES:
+            raise ValueError(f"boundary should be one of {BOUNDARIES}")
+        self.boundary = boundary
+        self.neighbourhood = neighbourhood
+        self.radius = radius
+        self.kernel = neighbourhood_kernel(neighbourhood, radius)
+
+    @property
+    def teams(self) -> np.ndarray:
+        return self._teams
+
+    @teams.setter
+    def teams(self, teams: npt.ArrayLike):
+        # everything cached depends on the teams only
+        self._teams = teams
+        self._neighbours_cache = None
+        self._team_index_cache = None
+        self._happy_cache = None
+
+    @property
+    def threshold(self):
+        return self._threshold
+
+    @threshold.setter
+    def threshold(self, threshold: Union[float, Sequence[float]]):
+        if np.ndim(threshold) > 0 and len(threshold) != self.n_teams:
+            raise ValueError("threshold should have one value per team")
+        # only the happy cells depend on the threshold
+        self._threshold = threshold
+        self._happy_cache = None
+
+    @classmethod
+    def from_boards(cls, boards: Sequence[SchellingBoard]) -> "BoardBatch":
+        """Stack boards with the same shape, teams and moods definitions"""
+        if len(boards) == 0:
+            raise ValueError("at least one board is needed")
+
+        first = boards[0]
+        teams = np.stack([board.teams for board in boards])
+        if all(board.moods is not None for board in boards):
+            moods = np.stack([board.moods for board in boards])
+        else:
+            moods = None
+
+        return cls(teams, moods,
+                   team_names=first.team_names,
+                   mood_map=first.mood_map,
+                   empty_value=first.empty_value,
+                   threshold=first.threshold,
+                   **first.neighbourhood_kwargs())
+
+    def __len__(self) -> int:
+        return self.teams.shape[0]
+
+    def __getitem__(self, ix: int) -> SchellingBoard:
+        return SchellingBoard(
+            teams=self.teams[ix],
+            moods=self.moods[ix] if self.moods is not None else None,
+            team_names=self.team_names,
+            mood_map=self.mood_map,
+            empty_value=self.empty_value,
+            threshold=self.threshold,
+            boundary=self.boundary,
+            neighbourhood=self.neighbourhood,
+            radius=self.radius)
+
+    @property
+    def n_teams(self) -> int:
+        return len(self.team_names)
+
+    def team_index(self) -> np.ndarray:
+        """Return the teams where anything that is not a team is 0"""
+        if self._team_index_cache is None:
+            valid = (self.teams >= 1) & (self.teams <= self.n_teams)
+            self._team_index_cache = np.where(valid, self.teams, 0)
+
+        return self._team_index_cache
+
+    def neighbours_tensor(self, use_cache=True) -> np.ndarray:
+        """Return the neighbour counts of shape (N, n_teams, H, W)"""
+        return self._neighbour_counts(use_cache).astype(np.int_)
+
+    def _neighbour_counts(self, use_cache=True) -> np.ndarray:
+        """The counts of neighbours_tensor in the small unsigned dtype of
+        the kernels, the cached array itself"""
+        if use_cache and self._neighbours_cache is not None:
+            return self._neighbours_cache
+
+        neighbours = get_backend().neighbour_counts(
+            team_masks(self.teams, self.n_teams),
+            self.kernel, self.boundary)
+
+        if use_cache:
+            self._neighbours_cache = neighbours
+
+        return neighbours
+
+    def model_happy_mask(self) -> np.ndarray:
+        """Return a (N, H, W) boolean array, True where the agent is happy"""
+        if self._happy_cache is None:
+            self._happy_cache = get_backend().happy_mask(
+                self._neighbour_counts(),
+                self.team_index(),
+                self.threshold)
+
+        return self._happy_cache
+
+    def count_agents_teams(self) -> Dict[str, np.ndarray]:
+        """Return the number of agents of each team in every board"""
+        team_index = self.team_index()
+        count = {team: np.count_nonzero(team_index == ix, axis=(1, 2))
+                 for ix, team in enumerate(self.team_names, start=1)}
+        count["Empty"] = np.count_nonzero(self.teams == self.empty_value,
+                                          axis=(1, 2))
+        return count
+
+    def happyness(self) -> Dict[str, np.ndarray]:
+        """Return the fraction of happy agents of each team in every board
+
+        As in SchellingBoard.happyness, the value is -1 for the boards where
+        a team (or the whole board) has no agents.
+        """
+        team_index = self.team_index()
+        happy_cells = self.model_happy_mask()
+
+        happiness = {}
+        for ix, team in enumerate(self.team_names, start=1):
+            team_positions = team_index == ix
+            happiness[team] = _ratio(
+                np.count_nonzero(team_positions & happy_cells, axis=(1, 2)),
+                np.count_nonzero(team_positions, axis=(1, 2)))
+
+        happiness["total"] = _ratio(
+            np.count_nonzero(happy_cells, axis=(1, 2)),
+            np.count_nonzero(self.teams != self.empty_value, axis=(1, 2)))
+
+        return happiness
+
+    def segregation(self) -> np.ndarray:
+        """Return the segregation of every board, -1 where not defined"""
+        links, mixed_links = get_backend().link_counts(
+            self.teams, self.empty_value,
+            kernel=self.kernel,
+            boundary=self.boundary)
+        return np.where(links > 0,
+                        1 - mixed_links / np.maximum(links, 1),
+                        -1)
+
+    def find_wrong_position(self) -> np.ndarray:
+        """Return a (N, H, W) boolean array of the agents with a wrong mood"""
+        happy_cells = self.model_happy_mask()
+        wrong_mood = ((self.moods == self.mood_map["H"]) & ~happy_cells) | \
+                     ((self.moods == self.mood_map["S"]) & happy_cells)
+
+        return wrong_mood & (self.team_index() > 0)
+
+    def count_wrong_moods(self) -> np.ndarray:
+        """Return the number of agents with a wrong mood in every board"""
+        return np.count_nonzero(self.find_wrong_position(), axis=(1, 2))
+
+    def diff(self) -> BoardDiff:
+        """Return what changed between consecutive boards, see diff_boards"""
+        return diff_boards(self.teams, self.moods, self.team_names,
+                           self.empty_value)
+
+
+def _ratio(numerator, denominator):
+    return np.where(denominator > 0,
+                    numerator / np.maximum(denominator, 1),
+                    -1)
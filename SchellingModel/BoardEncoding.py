@@ -0,0 +1,237 @@
+# Copyright (C) 2022-present Associació Heuristica <info@heuristica.barcelona>
+#                      and   Dimitri Marinelli <dimi.marin@proton.me>
+#
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# A copy of the GNU Affero General Public License is in the LICENSE file
+# in the source code repository.
+
+""" Binary serialization of boards
+
+A board is stored as a small header followed by its cell codes (see
+SchellingModel.SchellingGame.cell_code_lut) packed with the minimum number
+of bits per cell, e.g. 3 bits for 2 teams with 2 moods.
+
+The header is, in big endian order:
+    magic (2 bytes) "SB"
+    version (uint8)
+    bits per cell (uint8)
+    height, width (uint16 each)
+    number of teams, number of moods (uint8 each)
+
+The packed cells are padded with zeros to a whole number of bytes.
+"""
+import re
+import struct
+
+import numpy as np
+
+from typing import Dict, List, Sequence, Tuple
+import numpy.typing as npt
+
+from SchellingModel.SchellingGame import SchellingBoard, cell_code_lut, \
+    decode_cell_codes, default_team_names
+from SchellingModel.BoardBatch import BoardBatch
+
+
+FORMAT_MAGIC = b"SB"
+FORMAT_VERSION = 1
+HEADER = struct.Struct(">2sBBHHBB")
+
+
+def bits_per_cell(n_teams: int, n_moods: int) -> int:
+    """Return the number of bits needed to store a cell code"""
+    n_codes = 1 + n_teams * (n_moods + 1)
+    return max(1, int(n_codes - 1).bit_length())
+
+
+def pack_codes(codes: npt.ArrayLike, n_teams: int, n_moods: int) -> bytes:
+    """Serialize a 2D matrix of cell codes
+
+    Args:
+        codes (npt.ArrayLike): a 2D array of cell codes.
+        n_teams (int): the number of teams of the board.
+        n_moods (int): the number of moods of the board.
+
+    Returns:
+        bytes: the header followed by the packed codes
+    """
+    codes = np.asarray(codes)
+    if codes.ndim != 2:
+        raise ValueError("codes should be a 2D array")
+
+    n_bits = bits_per_cell(n_teams, n_moods)
+    header = HEADER.pack(FORMAT_MAGIC, FORMAT_VERSION, n_bits,
+                         codes.shape[0], codes.shape[1], n_teams, n_moods)
+
+    # one row of n_bits bits per cell, most significant bit first
+    shifts = np.arange(n_bits - 1, -1, -1, dtype=np.uint8)
+    bits = (codes.astype(np.uint8).reshape(-1, 1) >> shifts) & 1
+
+    return header + np.packbits(bits).tobytes()
+
+
+def read_header(data: bytes) -> Tuple[int, int, int, int, int]:
+    """Return (bits per cell, height, width, n_teams, n_moods) of a blob"""
+    if len(data) < HEADER.size:
+        raise ValueError("the data is too short to contain a board")
+
+    magic, version, n_bits, height, width, n_teams, n_moods = \
+        HEADER.unpack_from(data)
+    if magic != FORMAT_MAGIC:
+        raise ValueError("the data is not a packed board")
+    if version != FORMAT_VERSION:
+        raise ValueError(f"unsupported board format version {version}")
+
+    return n_bits, height, width, n_teams, n_moods
+
+
+def unpack_codes(data: bytes) -> Tuple[np.ndarray, int, int]:
+    """Deserialize the cell codes written by pack_codes
+
+    Returns:
+        tuple: (codes, n_teams, n_moods), codes is a 2D int8 array
+    """
+    codes, n_teams, n_moods = unpack_codes_batch([data])
+    return codes[0], n_teams, n_moods
+
+
+def unpack_codes_batch(blobs: Sequence[bytes]) -> Tuple[np.ndarray, int, int]:
+    """Deserialize many boards with the same header at once
+
+    All the payloads are unpacked with a single call to np.unpackbits, so
+    thousands of boards take a few milliseconds.
+
+    Returns:
+        tuple: (codes, n_teams, n_moods), codes is a 3D int8 array (N, H, W)
+    """
+    if len(blobs) == 0:
+        raise ValueError("at least one board is needed")
+
+    header = blobs[0][:HEADER.size]
+    if any(blob[:HEADER.size] != header for blob in blobs):
+        raise ValueError("all the boards should have the same shape, "
+                         "teams and moods")
+    n_bits, height, width, n_teams, n_moods = read_header(header)
+
+    n_cells = height * width
+    n_bytes = (n_cells * n_bits + 7) // 8
+    if any(len(blob) != HEADER.size + n_bytes for blob in blobs):
+        raise ValueError("the size of the data does not match its header")
+
+    payload = np.frombuffer(b"".join(blob[HEADER.size:] for blob in blobs),
+                            dtype=np.uint8).reshape(len(blobs), n_bytes)
+    bits = np.unpackbits(payload, axis=1, count=n_cells * n_bits)
+
+    weights = (1 << np.arange(n_bits - 1, -1, -1)).astype(np.uint8)
+    codes = bits.reshape(len(blobs), n_cells, n_bits) @ weights
+
+    if codes.max(initial=0) > cell_code_lut(n_teams, n_moods).max():
+        raise ValueError("the data contains invalid cell codes")
+
+    return (codes.astype(np.int8).reshape(len(blobs), height, width),
+            n_teams, n_moods)
+
+
+def encode_board(board: SchellingBoard) -> bytes:
+    """Serialize a board, see pack_codes"""
+    return pack_codes(board.to_codes(), board.n_teams, len(board.mood_map))
+
+
+def decode_board(data: bytes,
+                 team_names: List = None,
+                 mood_map: Dict = {"H": 1, "S": -1},
+                 **kwargs) -> SchellingBoard:
+    """Build a board from the data written by encode_board
+
+    Args:
+        data (bytes): the serialized board.
+        team_names (List, optional): Defaults to default_team_names.
+        mood_map (Dict, optional): Defaults to {"H": 1, "S": -1}.
+        **kwargs: passed to SchellingBoard.
+    """
+    codes, n_teams, n_moods = unpack_codes(data)
+    team_names = _check_names(team_names, mood_map, n_teams, n_moods)
+    return SchellingBoard.from_codes(codes, team_names=team_names,
+                                     mood_map=mood_map, **kwargs)
+
+
+def decode_boards(blobs: Sequence[bytes],
+                  team_names: List = None,
+                  mood_map: Dict = {"H": 1, "S": -1},
+                  **kwargs) -> BoardBatch:
+    """Build a BoardBatch from many boards written by encode_board
+
+    Args:
+        blobs (Sequence[bytes]): boards with the same shape, teams and moods.
+        team_names (List, optional): Defaults to default_team_names.
+        mood_map (Dict, optional): Defaults to {"H": 1, "S": -1}.
+        **kwargs: passed to BoardBatch.
+    """
+    codes, n_teams, n_moods = unpack_codes_batch(blobs)
+    team_names = _check_names(team_names, mood_map, n_teams, n_moods)
+    teams, moods = decode_cell_codes(codes, n_teams, list(mood_map.values()),
+                                     kwargs.get("empty_value", 0))
+    return BoardBatch(teams, moods, team_names=team_names, mood_map=mood_map,
+                      **kwargs)
+
+
+def parse_board_str(board_str: str,
+                    team_names: List = ["B", "R"],
+                    mood_map: Dict = {"H": 1, "S": -1}) -> np.ndarray:
+    """Return the cell codes of a board stored as text
+
+    The text is the output of np.array2string(board.to_str_matrix(),
+    separator=","), as stored in the database before the packed format.
+
+    Returns:
+        np.ndarray: a 2D array of cell codes, or None when the text was
+                        summarized by numpy ("...") and the board is lost.
+    """
+    if "..." in board_str:
+        return None
+
+    labels = re.findall(r"'([^']*)'", board_str)
+    n_rows = board_str.count("[") - 1
+    if n_rows <= 0 or len(labels) % n_rows != 0:
+        raise ValueError("the text is not a 2D board")
+
+    # a board with all the teams, so that SchellingBoard does not complain
+    template = SchellingBoard(
+        teams=np.arange(len(team_names) + 1).reshape(1, -1),
+        team_names=team_names,
+        mood_map=mood_map)
+
+    return template.labels_to_codes(np.array(labels).reshape(n_rows, -1))
+
+
+def board_str_to_packed(board_str: str,
+                        team_names: List = ["B", "R"],
+                        mood_map: Dict = {"H": 1, "S": -1}) -> bytes:
+    """Convert a board stored as text into the packed format
+
+    Returns:
+        bytes: the packed board, None if the text is not a complete board
+    """
+    codes = parse_board_str(board_str, team_names, mood_map)
+    if codes is None:
+        return None
+    return pack_codes(codes, len(team_names), len(mood_map))
+
+
+def _check_names(team_names, mood_map, n_teams, n_moods):
+    if team_names is None:
+        team_names = default_team_names(n_teams)
+    if len(team_names) != n_teams or len(mood_map) != n_moods:
+        raise ValueError(f"the board has {n_teams} teams and {n_moods} "
+                         f"moods, which do not match team_names and mood_map")
+    return team_names
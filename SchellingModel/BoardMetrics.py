@@ -0,0 +1,330 @@
+# Copyright (C) 2022-present Associació Heuristica <info@heuristica.barcelona>
+#                      and   Dimitri Marinelli <dimi.marin@proton.me>
+#
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# A copy of the GNU Affero General Public License is in the LICENSE file
+# in the source code repository.
+
+""" Spatial statistics of boards beyond happiness and segregation
+
+Every function takes the teams of a single board (H, W) or of a stack of
+boards (N, H, W), e.g. all the pictures of a match, and returns one value
+(or one value per team) for each board. The clusters of all the boards are
+labelled in a single call of scipy.ndimage.label, with a structure that does
+not connect different boards.
+"""
+import numpy as np
+
+from dataclasses import dataclass
+from typing import Union
+import numpy.typing as npt
+
+from scipy import ndimage
+from scipy.sparse import coo_matrix
+from scipy.sparse.csgraph import connected_components
+
+from SchellingModel.SchellingGame import SchellingBoard
+from SchellingModel.Kernels import MOORE_KERNEL, BOUNDARIES, team_masks, \
+    neighbour_counts
+from SchellingModel.BoardBatch import BoardBatch
+
+
+@dataclass
+class BoardMetrics:
+    """ The spatial statistics of a stack of boards, see board_metrics
+
+    Attributes:
+        cluster_size_distribution (np.ndarray): (N, T, S + 1) the number of
+                    clusters of each size of every team, S is the largest.
+        largest_cluster (np.ndarray): (N, T) size of the largest cluster.
+        n_clusters (np.ndarray): (N, T) number of clusters.
+        interface_length (np.ndarray): (N,) sides shared by agents of
+                    different teams.
+        dissimilarity (np.ndarray): (N,) multigroup dissimilarity index.
+        morans_i (np.ndarray): (N, T) Moran's I of the team indicators,
+                    NaN where not defined.
+    """
+    cluster_size_distribution: np.ndarray
+    largest_cluster: np.ndarray
+    n_clusters: np.ndarray
+    interface_length: np.ndarray
+    dissimilarity: np.ndarray
+    morans_i: np.ndarray
+
+    @property
+    def mean_cluster_size(self) -> np.ndarray:
+        """(N, T) mean size of the clusters, 0 for teams without agents"""
+        sizes = np.arange(self.cluster_size_distribution.shape[-1])
+        agents = (self.cluster_size_distribution * sizes).sum(axis=-1)
+        return agents / np.maximum(self.n_clusters, 1)
+
+
+def board_metrics(board: Union[SchellingBoard, BoardBatch],
+                  connectivity: int = 8,
+                  block_size: int = 3) -> BoardMetrics:
+    """Compute all the metrics of a board or of a batch of boards
+
+    The neighbourhood and the boundary of the board are used for Moran's I,
+    the boundary for the clusters and the interfaces.
+
+    Args:
+        board (SchellingBoard or BoardBatch): the board(s).
+        connectivity (int, optional): 4 or 8, see cluster_labels.
+        block_size (int, optional): side of the blocks of the dissimilarity.
+
+    Returns:
+        BoardMetrics: arrays with a leading axis of size 1 for a single
+                        board.
+    """
+    teams = _as_stack(board.teams)
+    distribution = cluster_size_distribution(teams, board.n_teams,
+                                             connectivity, board.boundary)
+    sizes = np.arange(distribution.shape[-1])
+    largest = np.where(distribution > 0, sizes, 0).max(axis=-1)
+
+    return BoardMetrics(
+        cluster_size_distribution=distribution,
+        largest_cluster=largest,
+        n_clusters=distribution.sum(axis=-1),
+        interface_length=interface_length(teams, board.empty_value,
+                                          board.boundary),
+        dissimilarity=dissimilarity_index(teams, board.n_teams, block_size),
+        morans_i=morans_i(teams, board.n_teams, board.empty_value,
+                          board.kernel, board.boundary))
+
+
+def cluster_labels(mask: npt.ArrayLike, connectivity: int = 8,
+                   boundary: str = "constant"):
+    """Label the connected components of every board of a stack
+
+    Args:
+        mask (npt.ArrayLike): (N, H, W) boolean array.
+        connectivity (int, optional): 4, cells sharing a side, or 8, cells
+                                        sharing a side or a corner.
+        boundary (str, optional): "constant" or "wrap", with "wrap" the
+                                    clusters continue across the edges.
+
+    Returns:
+        tuple: (labels, n_labels), labels is an (N, H, W) integer array, 0
+                outside the mask; no label is shared by two boards
+    """
+    if connectivity not in (4, 8):
+        raise ValueError("connectivity should be 4 or 8")
+    if boundary not in BOUNDARIES:
+        raise ValueError(f"boundary should be one of {BOUNDARIES}")
+
+    # connect the cells of the same board only
+    structure = np.zeros((3, 3, 3), dtype=bool)
+    structure[1] = ndimage.generate_binary_structure(
+        2, 1 if connectivity == 4 else 2)
+    labels, n_labels = ndimage.label(mask, structure=structure)
+
+    if boundary == "wrap" and n_labels > 0:
+        labels, n_labels = _merge_across_edges(labels, n_labels,
+                                               connectivity)
+
+    return labels, n_labels
+
+
+def _merge_across_edges(labels, n_labels, connectivity):
+    """Join the labels of the clusters that touch across the edges"""
+    offsets = [(0, 1), (1, 0)]
+    if connectivity == 8:
+        offsets += [(1, 1), (1, -1)]
+
+    # inside the board neighbouring cells have the same label already, only
+    # the pairs across the edges can differ
+    sources, targets = [], []
+    for dy, dx in offsets:
+        rolled = np.roll(labels, (-dy, -dx), axis=(-2, -1))
+        touching = (labels > 0) & (rolled > 0) & (labels != rolled)
+        sources.append(labels[touching])
+        targets.append(rolled[touching])
+    sources = np.concatenate(sources)
+    targets = np.concatenate(targets)
+
+    graph = coo_matrix((np.ones(sources.size), (sources, targets)),
+                       shape=(n_labels + 1, n_labels + 1))
+    _, components = connected_components(graph, directed=False)
+
+    # the background keeps 0, the clusters are numbered from 1
+    _, new_labels = np.unique(components[1:], return_inverse=True)
+    lut = np.concatenate([[0], new_labels.ravel() + 1])
+    return lut[labels], int(lut.max())
+
+
+def cluster_size_distribution(teams: npt.ArrayLike, n_teams: int,
+                              connectivity: int = 8,
+                              boundary: str = "constant") -> np.ndarray:
+    """Return how many clusters of each size every team has
+
+    A cluster is a connected group of agents of the same team.
+
+    Returns:
+        np.ndarray: (..., n_teams, S + 1) counts, the entry [t, s] is the
+                    number of clusters of s agents of team t + 1
+    """
+    teams = np.asarray(teams)
+    stack = _as_stack(teams)
+    n_boards = stack.shape[0]
+
+    board_of_cell = np.broadcast_to(
+        np.arange(n_boards)[:, np.newaxis, np.newaxis], stack.shape)
+
+    all_boards, all_teams, all_sizes = [], [], []
+    for team in range(n_teams):
+        labels, n_labels = cluster_labels(stack == team + 1, connectivity,
+                                          boundary)
+        if n_labels == 0:
+            continue
+        in_cluster = labels > 0
+        sizes = np.bincount(labels[in_cluster], minlength=n_labels + 1)
+        board_of_label = np.zeros(n_labels + 1, dtype=np.int_)
+        board_of_label[labels[in_cluster]] = board_of_cell[in_cluster]
+
+        all_boards.append(board_of_label[1:])
+        all_teams.append(np.full(n_labels, team))
+        all_sizes.append(sizes[1:])
+
+    if not all_sizes:
+        distribution = np.zeros((n_boards, n_teams, 1), dtype=np.int_)
+    else:
+        sizes = np.concatenate(all_sizes)
+        distribution = np.zeros((n_boards, n_teams, sizes.max() + 1),
+                                dtype=np.int_)
+        np.add.at(distribution,
+                  (np.concatenate(all_boards), np.concatenate(all_teams),
+                   sizes),
+                  1)
+
+    return distribution.reshape(teams.shape[:-2] + distribution.shape[1:])
+
+
+def interface_length(teams: npt.ArrayLike, empty_value: int = 0,
+                     boundary: str = "constant") -> np.ndarray:
+    """Return the number of sides shared by agents of different teams"""
+    teams = np.asarray(teams)
+    occupied = teams != empty_value
+
+    length = 0
+    for axis in (-2, -1):
+        if boundary == "wrap":
+            neighbour = np.roll(teams, -1, axis=axis)
+            neighbour_occupied = np.roll(occupied, -1, axis=axis)
+            cell = np.s_[...]
+        else:
+            neighbour = np.delete(teams, 0, axis=axis)
+            neighbour_occupied = np.delete(occupied, 0, axis=axis)
+            cell = np.s_[..., :-1, :] if axis == -2 else np.s_[..., :-1]
+
+        length = length + np.count_nonzero(
+            occupied[cell] & neighbour_occupied &
+            (teams[cell] != neighbour), axis=(-2, -1))
+
+    return length
+
+
+def dissimilarity_index(teams: npt.ArrayLike, n_teams: int,
+                        block_size: int = 3) -> np.ndarray:
+    """Return the multigroup dissimilarity index of every board
+
+    The board is cut in square blocks of block_size cells (the blocks on
+    the right and bottom edges may be smaller). The index is
+        D = sum_b sum_t n_b |p_bt - p_t| / (2 n I),  I = sum_t p_t (1 - p_t)
+    where n_b is the number of agents in block b, p_bt the fraction of them
+    in team t, and p_t the same fraction on the whole board. For two teams
+    it is the classic dissimilarity index. D is 0 when every block has the
+    composition of the board, 1 when each block holds a single team, and -1
+    when it is not defined (fewer than two teams on the board).
+    """
+    teams = np.asarray(teams)
+    masks = team_masks(teams, n_teams)
+
+    height, width = masks.shape[-2:]
+    pad_y = -height % block_size
+    pad_x = -width % block_size
+    padding = [(0, 0)] * (masks.ndim - 2) + [(0, pad_y), (0, pad_x)]
+    masks = np.pad(masks, padding)
+
+    blocks = masks.reshape(masks.shape[:-2] +
+                           ((height + pad_y) // block_size, block_size,
+                            (width + pad_x) // block_size, block_size))
+    team_in_block = blocks.sum(axis=(-3, -1))          # (..., T, By, Bx)
+    agents_in_block = team_in_block.sum(axis=-3)       # (..., By, Bx)
+
+    team_total = team_in_block.sum(axis=(-2, -1))      # (..., T)
+    agents_total = team_total.sum(axis=-1)             # (...)
+    share = team_total / np.maximum(agents_total, 1)[..., np.newaxis]
+    interaction = (share * (1 - share)).sum(axis=-1)
+
+    # n_b |p_bt - p_t| = |n_bt - n_b p_t|
+    deviation = np.abs(team_in_block - agents_in_block[..., np.newaxis, :, :]
+                       * share[..., np.newaxis, np.newaxis])
+    defined = interaction > 0
+    return np.where(defined,
+                    deviation.sum(axis=(-3, -2, -1)) /
+                    np.where(defined, 2 * agents_total * interaction, 1),
+                    -1)
+
+
+def morans_i(teams: npt.ArrayLike, n_teams: int, empty_value: int = 0,
+             kernel: npt.ArrayLike = MOORE_KERNEL,
+             boundary: str = "constant") -> np.ndarray:
+    """Return Moran's I of the indicator of every team
+
+    The variable of an agent is 1 if it belongs to the team and 0 otherwise,
+    empty cells are left out and two agents are neighbours when they are in
+    each other's neighbourhood. I > 0 when agents cluster with their own
+    team, I is about -1 / (n - 1) for a random board and -1 for a perfectly
+    dispersed one. It is NaN when not defined: the board holds one team
+    only, or no two agents are neighbours.
+
+    With z = x - m on the occupied cells and K the neighbourhood, the cross
+    products sum_ij w_ij z_i z_j are expanded into counts of neighbours of
+    binary masks, so the whole computation is a few convolutions.
+
+    Returns:
+        np.ndarray: (..., n_teams)
+    """
+    teams = np.asarray(teams)
+    occupied = teams != empty_value
+    masks = team_masks(teams, n_teams)
+
+    def neighbour_sum(mask, around):
+        # sum over the cells of mask of the neighbours in around
+        counts = neighbour_counts(around, kernel, boundary)
+        return np.sum(counts * mask, axis=(-2, -1), dtype=np.int64)
+
+    n_agents = np.count_nonzero(occupied, axis=(-2, -1))[..., np.newaxis]
+    n_team = np.count_nonzero(masks, axis=(-2, -1))
+    mean = n_team / np.maximum(n_agents, 1)
+
+    occupied_links = neighbour_sum(occupied, occupied)[..., np.newaxis]
+    team_links = neighbour_sum(masks, masks)
+    # K is symmetric: sum_i x_i (K o)_i = sum_i o_i (K x)_i
+    mixed_links = neighbour_sum(masks, occupied[..., np.newaxis, :, :])
+
+    cross = team_links - 2 * mean * mixed_links + mean ** 2 * occupied_links
+    variance = n_agents * mean * (1 - mean)
+
+    defined = (variance > 0) & (occupied_links > 0)
+    # -1 is a valid value, undefined is NaN
+    return np.where(defined,
+                    n_agents * cross /
+                    np.where(defined, occupied_links * variance, 1),
+                    np.nan)
+
+
+def _as_stack(teams):
+    teams = np.asarray(teams)
+    return teams.reshape((-1,) + teams.shape[-2:])
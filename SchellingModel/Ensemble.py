@@ -0,0 +1,234 @@
+# Copyright (C) 2022-present Associació Heuristica <info@heuristica.barcelona>
+#                      and   Dimitri Marinelli <dimi.marin@proton.me>
+#
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# A copy of the GNU Affero General Public License is in the LICENSE file
+# in the source code repository.
+
+""" Many independent simulations of the Schelling dynamics at once
+
+The R replicas of a SchellingEnsemble start from the same board and are
+stored as a single (R, H, W) array. Every step computes the happiness of all
+the replicas with the batched kernels of BoardBatch and moves the unhappy
+agents of all the replicas with a single vectorized relocation. Each replica
+has its own random stream, so a replica does not depend on how many others
+run with it.
+"""
+import time
+
+import numpy as np
+from loguru import logger
+
+from dataclasses import dataclass
+from typing import List, Sequence, Union
+import numpy.typing as npt
+
+from SchellingModel.SchellingGame import SchellingBoard
+from SchellingModel.BoardBatch import BoardBatch
+
+
+@dataclass
+class EnsembleHistory:
+    """ The time series of all the replicas of a SchellingEnsemble
+
+    Attributes:
+        step (np.ndarray): the step of each row, starting from 0.
+        moved (np.ndarray): (T, R) agents moved in each replica.
+        happiness (np.ndarray): (T, R) total happiness of each replica.
+        segregation (np.ndarray): (T, R) segregation of each replica, -1
+                                    where not defined.
+    """
+    step: np.ndarray
+    moved: np.ndarray
+    happiness: np.ndarray
+    segregation: np.ndarray
+
+    def bands(self, metric: str = "happiness",
+              percentiles: Sequence[float] = (5, 25, 50, 75, 95)
+              ) -> np.ndarray:
+        """Return the percentiles of a metric over the replicas
+
+        Args:
+            metric (str, optional): "happiness", "segregation" or "moved".
+            percentiles (Sequence[float], optional): percentiles in [0, 100].
+
+        Returns:
+            np.ndarray: (len(percentiles), T) array, one band per row
+        """
+        values = getattr(self, metric)
+        return np.percentile(values, percentiles, axis=1)
+
+
+class SchellingEnsemble:
+    def __init__(self, board: SchellingBoard, n_replicas: int,
+                 threshold: Union[float, Sequence[float]] = 0.5,
+                 seed=None):
+        """ Independent simulations of the Schelling dynamics
+
+        Every replica follows the dynamics of SchellingGame: at every step
+        all the unhappy agents move at the same time to randomly chosen
+        empty cells.
+
+        Args:
+            board (SchellingBoard): the starting board of all the replicas,
+                                    it is not modified.
+            n_replicas (int): number of replicas.
+            threshold (float or Sequence[float], optional): minimum fraction
+                    of neighbours of the same team to be happy, one for all
+                    the teams or one per team. Defaults to 0.5.
+            seed (optional): seed or np.random.SeedSequence, spawned into
+                                one random stream per replica.
+        """
+        if n_replicas < 1:
+            raise ValueError("at least one replica is needed")
+
+        if not isinstance(seed, np.random.SeedSequence):
+            seed = np.random.SeedSequence(seed)
+        self.rngs = [np.random.default_rng(s)
+                     for s in seed.spawn(n_replicas)]
+
+        teams = np.broadcast_to(board.teams,
+                                (n_replicas,) + board.teams.shape).copy()
+        self.batch = BoardBatch(teams,
+                                team_names=board.team_names,
+                                mood_map=board.mood_map,
+                                empty_value=board.empty_value,
+                                threshold=threshold,
+                                **board.neighbourhood_kwargs())
+        self.time = 0
+        self.steps_per_second = None
+
+    @property
+    def n_replicas(self) -> int:
+        return len(self.batch)
+
+    @property
+    def teams(self) -> np.ndarray:
+        """The (R, H, W) teams of all the replicas"""
+        return self.batch.teams
+
+    def unhappy_agents(self) -> np.ndarray:
+        """Return a (R, H, W) boolean array, True where the agent wants to
+        move"""
+        batch = self.batch
+        return (batch.team_index() > 0) & ~batch.model_happy_mask()
+
+    def step(self) -> np.ndarray:
+        """Move all the unhappy agents of every replica once
+
+        Returns:
+            np.ndarray: the number of agents moved in each replica
+        """
+        batch = self.batch
+        batch.teams, moved = relocate_agents_batch(
+            batch.teams,
+            self.unhappy_agents(),
+            batch.teams == batch.empty_value,
+            self.rngs,
+            batch.empty_value)
+        self.time += 1
+        return moved
+
+    def happiness(self) -> np.ndarray:
+        """Return the total happiness of every replica"""
+        return self.batch.happyness()["total"]
+
+    def segregation(self) -> np.ndarray:
+        """Return the segregation of every replica"""
+        return self.batch.segregation()
+
+    def run(self, n_steps: int, stop_when_stable=True) -> EnsembleHistory:
+        """Run the dynamics of all the replicas
+
+        Args:
+            n_steps (int): maximum number of steps.
+            stop_when_stable (bool, optional): stop as soon as no agent moves
+                                                in any replica.
+
+        Returns:
+            EnsembleHistory: the status before the first step and after each
+                                step.
+        """
+        steps = [self.time]
+        moved = [np.zeros(self.n_replicas, dtype=np.int_)]
+        happiness = [self.happiness()]
+        segregation = [self.segregation()]
+
+        start = time.perf_counter()
+        for _ in range(n_steps):
+            moved.append(self.step())
+            steps.append(self.time)
+            happiness.append(self.happiness())
+            segregation.append(self.segregation())
+            if stop_when_stable and not moved[-1].any():
+                break
+        elapsed = time.perf_counter() - start
+
+        n_done = len(steps) - 1
+        self.steps_per_second = n_done / elapsed if elapsed > 0 else None
+        logger.info(f"{n_done} steps of {self.n_replicas} replicas in "
+                    f"{elapsed:.3f} s ({self.steps_per_second or 0:.1f} "
+                    f"steps/s)")
+
+        return EnsembleHistory(step=np.array(steps),
+                               moved=np.stack(moved),
+                               happiness=np.stack(happiness),
+                               segregation=np.stack(segregation))
+
+
+def relocate_agents_batch(teams: npt.ArrayLike,
+                          movers: npt.ArrayLike,
+                          empty: npt.ArrayLike,
+                          rngs: List[np.random.Generator],
+                          empty_value: int = 0):
+    """Move agents to randomly chosen empty cells in a stack of boards
+
+    The batched version of SchellingGame.relocate_agents: in every board the
+    movers and the empty cells are shuffled by sorting random keys drawn from
+    the board's own generator, and the first min(movers, empty) of each are
+    paired.
+
+    Args:
+        teams (npt.ArrayLike): the (R, H, W) array of teams.
+        movers (npt.ArrayLike): boolean mask of the agents that want to move.
+        empty (npt.ArrayLike): boolean mask of the empty cells.
+        rngs (List[np.random.Generator]): one generator per board.
+        empty_value (int, optional): the integer representing an empty cell.
+
+    Returns:
+        tuple: (new teams array, number of agents moved in each board)
+    """
+    teams = np.asarray(teams)
+    n_boards = teams.shape[0]
+    movers = np.asarray(movers).reshape(n_boards, -1)
+    empty = np.asarray(empty).reshape(n_boards, -1)
+    n_cells = movers.shape[1]
+
+    # keys >= 1 push the cells that are not candidates to the end
+    keys = np.stack([rng.random(2 * n_cells) for rng in rngs])
+    sources = np.argsort(np.where(movers, keys[:, :n_cells], 2), axis=1)
+    destinations = np.argsort(np.where(empty, keys[:, n_cells:], 2), axis=1)
+
+    n_moves = np.minimum(np.count_nonzero(movers, axis=1),
+                         np.count_nonzero(empty, axis=1))
+    valid = np.arange(n_cells) < n_moves[:, np.newaxis]
+
+    offsets = (np.arange(n_boards) * n_cells)[:, np.newaxis]
+    sources = (sources + offsets)[valid]
+    destinations = (destinations + offsets)[valid]
+
+    new_teams = teams.copy().ravel()
+    new_teams[destinations] = new_teams[sources]
+    new_teams[sources] = empty_value
+
+    return new_teams.reshape(teams.shape), n_moves
@@ -0,0 +1,278 @@
+# Copyright (C) 2022-present Associació Heuristica <info@heuristica.barcelona>
+#                      and   Dimitri Marinelli <dimi.marin@proton.me>
+#
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# A copy of the GNU Affero General Public License is in the LICENSE file
+# in the source code repository.
+
+""" Custom happiness rules compiled into lookup tables
+
+A rule is a boolean expression of the neighbours of an agent:
+
+    own         neighbours of the agent's team
+    others      neighbours of all the other teams
+    total       own + others
+    fraction    own / total, 1 when the agent has no neighbours
+
+e.g. "own >= 3", "others <= 2" or "fraction >= 0.3 and own >= 2". The
+expressions accept numbers, + - * /, comparisons, and, or, not and
+parentheses, nothing else is ever evaluated.
+
+The happiness of an agent depends only on (own, others), so a rule is
+evaluated once on every possible pair and stored in a boolean table; a whole
+board, or a stack of boards, is then judged with a single gather
+table[own, others], as fast as the built-in threshold. A rule can be passed
+wherever a threshold is accepted, e.g. SchellingGame(threshold=rule).
+"""
+import ast
+import functools
+import operator
+
+import numpy as np
+
+from typing import Sequence, Union
+import numpy.typing as npt
+
+VARIABLES = ("own", "others", "total", "fraction")
+
+_BINARY_OPERATORS = {ast.Add: np.add, ast.Sub: np.subtract,
+                     ast.Mult: np.multiply, ast.Div: np.divide}
+_COMPARISONS = {ast.Eq: operator.eq, ast.NotEq: operator.ne,
+                ast.Lt: operator.lt, ast.LtE: operator.le,
+                ast.Gt: operator.gt, ast.GtE: operator.ge}
+
+
+class HappinessRule:
+    def __init__(self, expression: str) -> None:
+        """ A happiness rule, see the module documentation
+
+        Args:
+            expression (str): e.g. "own >= 3 and others <= 2".
+
+        Raises:
+            ValueError: if the expression is not a valid rule
+        """
+        self.expression = expression
+        try:
+            self._tree = ast.parse(expression, mode="eval")
+        except SyntaxError as e:
+            raise ValueError(f"invalid rule {expression!r}: {e.msg}")
+        _check_node(self._tree.body, expression)
+        self._table = None
+
+    @classmethod
+    def at_least_own(cls, n: int) -> "HappinessRule":
+        """Happy with at least n neighbours of the same team"""
+        return cls(f"own >= {n}")
+
+    @classmethod
+    def at_most_strangers(cls, n: int) -> "HappinessRule":
+        """Happy with at most n neighbours of other teams"""
+        return cls(f"others <= {n}")
+
+    @classmethod
+    def fraction_own(cls, threshold: float) -> "HappinessRule":
+        """The built-in rule, at least a fraction of neighbours of the same
+        team"""
+        return cls(f"fraction >= {float(threshold)!r}")
+
+    def __and__(self, other: "HappinessRule") -> "HappinessRule":
+        return HappinessRule(f"({self.expression}) and ({other.expression})")
+
+    def __or__(self, other: "HappinessRule") -> "HappinessRule":
+        return HappinessRule(f"({self.expression}) or ({other.expression})")
+
+    def __invert__(self) -> "HappinessRule":
+        return HappinessRule(f"not ({self.expression})")
+
+    def __eq__(self, other) -> bool:
+        return isinstance(other, HappinessRule) and \
+            other.expression == self.expression
+
+    def __hash__(self) -> int:
+        return hash(self.expression)
+
+    def __repr__(self) -> str:
+        return f"HappinessRule({self.expression!r})"
+
+    def __getstate__(self):
+        # the tree and the table are rebuilt, a rule travels as its text
+        return {"expression": self.expression}
+
+    def __setstate__(self, state):
+        self.__init__(state["expression"])
+
+    def evaluate(self, own: npt.ArrayLike,
+                 others: npt.ArrayLike) -> np.ndarray[np.bool_]:
+        """Evaluate the rule on arrays of neighbour counts"""
+        own = np.asarray(own)
+        others = np.asarray(others)
+        total = own + others
+        with np.errstate(divide="ignore", invalid="ignore"):
+            fraction = np.where(total > 0, own / np.maximum(total, 1), 1.)
+        variables = {"own": own, "others": others, "total": total,
+                     "fraction": fraction}
+
+        result = _evaluate(self._tree.body, variables)
+        return np.broadcast_to(np.asarray(result, dtype=bool),
+                               np.broadcast(own, others).shape)
+
+    def table(self, size: int) -> np.ndarray[np.bool_]:
+        """Return the lookup table of the rule
+
+        Args:
+            size (int): one more than the largest neighbour count.
+
+        Returns:
+            np.ndarray: (size, size) boolean array, the entry [own, others]
+                        tells whether the agent is happy
+        """
+        if self._table is None or self._table.shape[0] < size:
+            counts = np.arange(size)
+            self._table = self.evaluate(counts[:, np.newaxis],
+                                        counts[np.newaxis, :])
+        return self._table[:size, :size]
+
+
+def _check_node(node, expression):
+    """Raise ValueError if the node is not allowed in a rule"""
+    if isinstance(node, ast.BoolOp):
+        children = node.values
+    elif isinstance(node, ast.UnaryOp) and \
+            isinstance(node.op, (ast.Not, ast.USub)):
+        children = [node.operand]
+    elif isinstance(node, ast.BinOp) and \
+            type(node.op) in _BINARY_OPERATORS:
+        children = [node.left, node.right]
+    elif isinstance(node, ast.Compare) and \
+            all(type(op) in _COMPARISONS for op in node.ops):
+        children = [node.left] + node.comparators
+    elif isinstance(node, ast.Name):
+        if node.id not in VARIABLES:
+            raise ValueError(f"invalid rule {expression!r}: unknown "
+                             f"variable {node.id}, use one of {VARIABLES}")
+        children = []
+    elif isinstance(node, ast.Constant) and \
+            isinstance(node.value, (int, float)):
+        children = []
+    else:
+        raise ValueError(f"invalid rule {expression!r}: "
+                         f"{type(node).__name__} is not allowed")
+
+    for child in children:
+        _check_node(child, expression)
+
+
+def _evaluate(node, variables):
+    if isinstance(node, ast.BoolOp):
+        values = [_evaluate(value, variables) for value in node.values]
+        if isinstance(node.op, ast.And):
+            return functools.reduce(np.logical_and, values)
+        return functools.reduce(np.logical_or, values)
+    if isinstance(node, ast.UnaryOp):
+        operand = _evaluate(node.operand, variables)
+        if isinstance(node.op, ast.Not):
+            return np.logical_not(operand)
+        return np.negative(operand)
+    if isinstance(node, ast.BinOp):
+        return _BINARY_OPERATORS[type(node.op)](
+            _evaluate(node.left, variables), _evaluate(node.right, variables))
+    if isinstance(node, ast.Compare):
+        # a < b < c is a < b and b < c
+        left = _evaluate(node.left, variables)
+        result = True
+        for op, comparator in zip(node.ops, node.comparators):
+            right = _evaluate(comparator, variables)
+            result = np.logical_and(result, _COMPARISONS[type(op)](left,
+                                                                   right))
+            left = right
+        return result
+    if isinstance(node, ast.Name):
+        return variables[node.id]
+    return node.value
+
+
+Rules = Union[HappinessRule, Sequence[Union[HappinessRule, float]]]
+
+
+def is_rule(threshold) -> bool:
+    """Return True if the threshold is a rule or a sequence with rules"""
+    if isinstance(threshold, HappinessRule):
+        return True
+    return np.ndim(threshold) > 0 and \
+        any(isinstance(t, HappinessRule) for t in threshold)
+
+
+def compile_rules(rules: Rules, size: int) -> np.ndarray[np.bool_]:
+    """Return the lookup table of one rule, or the stacked tables of one
+    rule per team
+
+    Thresholds in a sequence of rules become HappinessRule.fraction_own.
+
+    Returns:
+        np.ndarray: (size, size) or (n_teams, size, size) boolean array
+    """
+    if isinstance(rules, HappinessRule):
+        return rules.table(size)
+    return np.stack([rule.table(size) if isinstance(rule, HappinessRule)
+                     else HappinessRule.fraction_own(rule).table(size)
+                     for rule in rules])
+
+
+def rule_happy_mask(neighbours: npt.ArrayLike,
+                    team_index: npt.ArrayLike,
+                    rules: Rules) -> np.ndarray[np.bool_]:
+    """Return True where the agent is happy according to its team's rule
+
+    Args:
+        neighbours (npt.ArrayLike): neighbour counts of shape (..., T, H, W).
+        team_index (npt.ArrayLike): teams of shape (..., H, W) with values in
+                            [0, T], 0 marks the cells without agents.
+        rules: one rule for all the teams or one per team.
+
+    Returns:
+        np.ndarray: boolean array of shape (..., H, W)
+    """
+    neighbours = np.asarray(neighbours)
+    team_index = np.asarray(team_index)
+
+    channel = np.maximum(team_index - 1, 0)[..., np.newaxis, :, :]
+    own = np.take_along_axis(neighbours, channel, axis=-3)[..., 0, :, :]
+    total = neighbours.sum(axis=-3, dtype=neighbours.dtype)
+    size = int(total.max(initial=0)) + 1
+    table = compile_rules(rules, size)
+
+    # a gather on the flattened table, with the smallest index dtype
+    dtype = np.promote_types(np.min_scalar_type(table.size - 1), own.dtype)
+    index = own.astype(dtype) * dtype.type(size) + (total - own)
+    if table.ndim == 3:
+        index += channel[..., 0, :, :].astype(dtype) * dtype.type(size * size)
+    return np.take(table.ravel(), index) & (team_index > 0)
+
+
+def rule_happy_tensor(neighbours: npt.ArrayLike,
+                      rules: Rules) -> np.ndarray[np.bool_]:
+    """Return for every team and cell whether an agent of that team would be
+    happy there, see rule_happy_mask
+
+    Returns:
+        np.ndarray: boolean array of shape (..., T, H, W)
+    """
+    neighbours = np.asarray(neighbours)
+    total = neighbours.sum(axis=-3, keepdims=True, dtype=neighbours.dtype)
+    table = compile_rules(rules, int(total.max(initial=0)) + 1)
+
+    if table.ndim == 2:
+        return table[neighbours, total - neighbours]
+    teams = np.arange(neighbours.shape[-3])[:, np.newaxis, np.newaxis]
+    return table[teams, neighbours, total - neighbours]
@@ -0,0 +1,148 @@
+# Copyright (C) 2022-present Associació Heuristica <info@heuristica.barcelona>
+#                      and   Dimitri Marinelli <dimi.marin@proton.me>
+#
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# A copy of the GNU Affero General Public License is in the LICENSE file
+# in the source code repository.
+
+""" A SchellingBoard that follows single agent moves incrementally
+
+When agents move one at a time (sequential dynamics) only the cells around
+the source and the destination of a move change their neighbour counts, so
+there is no need to convolve the whole grid again.
+"""
+import numpy as np
+
+from typing import Tuple
+
+from SchellingModel.SchellingGame import SchellingBoard
+from SchellingModel.Kernels import team_masks, neighbour_counts, happy_mask
+
+
+class IncrementalSchellingBoard(SchellingBoard):
+    def __init__(self, *args, **kwargs) -> None:
+        """ A SchellingBoard updated in place by move
+
+        It takes the same arguments of SchellingBoard. The teams (and moods)
+        arrays are copied, since moves modify them in place. The neighbour
+        tensor and the happy mask of SchellingBoard are kept up to date after
+        every move, so all the metrics of the board keep working.
+        """
+        super().__init__(*args, **kwargs)
+        self.teams = np.array(self.teams, copy=True)
+        if self.moods is not None:
+            self.moods = np.array(self.moods, copy=True)
+
+    @classmethod
+    def from_board(cls, board: SchellingBoard) -> "IncrementalSchellingBoard":
+        return cls(teams=board.teams,
+                   moods=board.moods,
+                   team_names=board.team_names,
+                   separator=board.separator,
+                   mood_map=board.mood_map,
+                   empty_value=board.empty_value,
+                   threshold=board.threshold,
+                   **board.neighbourhood_kwargs())
+
+    def move(self, source: Tuple[int, int], destination: Tuple[int, int]):
+        """Move the agent in source to the empty cell destination
+
+        Args:
+            source (Tuple[int, int]): (row, column) of the agent.
+            destination (Tuple[int, int]): (row, column) of an empty cell.
+        """
+        source = tuple(source)
+        destination = tuple(destination)
+
+        # make sure the tensors to update exist
+        neighbours = self._neighbour_counts()
+        self.model_happy_mask()
+
+        team = self.teams[source]
+        if not 1 <= team <= self.n_teams:
+            raise ValueError(f"there is no agent in {source}")
+        if self.teams[destination] != self.empty_value:
+            raise ValueError(f"the cell {destination} is not empty")
+
+        # the teams array is modified in place, not reassigned, to keep the
+        # caches of SchellingBoard
+        self.teams[source] = self.empty_value
+        self.teams[destination] = team
+        if self.moods is not None:
+            self.moods[destination] = self.moods[source]
+            self.moods[source] = 0
+
+        self._add_agent_to_counts(neighbours[team - 1], source, remove=True)
+        self._add_agent_to_counts(neighbours[team - 1], destination)
+
+        self._update_happy_cells(source)
+        self._update_happy_cells(destination)
+
+    def _window(self, cell: Tuple[int, int]):
+        """Return the board and kernel indices of the neighbourhood of cell
+
+        With constant boundaries they are slices cut at the edges, with wrap
+        boundaries the board indices are arrays that wrap around (and may
+        repeat a cell when the kernel is larger than the board).
+        """
+        (k_height, k_width) = self.kernel.shape
+        r_y, r_x = k_height // 2, k_width // 2
+        y, x = cell
+
+        if self.boundary == "wrap":
+            rows = np.arange(y - r_y, y + r_y + 1) % self.grid_y
+            columns = np.arange(x - r_x, x + r_x + 1) % self.grid_x
+            return np.ix_(rows, columns), np.s_[:, :]
+
+        y0, y1 = max(y - r_y, 0), min(y + r_y + 1, self.grid_y)
+        x0, x1 = max(x - r_x, 0), min(x + r_x + 1, self.grid_x)
+
+        board_window = np.s_[y0:y1, x0:x1]
+        kernel_window = np.s_[y0 - y + r_y:y1 - y + r_y,
+                              x0 - x + r_x:x1 - x + r_x]
+        return board_window, kernel_window
+
+    def _add_agent_to_counts(self, counts, cell, remove=False):
+        board_window, kernel_window = self._window(cell)
+        weights = self.kernel[kernel_window].astype(counts.dtype)
+        if self.boundary == "wrap":
+            # unbuffered, the window may contain a cell more than once
+            (np.subtract if remove else np.add).at(counts, board_window,
+                                                   weights)
+        elif remove:
+            counts[board_window] -= weights
+        else:
+            counts[board_window] += weights
+
+    def _update_happy_cells(self, cell):
+        board_window, _ = self._window(cell)
+        team_index = self._team_index_window(board_window)
+        self._happy_cache[board_window] = happy_mask(
+            self._neighbours_cache[(slice(None),) + board_window],
+            team_index,
+            self.threshold)
+
+    def _team_index_window(self, window) -> np.ndarray:
+        teams = self.teams[window]
+        valid = (teams >= 1) & (teams <= self.n_teams)
+        return np.where(valid, teams, 0)
+
+    def check_consistency(self) -> bool:
+        """Compare the incremental state with a full recomputation"""
+        neighbours = neighbour_counts(team_masks(self.teams, self.n_teams),
+                                      self.kernel, self.boundary)
+        happy_cells = happy_mask(neighbours, self.team_index(),
+                                 self.threshold)
+
+        return np.array_equal(neighbours, self._neighbour_counts()) and \
+            np.array_equal(happy_cells, self.model_happy_mask())
@@ -0,0 +1,321 @@
+# Copyright (C) 2022-present Associació Heuristica <info@heuristica.barcelona>
+#                      and   Dimitri Marinelli <dimi.marin@proton.me>
+#
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# A copy of the GNU Affero General Public License is in the LICENSE file
+# in the source code repository.
+
+""" The array kernels behind SchellingBoard and BoardBatch
+
+All the functions work on whole arrays, the last two axes are the board and
+any leading axes are a batch of boards. They are the NumPy implementation
+of the backends in SchellingModel.Backends.
+"""
+import numpy as np
+from scipy.signal import fftconvolve
+
+from typing import Union, Sequence
+import numpy.typing as npt
+
+from SchellingModel.HappinessRules import is_rule, rule_happy_mask, \
+    rule_happy_tensor
+
+
+MOORE_KERNEL = np.array([[1, 1, 1],
+                         [1, 0, 1],
+                         [1, 1, 1]])
+
+# absorbs the rounding of threshold * neighbours, e.g. 1/3 * 3
+THRESHOLD_TOLERANCE = 1e-9
+
+# kernels with more non zero entries are applied with an FFT convolution
+SHIFTED_SUM_MAX_TERMS = 24
+
+BOUNDARIES = ("constant", "wrap")
+NEIGHBOURHOODS = ("moore", "von_neumann")
+
+
+def neighbourhood_kernel(neighbourhood: str = "moore",
+                         radius: int = 1) -> np.ndarray:
+    """Return the kernel of a neighbourhood of a given radius
+
+    Args:
+        neighbourhood (str, optional): "moore", the square around the cell,
+                    or "von_neumann", the cells at Manhattan distance at most
+                    radius. Defaults to "moore".
+        radius (int, optional): Defaults to 1.
+
+    Returns:
+        np.ndarray: a (2 radius + 1, 2 radius + 1) array of 0 and 1, the cell
+                    itself is excluded
+    """
+    if neighbourhood not in NEIGHBOURHOODS:
+        raise ValueError(f"neighbourhood should be one of {NEIGHBOURHOODS}")
+    if radius < 1:
+        raise ValueError("radius should be at least 1")
+
+    dy, dx = np.mgrid[-radius:radius + 1, -radius:radius + 1]
+    if neighbourhood == "moore":
+        kernel = np.ones_like(dy)
+    else:
+        kernel = (np.abs(dy) + np.abs(dx) <= radius).astype(dy.dtype)
+    kernel[radius, radius] = 0
+    return kernel
+
+
+def team_masks(teams: npt.ArrayLike, n_teams: int) -> np.ndarray[np.bool_]:
+    """Return one boolean channel per team
+
+    Args:
+        teams (npt.ArrayLike): array of teams, the last two axes are the board.
+        n_teams (int): the number of teams, teams are numbered from 1.
+
+    Returns:
+        np.ndarray: array of shape (..., n_teams, H, W)
+    """
+    teams = np.asarray(teams)
+    team_ids = np.arange(1, n_teams + 1).reshape(-1, 1, 1)
+    return teams[..., np.newaxis, :, :] == team_ids
+
+
+def neighbour_counts(masks: npt.ArrayLike,
+                     kernel: npt.ArrayLike = MOORE_KERNEL,
+                     boundary: str = "constant") -> np.ndarray:
+    """Count the neighbours of every channel in a single convolution
+
+    Small kernels are applied as a sum of shifted views of the padded
+    masks, which is much faster than a generic convolution on a stack of
+    boards; larger kernels (e.g. radius > 2) use an FFT convolution, whose
+    cost does not grow with the size of the kernel.
+
+    Args:
+        masks (npt.ArrayLike): array of shape (..., H, W), e.g. the output of
+                                team_masks. Channels are never mixed.
+        kernel (npt.ArrayLike, optional): the neighbourhood of a cell.
+                                Defaults to the 3x3 Moore neighbourhood.
+        boundary (str, optional): "constant", nothing beyond the edges, or
+                                "wrap", the board is a torus.
+
+    Returns:
+        np.ndarray: unsigned integer array with the same shape of masks, the
+                    dtype is the smallest that can hold kernel.sum()
+    """
+    if boundary not in BOUNDARIES:
+        raise ValueError(f"boundary should be one of {BOUNDARIES}")
+
+    masks = np.asarray(masks)
+    kernel = np.asarray(kernel)
+    dtype = np.min_scalar_type(max(int(kernel.sum()), 1))
+
+    height, width = masks.shape[-2:]
+    k_height, k_width = kernel.shape
+    padding = [(0, 0)] * (masks.ndim - 2) + \
+              [(k_height // 2, k_height // 2), (k_width // 2, k_width // 2)]
+
+    if np.count_nonzero(kernel) > SHIFTED_SUM_MAX_TERMS:
+        padded = np.pad(masks.astype(np.float64), padding, mode=boundary)
+        kernel = kernel.reshape((1,) * (masks.ndim - 2) + kernel.shape)
+        counts = fftconvolve(padded, kernel.astype(np.float64),
+                             mode="valid", axes=(-2, -1))
+        return np.rint(counts).astype(dtype)
+
+    padded = np.pad(masks.astype(dtype), padding, mode=boundary)
+
+    # a convolution flips the kernel
+    flipped = kernel[::-1, ::-1]
+    counts = np.zeros(masks.shape, dtype=dtype)
+    for i, j in zip(*np.nonzero(flipped)):
+        shifted = padded[..., i:i + height, j:j + width]
+        if flipped[i, j] == 1:
+            counts += shifted
+        else:
+            counts += flipped[i, j].astype(dtype) * shifted
+
+    return counts
+
+
+def happy_mask(neighbours: npt.ArrayLike,
+               team_index: npt.ArrayLike,
+               threshold: Union[float, Sequence[float]] = 0.5
+               ) -> np.ndarray[np.bool_]:
+    """Return True where the fraction of neighbours of the agent's own team
+    is at least the threshold of its team
+
+    With the default threshold of 0.5 an agent is happy when it has at least
+    as many neighbours of its own team as of all the other teams together.
+    Agents without neighbours are happy. All the teams are judged in the same
+    pass: the threshold of each cell is gathered from the team in it.
+
+    Args:
+        neighbours (npt.ArrayLike): neighbour counts of shape (..., T, H, W).
+        team_index (npt.ArrayLike): teams of shape (..., H, W) with values in
+                            [0, T], 0 marks the cells without agents.
+        threshold (float or Sequence[float], optional): minimum fraction of
+                            neighbours of the same team, one for all the teams
+                            or one per team. Defaults to 0.5. HappinessRules
+                            are evaluated with rule_happy_mask.
+
+    Returns:
+        np.ndarray: boolean array of shape (..., H, W)
+    """
+    if is_rule(threshold):
+        return rule_happy_mask(neighbours, team_index, threshold)
+
+    neighbours = np.asarray(neighbours)
+    team_index = np.asarray(team_index)
+
+    channel = np.maximum(team_index - 1, 0)[..., np.newaxis, :, :]
+    my_neighbours = np.take_along_axis(neighbours, channel, axis=-3)[..., 0, :, :]
+    # every cell holds one agent, the total fits the dtype of the counts
+    all_neighbours = neighbours.sum(axis=-3, dtype=neighbours.dtype)
+
+    thresholds = np.asarray(threshold, dtype=float)
+    if np.all(thresholds == 0.5):
+        # exact integer comparison for the default rule
+        happy = my_neighbours >= all_neighbours - my_neighbours
+    else:
+        if thresholds.ndim > 0:
+            # the threshold of the team in each cell
+            thresholds = np.concatenate([[0.], thresholds])[team_index]
+        happy = my_neighbours >= thresholds * all_neighbours - THRESHOLD_TOLERANCE
+
+    return happy & (team_index > 0)
+
+
+def happy_tensor(neighbours: npt.ArrayLike,
+                 threshold: Union[float, Sequence[float]] = 0.5
+                 ) -> np.ndarray[np.bool_]:
+    """Return for every team and cell whether an agent of that team would be
+    happy there
+
+    Args:
+        neighbours (npt.ArrayLike): neighbour counts of shape (..., T, H, W).
+        threshold (float or Sequence[float], optional): as in happy_mask.
+
+    Returns:
+        np.ndarray: boolean array of shape (..., T, H, W)
+    """
+    if is_rule(threshold):
+        return rule_happy_tensor(neighbours, threshold)
+
+    neighbours = np.asarray(neighbours)
+    all_neighbours = neighbours.sum(axis=-3, keepdims=True,
+                                    dtype=neighbours.dtype)
+
+    thresholds = np.asarray(threshold, dtype=float)
+    if np.all(thresholds == 0.5):
+        return neighbours >= all_neighbours - neighbours
+
+    thresholds = np.broadcast_to(thresholds, neighbours.shape[-3:-2])
+    return neighbours >= thresholds[:, np.newaxis, np.newaxis] * \
+        all_neighbours - THRESHOLD_TOLERANCE
+
+
+def link_counts(teams: npt.ArrayLike, empty_value: int = 0,
+                occupied: npt.ArrayLike = None,
+                kernel: npt.ArrayLike = MOORE_KERNEL,
+                boundary: str = "constant"):
+    """Count the links between neighbouring agents
+
+    Two agents are linked when they are in each other's neighbourhood. Every
+    occupied cell is linked to the neighbours in the lower half of the
+    (symmetric) kernel, for the Moore neighbourhood the right, bottom,
+    bottom-right and bottom-left ones, so that each pair of agents is counted
+    once. The counts are computed on shifted views of the whole array
+    instead of walking the cells. Large kernels count the links with a
+    convolution of the occupied cells and of every team.
+
+    Args:
+        teams (npt.ArrayLike): array of teams, the last two axes are the board.
+                    Leading axes (if any) are treated as a batch of boards.
+        empty_value (int, optional): the integer representing an empty cell.
+        occupied (npt.ArrayLike, optional): precomputed teams != empty_value.
+        kernel (npt.ArrayLike, optional): the neighbourhood of a cell, it
+                    should be symmetric. Defaults to the 3x3 Moore one.
+        boundary (str, optional): "constant" or "wrap", as in
+                    neighbour_counts.
+
+    Returns:
+        tuple: (# of links, # of mixed links), as integers for a single board
+                or as arrays over the leading axes for a batch.
+    """
+    if boundary not in BOUNDARIES:
+        raise ValueError(f"boundary should be one of {BOUNDARIES}")
+
+    teams = np.asarray(teams)
+    kernel = np.asarray(kernel)
+    if occupied is None:
+        occupied = teams != empty_value
+
+    if np.count_nonzero(kernel) > SHIFTED_SUM_MAX_TERMS:
+        return _link_counts_convolution(teams, occupied, kernel, boundary)
+
+    links = 0
+    mixed_links = 0
+    for dy, dx in _half_kernel_offsets(kernel):
+        if boundary == "wrap":
+            cell = np.s_[...]
+            neighbour_teams = np.roll(teams, (-dy, -dx), axis=(-2, -1))
+            neighbour_occupied = np.roll(occupied, (-dy, -dx), axis=(-2, -1))
+        else:
+            cell, neighbour = _shifted_slices(dy, dx)
+            neighbour_teams = teams[neighbour]
+            neighbour_occupied = occupied[neighbour]
+
+        both_occupied = occupied[cell] & neighbour_occupied
+        links += np.count_nonzero(both_occupied, axis=(-2, -1))
+        mixed_links += np.count_nonzero(
+            both_occupied & (teams[cell] != neighbour_teams), axis=(-2, -1))
+
+    return links, mixed_links
+
+
+def _half_kernel_offsets(kernel):
+    """Return the (dy, dx) of the non zero entries after the kernel centre"""
+    k_height, k_width = kernel.shape
+    offsets = []
+    for i, j in zip(*np.nonzero(kernel)):
+        dy, dx = i - k_height // 2, j - k_width // 2
+        if dy > 0 or (dy == 0 and dx > 0):
+            offsets.append((int(dy), int(dx)))
+    return offsets
+
+
+def _shifted_slices(dy, dx):
+    """Return the slices of the cells and of their neighbours at (dy, dx)"""
+    def axis_slices(d):
+        if d >= 0:
+            return slice(0, -d or None), slice(d, None)
+        return slice(-d, None), slice(0, d)
+
+    cell_y, neighbour_y = axis_slices(dy)
+    cell_x, neighbour_x = axis_slices(dx)
+    return np.s_[..., cell_y, cell_x], np.s_[..., neighbour_y, neighbour_x]
+
+
+def _link_counts_convolution(teams, occupied, kernel, boundary):
+    # every link is seen from both its ends
+    def count_links(mask):
+        around = neighbour_counts(mask, kernel, boundary)
+        return np.sum(around, axis=(-2, -1), where=mask,
+                      dtype=np.int64) // 2
+
+    links = count_links(occupied)
+    same_team_links = 0
+    for team in np.unique(teams[occupied]):
+        same_team_links = same_team_links + \
+            count_links(occupied & (teams == team))
+
+    if np.ndim(links) == 0:
+        return int(links), int(links - same_team_links)
+    return links, links - same_team_links
@@ -0,0 +1,254 @@
+# Copyright (C) 2022-present Associació Heuristica <info@heuristica.barcelona>
+#                      and   Dimitri Marinelli <dimi.marin@proton.me>
+#
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# A copy of the GNU Affero General Public License is in the LICENSE file
+# in the source code repository.
+
+""" Parameter sweeps of the Schelling dynamics
+
+Every point of the sweep (threshold, density, grid size, number of teams,
+repetition) starts from a random board and runs SchellingGame until no agent
+moves. The points run in a process pool and each result is saved as soon as
+it is ready in a ResultStore, a directory of JSON files named after the hash
+of the parameters: running the same sweep again only computes the missing
+points.
+
+run from the repository root:
+    python -m SchellingModel.ParameterSweep run --help
+"""
+import hashlib
+import itertools
+import json
+import os
+import time
+
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Dict, Iterator, List, Sequence
+
+import click
+import pandas as pd
+from loguru import logger
+
+from SchellingModel.SchellingGame import SchellingGame
+
+
+def point_key(params: Dict) -> str:
+    """Return the content address of a point, the sha256 of its parameters"""
+    encoded = json.dumps(params, sort_keys=True).encode("utf-8")
+    return hashlib.sha256(encoded).hexdigest()
+
+
+def sweep_points(thresholds: Sequence[float],
+                 densities: Sequence[float],
+                 grid_sizes: Sequence[int],
+                 n_teams: Sequence[int],
+                 n_repeats: int = 1,
+                 max_steps: int = 1000,
+                 seed: int = 0) -> List[Dict]:
+    """Return the parameters of every point of the sweep
+
+    Every combination of the parameters is repeated n_repeats times with
+    different random boards.
+    """
+    points = []
+    for threshold, density, grid_size, teams, repeat in itertools.product(
+            thresholds, densities, grid_sizes, n_teams, range(n_repeats)):
+        points.append({"threshold": float(threshold),
+                       "density": float(density),
+                       "grid_size": int(grid_size),
+                       "n_teams": int(teams),
+                       "repeat": repeat,
+                       "max_steps": int(max_steps),
+                       "seed": int(seed)})
+    return points
+
+
+def run_point(params: Dict) -> Dict:
+    """Run the dynamics of one point to equilibrium
+
+    The random generator is seeded with the point key, so each point is
+    reproducible on its own, whatever worker runs it.
+
+    Returns:
+        Dict: the parameters together with the results
+    """
+    point_seed = int(point_key(params)[:16], 16)
+    game = SchellingGame(params["grid_size"], params["grid_size"],
+                         threshold=params["threshold"],
+                         n_teams=params["n_teams"],
+                         density=params["density"],
+                         seed=point_seed)
+
+    start = time.perf_counter()
+    history = game.run(params["max_steps"], stop_when_stable=True)
+    elapsed = time.perf_counter() - start
+
+    first, last = history[0], history[-1]
+    return dict(params,
+                initial_segregation=first["segregation"],
+                initial_happiness=first["happiness"],
+                segregation=last["segregation"],
+                happiness=last["happiness"],
+                n_steps=last["step"],
+                converged=last["moved"] == 0,
+                elapsed=elapsed)
+
+
+class ResultStore:
+    def __init__(self, path: str) -> None:
+        """ A directory of results addressed by the hash of their parameters
+
+        Args:
+            path (str): the directory, created if it does not exist.
+        """
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+
+    def _file(self, key: str) -> str:
+        return os.path.join(self.path, key[:2], f"{key}.json")
+
+    def __contains__(self, params: Dict) -> bool:
+        return os.path.exists(self._file(point_key(params)))
+
+    def __len__(self) -> int:
+        return sum(1 for _ in self._files())
+
+    def __iter__(self) -> Iterator[Dict]:
+        for file_name in self._files():
+            with open(file_name) as f:
+                yield json.load(f)["result"]
+
+    def _files(self) -> Iterator[str]:
+        for root, _, files in os.walk(self.path):
+            for file_name in sorted(files):
+                if file_name.endswith(".json"):
+                    yield os.path.join(root, file_name)
+
+    def get(self, params: Dict) -> Dict:
+        """Return the result of a point, None if it is not in the store"""
+        file_name = self._file(point_key(params))
+        if not os.path.exists(file_name):
+            return None
+        with open(file_name) as f:
+            return json.load(f)["result"]
+
+    def put(self, params: Dict, result: Dict):
+        """Save the result of a point
+
+        The file is written to a temporary name and renamed, so an
+        interrupted sweep never leaves half written results.
+        """
+        file_name = self._file(point_key(params))
+        os.makedirs(os.path.dirname(file_name), exist_ok=True)
+        tmp_name = f"{file_name}.{os.getpid()}.tmp"
+        with open(tmp_name, "w") as f:
+            json.dump({"params": params, "result": result}, f)
+        os.replace(tmp_name, file_name)
+
+    def to_dataframe(self) -> pd.DataFrame:
+        """Return all the results as a tidy table, one row per point"""
+        return pd.DataFrame.from_records(list(self))
+
+
+def run_sweep(points: Sequence[Dict], store: ResultStore,
+              n_workers: int = None) -> int:
+    """Run the points that are not in the store yet
+
+    Args:
+        points (Sequence[Dict]): the parameters of the points, see
+                                    sweep_points.
+        store (ResultStore): where the results are saved.
+        n_workers (int, optional): number of processes, by default one per
+                    CPU. With 1 the points run in the current process.
+
+    Returns:
+        int: the number of points computed
+    """
+    missing = [params for params in points if params not in store]
+    logger.info(f"{len(points) - len(missing)} of {len(points)} points "
+                f"already in {store.path}, {len(missing)} to run")
+
+    if n_workers == 1:
+        for ix, params in enumerate(missing, start=1):
+            store.put(params, run_point(params))
+            logger.debug(f"{ix}/{len(missing)} points done")
+        return len(missing)
+
+    with ProcessPoolExecutor(max_workers=n_workers) as executor:
+        futures = {executor.submit(run_point, params): params
+                   for params in missing}
+        for ix, future in enumerate(as_completed(futures), start=1):
+            store.put(futures[future], future.result())
+            logger.debug(f"{ix}/{len(missing)} points done")
+
+    return len(missing)
+
+
+def _parse_list(values: str, cast=float) -> List:
+    return [cast(v) for v in values.split(",")]
+
+
+@click.group()
+def control():
+    """ parameter sweeps of the Schelling dynamics """
+    pass
+
+
+@control.command()
+@click.option("--thresholds", "-t", type=str, default="0.3,0.4,0.5,0.6,0.7",
+              help="comma separated list of thresholds")
+@click.option("--densities", "-d", type=str, default="0.7,0.8,0.9",
+              help="comma separated list of densities")
+@click.option("--grid-sizes", "-g", type=str, default="20,50",
+              help="comma separated list of board sides")
+@click.option("--n-teams", "-n", type=str, default="2",
+              help="comma separated list of numbers of teams")
+@click.option("--repeats", "-r", type=int, default=5)
+@click.option("--max-steps", type=int, default=1000)
+@click.option("--seed", type=int, default=0)
+@click.option("--workers", "-w", type=int, default=None,
+              help="number of processes, one per CPU by default")
+@click.option("--store", "-s", type=click.Path(), default="sweep_results")
+@click.option("--output", "-o", type=click.Path(), default=None,
+              help="export the results as csv")
+def run(thresholds, densities, grid_sizes, n_teams, repeats, max_steps, seed,
+        workers, store, output):
+    """ run a sweep, resuming from the results already in the store """
+    points = sweep_points(_parse_list(thresholds),
+                          _parse_list(densities),
+                          _parse_list(grid_sizes, int),
+                          _parse_list(n_teams, int),
+                          n_repeats=repeats,
+                          max_steps=max_steps,
+                          seed=seed)
+    result_store = ResultStore(store)
+    run_sweep(points, result_store, n_workers=workers)
+
+    if output is not None:
+        result_store.to_dataframe().to_csv(output, index=False)
+        logger.info(f"results exported to {output}")
+
+
+@control.command()
+@click.option("--store", "-s", type=click.Path(exists=True),
+              default="sweep_results")
+@click.option("--output", "-o", type=click.Path(), default="sweep.csv")
+def export(store, output):
+    """ export all the results in the store as csv """
+    ResultStore(store).to_dataframe().to_csv(output, index=False)
+    logger.info(f"results exported to {output}")
+
+
+if __name__ == "__main__":
+    control()
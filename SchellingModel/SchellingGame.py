@@ -15,12 +15,119 @@
 # A copy of the GNU Affero General Public License is in the LICENSE file
 # in the source code repository.
 
+import time
+from collections import deque
+
 import numpy as np
-from scipy.ndimage import convolve
+from loguru import logger
+from scipy.optimize import linear_sum_assignment
 
-from typing import Union, List, Dict
+from dataclasses import dataclass
+from typing import Union, List, Dict, Iterator, Optional, Sequence
 import numpy.typing as npt
 
+from SchellingModel.Kernels import BOUNDARIES, neighbourhood_kernel, \
+    team_masks, happy_tensor
+from SchellingModel.Backends import get_backend
+
+
+@dataclass
+class BoardAnalysis:
+    """ The metrics of a board, as returned by SchellingBoard.analyze
+
+    Attributes:
+        counts (Dict): number of agents of each team and of empty cells.
+        happiness (Dict): fraction of happy agents of each team and "total".
+        segregation (float): the segregation index, -1 if not defined.
+        wrong_moods (np.ndarray): True where the agent shows the wrong mood,
+                                    None if the board has no moods.
+        codes (np.ndarray): the int8 cell codes of the board (to_codes).
+        code_labels (np.ndarray): the label of each code (code_labels).
+    """
+    counts: Dict[str, int]
+    happiness: Dict[str, float]
+    segregation: float
+    wrong_moods: Optional[np.ndarray]
+    codes: np.ndarray
+    code_labels: np.ndarray
+
+    @property
+    def labels(self) -> np.ndarray:
+        """The string matrix of the board, as to_str_matrix"""
+        return self.code_labels[self.codes]
+
+    @property
+    def n_wrong_moods(self) -> int:
+        if self.wrong_moods is None:
+            return 0
+        return int(np.count_nonzero(self.wrong_moods))
+
+
+@dataclass
+class BoardDiff:
+    """ What changed between consecutive boards, as returned by diff_boards
+
+    Every array has one entry per transition, N boards give N - 1 of them.
+
+    Attributes:
+        teams (np.ndarray): the (N, H, W) teams that were compared.
+        team_names (List): the names of the teams.
+        vacated (np.ndarray): (N-1, H, W) agents that left a cell, which is
+                                empty on the next board.
+        occupied (np.ndarray): (N-1, H, W) empty cells where an agent appears.
+        replaced (np.ndarray): (N-1, H, W) cells whose agent changed team.
+        mood_flips (np.ndarray): (N-1, H, W) agents that stayed and changed
+                                mood, None if the boards have no moods.
+        left (np.ndarray): (N-1, T) agents of each team that left a cell.
+        arrived (np.ndarray): (N-1, T) agents of each team that appeared in
+                                a cell.
+    """
+    teams: np.ndarray
+    team_names: List
+    vacated: np.ndarray
+    occupied: np.ndarray
+    replaced: np.ndarray
+    mood_flips: Optional[np.ndarray]
+    left: np.ndarray
+    arrived: np.ndarray
+
+    @property
+    def n_moves(self) -> np.ndarray:
+        """(N-1, T) agents of each team that moved, an agent that left and
+        one of the same team that arrived make a move"""
+        return np.minimum(self.left, self.arrived)
+
+    @property
+    def total_moves(self) -> np.ndarray:
+        """The number of moves of every transition"""
+        return self.n_moves.sum(axis=-1)
+
+    def match_moves(self, transition: int = 0) -> Dict[str, np.ndarray]:
+        """Pair the cells left and reached by each team in a transition
+
+        The pairing minimizes the total distance of the moves, the agents
+        that can not be paired are considered added or removed.
+
+        Returns:
+            Dict: for every team an array of shape (n_moves, 2, 2) with the
+                    (row, column) of the source and of the destination
+        """
+        before = self.teams[transition]
+        after = self.teams[transition + 1]
+
+        moves = {}
+        for ix, team in enumerate(self.team_names, start=1):
+            sources = np.argwhere((before == ix) & (after != ix))
+            destinations = np.argwhere((after == ix) & (before != ix))
+            distances = np.hypot(
+                *(sources[:, np.newaxis, :] -
+                  destinations[np.newaxis, :, :]).transpose(2, 0, 1))
+            rows, columns = linear_sum_assignment(distances)
+            moves[team] = np.stack([sources[rows], destinations[columns]],
+                                   axis=1).reshape(-1, 2, 2)
+
+        return moves
+
 
 class SchellingBoard:
     def __init__(self,
@@ -30,6 +137,10 @@ class SchellingBoard:
                  separator:str="_",
                  mood_map:Dict={"H": 1, "S": -1},
                  empty_value:int=0,
+                 threshold:Union[float, Sequence[float]]=0.5,
+                 boundary:str="constant",
+                 neighbourhood:str="moore",
+                 radius:int=1,
                  ) -> None:
         """ Manages the status of the board of the Schelling game
 
@@ -50,6 +161,18 @@ class SchellingBoard:
                     agent and an integer value. Defaults to {"H": 1, "S": -1}.
             empty_value (int, optional): the integer representing .
                                                 Defaults to 0.
+            threshold (float or Sequence[float], optional): minimum fraction
+                    of neighbours of the same team that makes an agent happy,
+                    either one for all the teams or one per team.
+                    Defaults to 0.5, namely my neighbours >= others' neighbours.
+                    A HappinessRule (or one per team) replaces the fraction
+                    with a custom rule, see SchellingModel.HappinessRules.
+            boundary (str, optional): "constant", the cells beyond the edges
+                    are empty, or "wrap", the board is a torus.
+                    Defaults to "constant".
+            neighbourhood (str, optional): "moore" or "von_neumann", see
+                    neighbourhood_kernel. Defaults to "moore".
+            radius (int, optional): radius of the neighbourhood. Defaults to 1.
         """
 
         if (np.unique(teams).size - 1) > len(team_names):
@@ -68,9 +191,92 @@ class SchellingBoard:
         self.separator = separator
         self.mood_map = mood_map
         self.mood_map_inv = {v: k for k, v in self.mood_map.items()}
+        self.threshold = threshold
+        self.set_neighbourhood(neighbourhood, radius, boundary)
+
+    @classmethod
+    def random(cls, grid_x: int, grid_y: int, n_teams: int = 2,
+               density: float = 0.9, seed=None, **kwargs) -> "SchellingBoard":
+        """Return a board with randomly placed agents
+
+        Args:
+            grid_x (int): number of columns.
+            grid_y (int): number of rows.
+            n_teams (int, optional): number of teams of (almost) equal size.
+            density (float, optional): fraction of occupied cells.
+            seed (optional): seed or np.random.Generator.
+            **kwargs: passed to SchellingBoard, e.g. team_names or threshold.
+        """
+        rng = np.random.default_rng(seed)
+        n_cells = grid_x * grid_y
+        n_agents = int(round(density * n_cells))
 
+        teams = np.zeros(n_cells, dtype=np.int_)
+        positions = rng.permutation(n_cells)[:n_agents]
+        teams[positions] = np.arange(n_agents) % n_teams + 1
 
-        self.same_team_neighbours_cache = {}
+        if "team_names" not in kwargs:
+            kwargs["team_names"] = default_team_names(n_teams)
+
+        return cls(teams=teams.reshape(grid_y, grid_x), **kwargs)
+
+    @property
+    def teams(self):
+        return self._teams
+
+    @teams.setter
+    def teams(self, teams: npt.ArrayLike):
+        # the neighbour counts depend only on the teams, a new board
+        # invalidates them
+        self._teams = teams
+        self._neighbours_cache = None
+        self._happy_cache = None
+
+    @property
+    def threshold(self):
+        return self._threshold
+
+    @threshold.setter
+    def threshold(self, threshold: Union[float, Sequence[float]]):
+        if np.ndim(threshold) > 0 and len(threshold) != self.n_teams:
+            raise ValueError("threshold should have one value per team")
+        self._threshold = threshold
+        self._happy_cache = None
+
+    def set_neighbourhood(self, neighbourhood: str = "moore",
+                          radius: int = 1, boundary: str = "constant"):
+        """Change the neighbourhood of the cells and the board boundary"""
+        if boundary not in BOUNDARIES:
+            raise ValueError(f"boundary should be one of {BOUNDARIES}")
+        self._kernel = neighbourhood_kernel(neighbourhood, radius)
+        self._neighbourhood = neighbourhood
+        self._radius = radius
+        self._boundary = boundary
+        self._neighbours_cache = None
+        self._happy_cache = None
+
+    @property
+    def neighbourhood(self) -> str:
+        return self._neighbourhood
+
+    @property
+    def radius(self) -> int:
+        return self._radius
+
+    @property
+    def boundary(self) -> str:
+        return self._boundary
+
+    @property
+    def kernel(self) -> np.ndarray:
+        return self._kernel
+
+    def neighbourhood_kwargs(self) -> Dict:
+        """Return the arguments that give another board the same
+        neighbourhood and boundary"""
+        return {"neighbourhood": self.neighbourhood,
+                "radius": self.radius,
+                "boundary": self.boundary}
 
     @property
     def n_teams(self):
@@ -151,26 +357,115 @@ class SchellingBoard:
         return mood
 
 
-    def teams_str(self, append_separator=True) -> npt.NDArray[np.str_]:
-        """Return a string representation of the teams matrix"""
-        team_str = np.empty_like(self.teams, dtype=np.str_)
-        for i, team in enumerate(self.team_names):
-            team_str[self.teams == (i + 1)] = \
-                (team + self.separator) if append_separator else team
+    def mood_index(self) -> np.ndarray[np.int_]:
+        """Return the position of each mood in mood_map, counting from 1
 
-        return team_str
+        Cells whose mood is not in mood_map (or boards without moods) are 0.
+        """
+        mood_index = np.zeros(np.shape(self.teams), dtype=np.int_)
+        if self.moods is None:
+            return mood_index
+        for ix, value in enumerate(self.mood_map.values(), start=1):
+            mood_index[self.moods == value] = ix
 
-    def moods_str(self):
-        mood_str = np.empty_like(self.moods, dtype=np.str_)
-        for mood, value in self.mood_map.items():
-            mood_str[self.moods == value] = mood
+        return mood_index
+
+    def label_lut(self) -> npt.NDArray[np.str_]:
+        """Return the label of every (team_index, mood_index) combination
 
+        Like teams_str and moods_str, each part of the label is a single
+        character wide.
+        """
+        team_str = self._team_str_lut(append_separator=True)
+        mood_str = self._mood_str_lut()
+
+        return np.char.add(team_str[:, np.newaxis], mood_str[np.newaxis, :])
+
+    def _team_str_lut(self, append_separator=True):
+        team_str = np.zeros(self.n_teams + 1, dtype=np.str_)
+        team_str[1:] = [(team + self.separator) if append_separator else team
+                        for team in self.team_names]
+        return team_str
+
+    def _mood_str_lut(self):
+        mood_str = np.zeros(len(self.mood_map) + 1, dtype=np.str_)
+        mood_str[1:] = list(self.mood_map.keys())
         return mood_str
 
+    @property
+    def n_codes(self) -> int:
+        """Number of distinct cell codes, see code_lut"""
+        return 1 + self.n_teams * (len(self.mood_map) + 1)
+
+    def code_lut(self) -> np.ndarray[np.int8]:
+        """Return the cell code of every (team_index, mood_index) combination
+
+        see cell_code_lut
+        """
+        return cell_code_lut(self.n_teams, len(self.mood_map))
+
+    def code_labels(self) -> npt.NDArray[np.str_]:
+        """Return the label of each cell code, as in to_str_matrix"""
+        labels = np.zeros(self.n_codes, dtype=self.label_lut().dtype)
+        labels[self.code_lut()[1:].ravel()] = self.label_lut()[1:].ravel()
+        return labels
+
+    def to_codes(self) -> np.ndarray[np.int8]:
+        """Return the board as a matrix of cell codes (see cell_code_lut)"""
+        return self.code_lut()[self.team_index(), self.mood_index()]
+
+    @classmethod
+    def from_codes(cls, codes: npt.ArrayLike,
+                   team_names: List = ["B", "R"],
+                   mood_map: Dict = {"H": 1, "S": -1},
+                   **kwargs) -> "SchellingBoard":
+        """Build a board from a matrix of cell codes
+
+        Args:
+            codes (npt.ArrayLike): the cell codes, see cell_code_lut.
+            team_names (List, optional): the teams used to encode the board.
+            mood_map (Dict, optional): the moods used to encode the board.
+            **kwargs: passed to SchellingBoard.
+        """
+        teams, moods = decode_cell_codes(codes, len(team_names),
+                                         list(mood_map.values()),
+                                         kwargs.get("empty_value", 0))
+        return cls(teams=teams, moods=moods, team_names=team_names,
+                   mood_map=mood_map, **kwargs)
+
+    def codes_to_labels(self, codes: npt.ArrayLike) -> npt.NDArray[np.str_]:
+        """Convert a matrix of cell codes into a matrix of labels"""
+        return self.code_labels()[np.asarray(codes)]
+
+    def labels_to_codes(self, labels: npt.ArrayLike) -> np.ndarray[np.int8]:
+        """Convert a matrix of labels (see to_str_matrix) into cell codes"""
+        code_labels = self.code_labels()
+        if np.unique(code_labels).size != code_labels.size:
+            raise ValueError("the labels of these teams and moods are "
+                             "ambiguous, team names should start with "
+                             "different letters")
+        code_of_label = {label: code for code, label in enumerate(code_labels)}
+
+        unique_labels, inverse = np.unique(np.asarray(labels),
+                                           return_inverse=True)
+        try:
+            unique_codes = np.array([code_of_label[label]
+                                     for label in unique_labels],
+                                    dtype=np.int8)
+        except KeyError as e:
+            raise ValueError(f"unknown label {e}")
+
+        return unique_codes[inverse].reshape(np.shape(labels))
+
+    def teams_str(self, append_separator=True) -> npt.NDArray[np.str_]:
+        """Return a string representation of the teams matrix"""
+        return self._team_str_lut(append_separator)[self.team_index()]
+
+    def moods_str(self):
+        return self._mood_str_lut()[self.mood_index()]
+
     def to_str_matrix(self):
-        return \
-            np.char.add(self.teams_str(append_separator=True),
-                        self.moods_str())
+        return self.label_lut()[self.team_index(), self.mood_index()]
 
     def team_positions(self, team: Union[int, str]):
         team = self.parse_team(team)
@@ -187,150 +482,620 @@ class SchellingBoard:
         return (self.moods == mood)
 
 
-    def same_team_neighbours(self, team: Union[int, str], use_cache=True) ->np.ndarray[np.int_]:
-        team = self.parse_team(team)
+    def team_index(self) -> np.ndarray[np.int_]:
+        """Return the teams matrix where anything that is not a team is 0"""
+        valid = (self.teams >= 1) & (self.teams <= self.n_teams)
+        return np.where(valid, self.teams, 0)
 
-        if use_cache and team in self.same_team_neighbours_cache:
-            return self.same_team_neighbours_cache[team]
+    def neighbours_tensor(self, use_cache=True) -> np.ndarray[np.int_]:
+        """Return the number of neighbours of each team around every cell
 
-        position = self.team_positions(team).astype(int)
+        The counts of all the teams are computed in a single convolution
+        and kept until the teams are reassigned.
 
-        kernel = np.array([[1, 1, 1],
-                           [1, 0, 1],
-                           [1, 1, 1]])
+        Returns:
+            np.ndarray: array of shape (n_teams, grid_y, grid_x), the entry
+                [t, y, x] is the number of agents of team t + 1 around (x, y)
+        """
+        return self._neighbour_counts(use_cache).astype(np.int_)
 
-        return convolve(position, kernel, mode="constant")
+    def _neighbour_counts(self, use_cache=True) -> np.ndarray:
+        """The counts of neighbours_tensor in the small unsigned dtype of
+        the kernels, the cached array itself"""
+        if use_cache and self._neighbours_cache is not None:
+            return self._neighbours_cache
 
-    def model_happy_cells(self, team: Union[int, str]) ->np.ndarray[np.bool_]:
-        """Return a boolean array representing the cells of the team that are happy according to the model"""
-        # TODO implement multiple teams and different thresholds
+        neighbours = get_backend().neighbour_counts(
+            team_masks(self.teams, self.n_teams),
+            self.kernel, self.boundary)
+
+        if use_cache:
+            self._neighbours_cache = neighbours
 
-        other_teams = [t for t in self.team_names if t != team]
+        return neighbours
 
-        my_neighbours = self.same_team_neighbours(team)
+    def same_team_neighbours(self, team: Union[int, str], use_cache=True) ->np.ndarray[np.int_]:
+        team = self.parse_team(team)
 
-        others_neighbours = 0
-        for other_team in other_teams:
-            others_neighbours += self.same_team_neighbours(other_team)
+        return self._neighbour_counts(use_cache)[team - 1].astype(np.int_)
 
-        return my_neighbours >= others_neighbours
+    def model_happy_cells(self, team: Union[int, str]) ->np.ndarray[np.bool_]:
+        """Return a boolean array representing the cells of the team that are happy according to the model"""
+        return self.model_happy_tensor()[self.parse_team(team) - 1]
 
-    def find_wrong_position(self):
+    def model_happy_tensor(self) -> np.ndarray[np.bool_]:
+        """Return a (n_teams, grid_y, grid_x) boolean array
 
-        wrong_mood = np.full_like(self.moods, False)
+        The entry [t, y, x] is True if an agent of team t + 1 would be happy
+        in the cell (x, y), whatever is there now.
+        """
+        return happy_tensor(self._neighbour_counts(), self.threshold)
 
-        for team in self.team_names:
-            team_positions = self.team_positions(team)
-            mood_happy = self.mood_positions("H")
-            mood_sad = self.mood_positions("S")
+    def model_happy_mask(self) -> np.ndarray[np.bool_]:
+        """Return a boolean array that is True where the agent is happy
 
-            happy_cells = self.model_happy_cells(team)
-            sad_cells = ~happy_cells
+        Each agent is judged against the neighbours of its own team, empty
+        cells are never happy.
+        """
+        if self._happy_cache is None:
+            self._happy_cache = get_backend().happy_mask(
+                self._neighbour_counts(),
+                self.team_index(),
+                self.threshold)
+
+        return self._happy_cache
 
-            # if the cell is of the team and is happy, it should be happy
-            wrong_mood[(team_positions & mood_happy) & ~happy_cells] = True
+    def model_moods(self) -> np.ndarray[np.int_]:
+        """Return the moods the agents should show according to the model"""
+        happy_cells = self.model_happy_mask()
+        moods = np.where(happy_cells, self.mood_map["H"], self.mood_map["S"])
+        return np.where(self.team_index() > 0, moods, 0)
+
+    def find_wrong_position(self):
+        """Return a boolean array of the agents showing the wrong mood"""
+        team_index = self.team_index()
+        return self._wrong_moods(self.model_happy_mask(), team_index > 0)
 
-            # if the cell is of the team and is sad, it should be sad
-            wrong_mood[(team_positions & mood_sad) & ~sad_cells] = True
+    def _wrong_moods(self, happy_cells, occupied):
+        # happy agents should show a happy face and sad agents a sad one
+        wrong_mood = (self.mood_positions("H") & ~happy_cells) | \
+                     (self.mood_positions("S") & happy_cells)
 
-        return wrong_mood
+        return wrong_mood & occupied
 
 
     def happyness(self, details=False) -> Dict[str, float]:
         """Return the percentage of happy cells based on the modellized happiness"""
+        team_index = self.team_index()
+        team_count = np.bincount(team_index.ravel(),
+                                 minlength=self.n_teams + 1)
+        return self._happiness(team_index, team_count,
+                               self.model_happy_mask(),
+                               np.count_nonzero(self.teams != self.empty_value))
+
+    def _happiness(self, team_index, team_count, happy_cells,
+                   total_number_of_tokens) -> Dict[str, float]:
+        happy_count = np.bincount(team_index[happy_cells],
+                                  minlength=self.n_teams + 1)
 
         happiness = {}
-        total_happy_cells = 0
-        for team in self.team_names:
-            team_positions = self.team_positions(team)
+        for ix, team in enumerate(self.team_names, start=1):
+            happiness[team] = happy_count[ix] / team_count[ix] \
+                if team_count[ix] > 0 else -1
 
+        happiness["total"] = happy_count[1:].sum() / total_number_of_tokens \
+            if total_number_of_tokens > 0 else -1
+        # todo: fix total happiness
 
-            happy_cells = self.model_happy_cells(team)
-            sad_cells = ~happy_cells
+        return happiness
 
-            # if the cell is of the team and is happy, it should be happy
-            pct_happy = np.sum(team_positions & happy_cells) / np.sum(team_positions) if np.sum(team_positions) > 0 else -1
-            happiness[team] = pct_happy
+    def analyze(self) -> "BoardAnalysis":
+        """Compute all the metrics shown for an uploaded board at once
 
-            total_happy_cells += np.sum(team_positions & happy_cells)
+        The team and mood masks, the neighbour counts and the happy cells
+        are computed a single time and shared by all the metrics.
 
-        total_number_of_tokens = np.sum(~(self.teams == 0))
+        Returns:
+            BoardAnalysis: counts, happiness, segregation, wrong moods and
+                            cell codes of the board.
+        """
+        team_index = self.team_index()
+        empty = self.empty_positions()
+        occupied = team_index > 0
+        happy_cells = self.model_happy_mask()
+
+        team_count = np.bincount(team_index.ravel(),
+                                 minlength=self.n_teams + 1)
+        counts = {team: int(team_count[ix])
+                  for ix, team in enumerate(self.team_names, start=1)}
+        counts["Empty"] = np.count_nonzero(empty)
+
+        happiness = self._happiness(team_index, team_count, happy_cells,
+                                    empty.size - counts["Empty"])
+
+        links, mixed_links = get_backend().link_counts(
+            self.teams, self.empty_value,
+            occupied=~empty,
+            kernel=self.kernel,
+            boundary=self.boundary)
+        segregation = 1 - mixed_links / links if links > 0 else -1
+
+        if self.moods is not None:
+            wrong_moods = self._wrong_moods(happy_cells, occupied)
+        else:
+            wrong_moods = None
 
+        codes = self.code_lut()[team_index, self.mood_index()]
 
-        #happiness["total"]= np.sum(list(happiness.values())) / len(happiness)
-        happiness["total"] = total_happy_cells / total_number_of_tokens if total_number_of_tokens > 0 else -1
-        # todo: fix total happiness
+        return BoardAnalysis(counts=counts,
+                             happiness=happiness,
+                             segregation=segregation,
+                             wrong_moods=wrong_moods,
+                             codes=codes,
+                             code_labels=self.code_labels())
 
-        return happiness
+    def diff(self, other: "SchellingBoard") -> BoardDiff:
+        """Return what changed from this board to other, see diff_boards"""
+        moods = None
+        if self.moods is not None and other.moods is not None:
+            moods = np.stack([self.moods, other.moods])
+        return diff_boards(np.stack([self.teams, other.teams]), moods,
+                           self.team_names, self.empty_value)
 
 
     def segregation(self):
         """
         Return the segregation of the board
 
-        returns 1 - (# of mixed couples / # of couples)
+        returns 1 - (# of mixed couples / # of couples), where a couple is
+        two agents in each other's neighbourhood
         """
-        links = 0
-        mixed_links = 0
-        for i in range(self.teams.shape[0]):
-            for j in range(self.teams.shape[1]):
-                if self.teams[i,j] != self.empty_value:
-                    
-                    if j+1 <= self.teams.shape[1]-1:
-                        if self.teams[i,j] == self.teams[i,j+1]:
-                            links += 1
-                        elif self.teams[i,j+1] != self.empty_value:
-                            mixed_links += 1
-                            links += 1
-                    if i+1 <= self.teams.shape[0]-1:                       
-                        if self.teams[i,j] == self.teams[i+1,j]:
-                            links += 1
-                        elif self.teams[i+1,j] != self.empty_value:
-                            mixed_links += 1
-                            links += 1
- 
-                    if j+1 <= self.teams.shape[1]-1 and i+1 <= self.teams.shape[0]-1:
-                        if self.teams[i,j] == self.teams[i+1,j+1]:
-                            links += 1
-                        elif self.teams[i+1,j+1] != self.empty_value:
-                            mixed_links += 1
-                            links += 1
-
-                    if j-1 >= 0 and i+1 <= self.teams.shape[0]-1:                        
-                        if self.teams[i,j] == self.teams[i+1,j-1]:
-                            links += 1
-                        elif self.teams[i+1,j-1] != self.empty_value:
-                            mixed_links += 1
-                            links += 1
-        
+        links, mixed_links = get_backend().link_counts(
+            self.teams, self.empty_value,
+            kernel=self.kernel,
+            boundary=self.boundary)
+
         if links > 0:
             return 1-mixed_links/links
         else:
             return -1
 
+
+def diff_boards(teams: npt.ArrayLike,
+                moods: npt.ArrayLike = None,
+                team_names: List = ["B", "R"],
+                empty_value: int = 0) -> BoardDiff:
+    """Compare every board of a stack with the next one
+
+    All the transitions are compared at once on the (N, H, W) arrays.
+
+    Args:
+        teams (npt.ArrayLike): (N, H, W) teams of consecutive boards.
+        moods (npt.ArrayLike, optional): (N, H, W) moods of the boards.
+        team_names (List, optional): the names of the teams.
+        empty_value (int, optional): the integer representing an empty cell.
+
+    Returns:
+        BoardDiff: the changes of the N - 1 transitions
+    """
+    teams = np.asarray(teams)
+    if teams.ndim != 3 or teams.shape[0] < 2:
+        raise ValueError("teams should be an (N, H, W) array with N >= 2")
+
+    before, after = teams[:-1], teams[1:]
+    empty_before = before == empty_value
+    empty_after = after == empty_value
+    changed = before != after
+
+    mood_flips = None
+    if moods is not None:
+        moods = np.asarray(moods)
+        mood_flips = ~changed & ~empty_before & (moods[:-1] != moods[1:])
+
+    masks = team_masks(teams, len(team_names))
+    left = np.count_nonzero(masks[:-1] & ~masks[1:], axis=(-2, -1))
+    arrived = np.count_nonzero(masks[1:] & ~masks[:-1], axis=(-2, -1))
+
+    return BoardDiff(teams=teams,
+                     team_names=team_names,
+                     vacated=~empty_before & empty_after,
+                     occupied=empty_before & ~empty_after,
+                     replaced=changed & ~empty_before & ~empty_after,
+                     mood_flips=mood_flips,
+                     left=left,
+                     arrived=arrived)
+
+
+def cell_code_lut(n_teams: int, n_moods: int) -> np.ndarray[np.int8]:
+    """Return the cell code of every (team_index, mood_index) combination
+
+    A cell is encoded in a single small integer:
+        0                         empty cell
+        1 + (t - 1) * M + (m - 1) agent of team t with the m-th mood
+        T * M + t                 agent of team t without a known mood
+    where T is the number of teams and M the number of moods. The agents
+    with a mood come in the order of SchellingBoard.get_all_classes_str.
+
+    Returns:
+        np.ndarray: int8 array of shape (n_teams + 1, n_moods + 1)
+    """
+    lut = np.zeros((n_teams + 1, n_moods + 1), dtype=np.int8)
+    lut[1:, 1:] = np.arange(1, n_teams * n_moods + 1).reshape(n_teams,
+                                                               n_moods)
+    lut[1:, 0] = n_teams * n_moods + np.arange(1, n_teams + 1)
+    return lut
+
+
+def decode_cell_codes(codes: npt.ArrayLike, n_teams: int,
+                      mood_values: Sequence[int], empty_value: int = 0):
+    """Return the teams and moods arrays encoded by cell codes
+
+    Args:
+        codes (npt.ArrayLike): the cell codes, see cell_code_lut.
+        n_teams (int): the number of teams.
+        mood_values (Sequence[int]): the values of the moods, in the order of
+                                        mood_map.
+        empty_value (int, optional): the team value of empty cells.
+
+    Returns:
+        tuple: (teams, moods) arrays with the shape of codes
+    """
+    codes = np.asarray(codes)
+    lut = cell_code_lut(n_teams, len(mood_values))
+    n_codes = lut.max() + 1
+    if codes.size > 0 and not 0 <= codes.min() <= codes.max() < n_codes:
+        raise ValueError("codes out of range for these teams and moods")
+
+    team_of_code = np.full(n_codes, empty_value, dtype=np.int_)
+    mood_of_code = np.zeros(n_codes, dtype=np.int_)
+    team_of_code[lut[1:]] = np.arange(1, n_teams + 1)[:, np.newaxis]
+    mood_of_code[lut[1:, 1:]] = np.asarray(mood_values)[np.newaxis, :]
+
+    return team_of_code[codes], mood_of_code[codes]
+
+
+def default_team_names(n_teams: int) -> List[str]:
+    """Return one single character name per team: B, R, G, Y, P, ..."""
+    names = ["B", "R", "G", "Y", "P"]
+    if n_teams <= len(names):
+        return names[:n_teams]
+    return [str(team) for team in range(1, n_teams + 1)]
+
+
+def relocate_agents(teams: npt.ArrayLike,
+                    movers: npt.ArrayLike,
+                    empty: npt.ArrayLike,
+                    rng: np.random.Generator,
+                    empty_value: int = 0):
+    """Move agents to randomly chosen empty cells, all at the same time
+
+    The cells left by the movers are not available as destinations in the
+    same step. If there are more movers than empty cells, a random subset of
+    the movers is moved.
+
+    Args:
+        teams (npt.ArrayLike): the 2D array of teams.
+        movers (npt.ArrayLike): boolean mask of the agents that want to move.
+        empty (npt.ArrayLike): boolean mask of the empty cells.
+        rng (np.random.Generator): the random number generator.
+        empty_value (int, optional): the integer representing an empty cell.
+
+    Returns:
+        tuple: (new teams array, number of agents moved)
+    """
+    teams = np.asarray(teams)
+    sources = np.flatnonzero(movers)
+    destinations = np.flatnonzero(empty)
+
+    n_moves = min(sources.size, destinations.size)
+    sources = rng.permutation(sources)[:n_moves]
+    destinations = rng.permutation(destinations)[:n_moves]
+
+    new_teams = teams.copy().ravel()
+    new_teams[destinations] = new_teams[sources]
+    new_teams[sources] = empty_value
+
+    return new_teams.reshape(teams.shape), n_moves
+
+
+def best_response_moves(neighbours: npt.ArrayLike,
+                        happy: npt.ArrayLike,
+                        team_index: npt.ArrayLike,
+                        movers: npt.ArrayLike,
+                        empty: npt.ArrayLike):
+    """Choose the destinations of the movers, each to the best empty cell
+
+    The value of a cell for a team is 1 if an agent of the team would be
+    happy there, plus the fraction of its neighbours of the team (1 without
+    neighbours), so happy cells come first. It is computed for every team
+    and cell at once from the neighbour counts; the cells left by the movers
+    are not available in the same step.
+
+    Every team claims its best free cells, as many as its movers still
+    without a destination, and a cell claimed by several teams goes to the
+    team that values it most (the first team on ties). The teams that lost a
+    cell claim again until no claim is left. Then the best cells of each
+    team go to its agents in the worst positions, and an agent moves only if
+    its destination is better than its position. All the ties are broken by
+    the position on the board, the moves do not depend on any random choice.
+
+    Args:
+        neighbours (npt.ArrayLike): (T, H, W) neighbour counts of the teams.
+        happy (npt.ArrayLike): (T, H, W), True where an agent of the team
+                                would be happy, e.g. model_happy_tensor.
+        team_index (npt.ArrayLike): teams with values in [0, T].
+        movers (npt.ArrayLike): boolean mask of the agents that want to move.
+        empty (npt.ArrayLike): boolean mask of the empty cells.
+
+    Returns:
+        tuple: flat indices of the (sources, destinations) of the moves
+    """
+    neighbours = np.asarray(neighbours)
+    n_teams = neighbours.shape[0]
+    total = neighbours.sum(axis=0)
+    fraction = np.where(total > 0, neighbours / np.maximum(total, 1), 1.)
+    value = (np.asarray(happy) + fraction).reshape(n_teams, -1)
+
+    cells = np.flatnonzero(empty)
+    cell_value = value[:, cells]
+    mover_cells = np.flatnonzero(movers)
+    mover_team = np.asarray(team_index).ravel()[mover_cells] - 1
+    mover_value = value[mover_team, mover_cells]
+
+    # a team only wants cells better than the worst position of its movers
+    worst = np.full(n_teams, np.inf)
+    np.minimum.at(worst, mover_team, mover_value)
+    wanted = cell_value > worst[:, np.newaxis]
+    demand = np.bincount(mover_team, minlength=n_teams)
+    owner = np.full(cells.size, -1)
+
+    while True:
+        claims = np.zeros_like(wanted)
+        for team in np.flatnonzero(demand):
+            candidates = np.flatnonzero(wanted[team] & (owner < 0))
+            best = np.argsort(-cell_value[team, candidates], kind="stable")
+            claims[team, candidates[best[:demand[team]]]] = True
+        claimed = np.flatnonzero(claims.any(axis=0))
+        if claimed.size == 0:
+            break
+
+        winners = np.argmax(np.where(claims[:, claimed],
+                                     cell_value[:, claimed], -1), axis=0)
+        owner[claimed] = winners
+        demand -= np.bincount(winners, minlength=n_teams)
+
+    sources, destinations = [], []
+    for team in range(n_teams):
+        team_cells = np.flatnonzero(owner == team)
+        team_cells = team_cells[np.argsort(-cell_value[team, team_cells],
+                                           kind="stable")]
+        team_movers = np.flatnonzero(mover_team == team)
+        team_movers = team_movers[np.argsort(mover_value[team_movers],
+                                             kind="stable")]
+
+        n_pairs = min(team_cells.size, team_movers.size)
+        team_cells, team_movers = team_cells[:n_pairs], team_movers[:n_pairs]
+        better = cell_value[team, team_cells] > mover_value[team_movers]
+        sources.append(mover_cells[team_movers[better]])
+        destinations.append(cells[team_cells[better]])
+
+    return np.concatenate(sources), np.concatenate(destinations)
+
+
 class SchellingGame:
-    def __init__(self, grid_x, grid_y, threshold=0.5, n_teams=2):
+    def __init__(self, grid_x, grid_y, threshold=0.5, n_teams=2,
+                 density=0.9, board=None, seed=None, dynamics="random",
+                 **board_kwargs):
+        """ Simulates the dynamics of the Schelling model
+
+        At every step all the unhappy agents move at the same time, with
+        the "random" dynamics to randomly chosen empty cells, with the
+        "best_response" dynamics to the best empty cells for their team (see
+        best_response_moves).
+
+        Args:
+            grid_x (int): number of columns of the board.
+            grid_y (int): number of rows of the board.
+            threshold (float or Sequence[float], optional): minimum fraction
+                    of neighbours of the same team to be happy, one for all
+                    the teams or one per team. Defaults to 0.5.
+            n_teams (int, optional): number of teams. Defaults to 2.
+            density (float, optional): fraction of occupied cells of the
+                    random starting board, unused if board is given.
+            board (SchellingBoard, optional): the starting board. The game
+                    works on it in place, use from_board to start from a copy.
+            seed (optional): seed or np.random.Generator of the dynamics.
+            dynamics (str, optional): "random" or "best_response".
+                    Defaults to "random".
+            **board_kwargs: passed to the random starting board, e.g.
+                    boundary, neighbourhood and radius.
+        """
         self.grid_x = grid_x
         self.grid_y = grid_y
         self.threshold = threshold
         self.n_teams = n_teams
 
-        if n_teams != 2:
-            raise NotImplementedError("Only implemented for 2 teams")
+        if dynamics not in ("random", "best_response"):
+            raise ValueError("dynamics should be random or best_response")
+        self.dynamics = dynamics
+        self.rng = np.random.default_rng(seed)
+
+        if board is None:
+            board = SchellingBoard.random(grid_x, grid_y, n_teams=n_teams,
+                                          density=density, seed=self.rng,
+                                          **board_kwargs)
+        elif (board.grid_x, board.grid_y) != (grid_x, grid_y):
+            raise ValueError("the board does not match the grid size")
+        elif board.n_teams != n_teams:
+            raise ValueError("the board does not match the number of teams")
+        board.threshold = threshold
+
+        self.board = board
+        self.time = 0
+        self.steps_per_second = None
+        self.trajectory = None
 
     @classmethod
-    def from_board(cls, board_status, threshold=0.5):
-            n_teams = board_status.n_teams
-            return cls(board_status.grid_x, board_status.grid_y, n_teams)
-
-
-
-
-
-
-
-
-
-
+    def from_board(cls, board_status, threshold=0.5, seed=None,
+                   dynamics="random"):
+        """Start a game from a copy of board_status"""
+        board = SchellingBoard(teams=board_status.teams.copy(),
+                               team_names=board_status.team_names,
+                               separator=board_status.separator,
+                               mood_map=board_status.mood_map,
+                               empty_value=board_status.empty_value,
+                               threshold=threshold,
+                               **board_status.neighbourhood_kwargs())
+        board.moods = board.model_moods()
+
+        return cls(board.grid_x, board.grid_y, threshold=threshold,
+                   n_teams=board.n_teams, board=board, seed=seed,
+                   dynamics=dynamics)
+
+    def unhappy_agents(self) -> np.ndarray:
+        """Return a boolean array, True where the agent wants to move"""
+        board = self.board
+        return (board.team_index() > 0) & ~board.model_happy_mask()
+
+    def step(self) -> Dict:
+        """Move all the unhappy agents once
+
+        Returns:
+            Dict: the record of the step, see status.
+        """
+        board = self.board
+        if self.dynamics == "best_response":
+            sources, destinations = best_response_moves(
+                board._neighbour_counts(),
+                board.model_happy_tensor(),
+                board.team_index(),
+                self.unhappy_agents(),
+                board.empty_positions())
+            teams = board.teams.copy().ravel()
+            teams[destinations] = teams[sources]
+            teams[sources] = board.empty_value
+            board.teams = teams.reshape(board.teams.shape)
+            moved = sources.size
+        else:
+            board.teams, moved = relocate_agents(board.teams,
+                                                 self.unhappy_agents(),
+                                                 board.empty_positions(),
+                                                 self.rng,
+                                                 board.empty_value)
+        board.moods = board.model_moods()
+        self.time += 1
+
+        return self.status(moved=moved)
+
+    def status(self, moved=0) -> Dict:
+        """Return the step, the agents moved, the happiness and the
+        segregation of the current board"""
+        return {"step": self.time,
+                "moved": moved,
+                "happiness": self.board.happyness()["total"],
+                "segregation": self.board.segregation()}
+
+    def iterate(self, n_steps: Optional[int] = None, stop_when_stable=True,
+                stop_on_cycle: Optional[bool] = None,
+                n_states: int = 16,
+                max_period: int = 256) -> Iterator[Dict]:
+        """Run the dynamics lazily, one step record at a time
+
+        The records are those of status, with one more key, "period": the
+        number of steps since the same board was last seen, None for a new
+        board. A period of 1 is a fixed point, the board did not change.
+        Boards are compared by a short hash (see Trajectory.board_key), only
+        the hashes of the last max_period boards are kept: a board seen
+        again after more steps counts as new, longer cycles are not
+        detected. The boards themselves are in self.trajectory, which keeps
+        the last n_states full boards and the moves of all the steps.
+
+        The best_response dynamics is deterministic, a board seen again
+        repeats forever, so by default the run stops there. With random
+        relocation a board seen again does not mean that the run repeats
+        itself, so by default only fixed points stop the run.
 
+        Args:
+            n_steps (int, optional): maximum number of steps, None for no
+                                        limit.
+            stop_when_stable (bool, optional): stop at a fixed point.
+            stop_on_cycle (bool, optional): stop as soon as a board is seen
+                    again. Defaults to True for the best_response dynamics
+                    and to False for the random one.
+            n_states (int, optional): number of full boards kept.
+            max_period (int, optional): longest cycle detected, the number
+                    of past board hashes kept. Defaults to 256.
+
+        Yields:
+            Dict: the record before the first step and after each step.
+        """
+        # BoardEncoding imports this module
+        from SchellingModel.Trajectory import Trajectory, board_key
+
+        if stop_on_cycle is None:
+            stop_on_cycle = self.dynamics == "best_response"
+        if max_period < 1:
+            raise ValueError("max_period should be at least 1")
+
+        board = self.board
+        self.trajectory = Trajectory(board.teams, step=self.time,
+                                     n_states=n_states)
+        # the step each hash was last seen at, and the hashes by step
+        key = board_key(board)
+        seen = {key: self.time}
+        window = deque([(self.time, key)])
+        yield dict(self.status(), period=None)
+
+        n_done = 0
+        while n_steps is None or n_done < n_steps:
+            record = self.step()
+            n_done += 1
+            self.trajectory.append(board.teams)
+
+            key = board_key(board)
+            last_seen = seen.get(key)
+            seen[key] = self.time
+            window.append((self.time, key))
+            if len(window) > max_period:
+                old_step, old_key = window.popleft()
+                # unless the board was seen again since
+                if seen[old_key] == old_step:
+                    del seen[old_key]
+
+            record["period"] = None if last_seen is None \
+                else self.time - last_seen
+            yield record
+
+            if record["period"] == 1 and stop_when_stable:
+                break
+            if record["period"] is not None and stop_on_cycle:
+                break
+
+    def run(self, n_steps: int, stop_when_stable=True,
+            stop_on_cycle: Optional[bool] = None,
+            max_period: int = 256) -> List[Dict]:
+        """Run the dynamics
 
+        Args:
+            n_steps (int): maximum number of steps.
+            stop_when_stable (bool, optional): stop as soon as no agent moves.
+            stop_on_cycle (bool, optional): stop as soon as a board is seen
+                    again, see iterate.
+            max_period (int, optional): longest cycle detected, see iterate.
+
+        Returns:
+            List[Dict]: the status before the first step and after each step,
+                        see iterate.
+        """
+        start = time.perf_counter()
+        history = list(self.iterate(n_steps, stop_when_stable,
+                                    stop_on_cycle, max_period=max_period))
+        elapsed = time.perf_counter() - start
+
+        n_done = len(history) - 1
+        self.steps_per_second = n_done / elapsed if elapsed > 0 else None
+        logger.info(f"{n_done} steps on a {self.grid_x}x{self.grid_y} board"
+                    f" in {elapsed:.3f} s ({self.steps_per_second or 0:.1f}"
+                    f" steps/s)")
+
+        return history
@@ -0,0 +1,291 @@
+# Copyright (C) 2022-present Associació Heuristica <info@heuristica.barcelona>
+#                      and   Dimitri Marinelli <dimi.marin@proton.me>
+#
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# A copy of the GNU Affero General Public License is in the LICENSE file
+# in the source code repository.
+
+""" Tiled multi-process board kernels
+
+For boards of a million cells and more the kernels of SchellingModel.Kernels
+run on tiles in a process pool. The arrays go through shared memory, so the
+workers read the board and write their part of the result in place; each
+tile is read with a halo of kernel radius cells around it, which is all the
+kernel needs to compute its core exactly. Wrapped boundaries fill the halo
+from the opposite edge.
+
+TiledBackend implements the interface of SchellingModel.Backends, select it
+with set_backend("tiled", n_workers=..., tile_size=...) to tile all the
+boards and the simulation steps.
+"""
+import os
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing.shared_memory import SharedMemory
+
+import numpy as np
+
+from typing import List, Sequence, Tuple, Union
+import numpy.typing as npt
+
+from SchellingModel import Kernels
+from SchellingModel.Kernels import MOORE_KERNEL, BOUNDARIES
+
+Tile = Tuple[int, int, int, int]
+
+
+def tile_bounds(height: int, width: int, tile_size: int) -> List[Tile]:
+    """Split a grid in tiles of at most tile_size x tile_size cells
+
+    Returns:
+        List[Tile]: the (y0, y1, x0, x1) bounds of every tile
+    """
+    return [(y0, min(y0 + tile_size, height), x0, min(x0 + tile_size, width))
+            for y0 in range(0, height, tile_size)
+            for x0 in range(0, width, tile_size)]
+
+
+def tile_window(array: np.ndarray, tile: Tile, halo: Tuple[int, int],
+                boundary: str = "constant", fill=0) -> np.ndarray:
+    """Return the tile of the last two axes of array with a halo around it
+
+    Beyond the edges of the grid the halo is filled with fill, or with the
+    cells of the opposite edge for the "wrap" boundary.
+    """
+    y0, y1, x0, x1 = tile
+    halo_y, halo_x = halo
+    height, width = array.shape[-2:]
+
+    if boundary == "wrap":
+        rows = np.arange(y0 - halo_y, y1 + halo_y) % height
+        columns = np.arange(x0 - halo_x, x1 + halo_x) % width
+        return array[..., rows[:, np.newaxis], columns]
+
+    top, bottom = max(y0 - halo_y, 0), min(y1 + halo_y, height)
+    left, right = max(x0 - halo_x, 0), min(x1 + halo_x, width)
+    padding = [(0, 0)] * (array.ndim - 2) + \
+              [(top - (y0 - halo_y), y1 + halo_y - bottom),
+               (left - (x0 - halo_x), x1 + halo_x - right)]
+    return np.pad(array[..., top:bottom, left:right], padding,
+                  constant_values=fill)
+
+
+class _Shared:
+    """ A numpy array in shared memory, by name in the workers """
+
+    def __init__(self, shape, dtype, name=None) -> None:
+        self.shape, self.dtype = tuple(shape), np.dtype(dtype)
+        if name is None:
+            size = max(int(np.prod(shape)) * self.dtype.itemsize, 1)
+            self.memory = SharedMemory(create=True, size=size)
+        else:
+            self.memory = SharedMemory(name=name)
+        self.array = np.ndarray(self.shape, self.dtype,
+                                buffer=self.memory.buf)
+
+    @classmethod
+    def copy_of(cls, array: np.ndarray) -> "_Shared":
+        shared = cls(array.shape, array.dtype)
+        shared.array[...] = array
+        return shared
+
+    def spec(self):
+        """What a worker needs to attach to the array"""
+        return self.shape, self.dtype.str, self.memory.name
+
+    def close(self, unlink=False):
+        del self.array
+        self.memory.close()
+        if unlink:
+            self.memory.unlink()
+
+
+def _neighbour_counts_tile(masks_spec, counts_spec, tile, kernel, boundary):
+    masks, counts = _Shared(*masks_spec), _Shared(*counts_spec)
+    try:
+        y0, y1, x0, x1 = tile
+        halo_y, halo_x = kernel.shape[0] // 2, kernel.shape[1] // 2
+        window = tile_window(masks.array, tile, (halo_y, halo_x), boundary)
+        # the halo holds all the neighbours, the window has no boundary
+        window_counts = Kernels.neighbour_counts(window, kernel, "constant")
+        counts.array[..., y0:y1, x0:x1] = \
+            window_counts[..., halo_y:halo_y + y1 - y0,
+                          halo_x:halo_x + x1 - x0]
+    finally:
+        masks.close()
+        counts.close()
+
+
+def _happy_mask_tile(neighbours_spec, team_index_spec, happy_spec, tile,
+                     threshold):
+    neighbours, team_index, happy = _Shared(*neighbours_spec), \
+        _Shared(*team_index_spec), _Shared(*happy_spec)
+    try:
+        y0, y1, x0, x1 = tile
+        happy.array[..., y0:y1, x0:x1] = Kernels.happy_mask(
+            neighbours.array[..., y0:y1, x0:x1],
+            team_index.array[..., y0:y1, x0:x1],
+            threshold)
+    finally:
+        neighbours.close()
+        team_index.close()
+        happy.close()
+
+
+def _link_counts_tile(teams_spec, occupied_spec, tile, kernel, boundary):
+    teams, occupied = _Shared(*teams_spec), _Shared(*occupied_spec)
+    try:
+        y0, y1, x0, x1 = tile
+        height, width = y1 - y0, x1 - x0
+        halo_y, halo_x = kernel.shape[0] // 2, kernel.shape[1] // 2
+        team_window = tile_window(teams.array, tile, (halo_y, halo_x),
+                                  boundary)
+        occupied_window = tile_window(occupied.array, tile, (halo_y, halo_x),
+                                      boundary, fill=False)
+
+        core = np.s_[..., halo_y:halo_y + height, halo_x:halo_x + width]
+        links = np.zeros(teams.shape[0], dtype=np.int64)
+        mixed_links = np.zeros(teams.shape[0], dtype=np.int64)
+        # the links of the agents in the core, each pair of agents once
+        for dy, dx in Kernels._half_kernel_offsets(kernel):
+            other = np.s_[..., halo_y + dy:halo_y + dy + height,
+                          halo_x + dx:halo_x + dx + width]
+            linked = occupied_window[core] & occupied_window[other]
+            links += np.count_nonzero(linked, axis=(-2, -1))
+            mixed_links += np.count_nonzero(
+                linked & (team_window[core] != team_window[other]),
+                axis=(-2, -1))
+        return links, mixed_links
+    finally:
+        teams.close()
+        occupied.close()
+
+
+class TiledBackend:
+    name = "tiled"
+
+    def __init__(self, n_workers: int = None, tile_size: int = 256,
+                 min_cells: int = 250_000) -> None:
+        """ The board kernels on tiles, in a pool of processes
+
+        Args:
+            n_workers (int, optional): number of processes, one per CPU by
+                                        default.
+            tile_size (int, optional): side of the tiles. Defaults to 256.
+            min_cells (int, optional): smaller boards are computed in the
+                    current process, where they are faster.
+        """
+        self.n_workers = n_workers or os.cpu_count()
+        self.tile_size = tile_size
+        self.min_cells = min_cells
+        self._executor = None
+
+    @property
+    def executor(self) -> ProcessPoolExecutor:
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(max_workers=self.n_workers)
+        return self._executor
+
+    def close(self):
+        """Stop the worker processes"""
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+
+    def _tiled(self, array: np.ndarray) -> bool:
+        return array.shape[-2] * array.shape[-1] >= self.min_cells
+
+    def neighbour_counts(self, masks: npt.ArrayLike,
+                         kernel: npt.ArrayLike = MOORE_KERNEL,
+                         boundary: str = "constant") -> np.ndarray:
+        masks = np.asarray(masks)
+        kernel = np.asarray(kernel)
+        if not self._tiled(masks):
+            return Kernels.neighbour_counts(masks, kernel, boundary)
+        if boundary not in BOUNDARIES:
+            raise ValueError(f"boundary should be one of {BOUNDARIES}")
+
+        dtype = np.min_scalar_type(max(int(kernel.sum()), 1))
+        shared_masks = _Shared.copy_of(masks.astype(bool))
+        shared_counts = _Shared(masks.shape, dtype)
+        try:
+            futures = [self.executor.submit(
+                _neighbour_counts_tile, shared_masks.spec(),
+                shared_counts.spec(), tile, kernel, boundary)
+                for tile in tile_bounds(*masks.shape[-2:], self.tile_size)]
+            for future in futures:
+                future.result()
+            return shared_counts.array.copy()
+        finally:
+            shared_masks.close(unlink=True)
+            shared_counts.close(unlink=True)
+
+    def happy_mask(self, neighbours: npt.ArrayLike,
+                   team_index: npt.ArrayLike,
+                   threshold: Union[float, Sequence[float]] = 0.5
+                   ) -> np.ndarray:
+        neighbours = np.asarray(neighbours)
+        team_index = np.asarray(team_index)
+        if not self._tiled(team_index):
+            return Kernels.happy_mask(neighbours, team_index, threshold)
+
+        shared_neighbours = _Shared.copy_of(neighbours)
+        shared_team_index = _Shared.copy_of(team_index)
+        shared_happy = _Shared(team_index.shape, bool)
+        try:
+            futures = [self.executor.submit(
+                _happy_mask_tile, shared_neighbours.spec(),
+                shared_team_index.spec(), shared_happy.spec(), tile,
+                threshold)
+                for tile in tile_bounds(*team_index.shape[-2:],
+                                        self.tile_size)]
+            for future in futures:
+                future.result()
+            return shared_happy.array.copy()
+        finally:
+            shared_neighbours.close(unlink=True)
+            shared_team_index.close(unlink=True)
+            shared_happy.close(unlink=True)
+
+    def link_counts(self, teams: npt.ArrayLike, empty_value: int = 0,
+                    occupied: npt.ArrayLike = None,
+                    kernel: npt.ArrayLike = MOORE_KERNEL,
+                    boundary: str = "constant"):
+        teams = np.asarray(teams)
+        kernel = np.asarray(kernel)
+        if not self._tiled(teams):
+            return Kernels.link_counts(teams, empty_value, occupied, kernel,
+                                       boundary)
+        if boundary not in BOUNDARIES:
+            raise ValueError(f"boundary should be one of {BOUNDARIES}")
+        if occupied is None:
+            occupied = teams != empty_value
+
+        stack_shape = (-1,) + teams.shape[-2:]
+        shared_teams = _Shared.copy_of(teams.reshape(stack_shape))
+        shared_occupied = _Shared.copy_of(
+            np.asarray(occupied, dtype=bool).reshape(stack_shape))
+        try:
+            futures = [self.executor.submit(
+                _link_counts_tile, shared_teams.spec(),
+                shared_occupied.spec(), tile, kernel, boundary)
+                for tile in tile_bounds(*teams.shape[-2:], self.tile_size)]
+            counts = [future.result() for future in futures]
+        finally:
+            shared_teams.close(unlink=True)
+            shared_occupied.close(unlink=True)
+
+        links = sum(c[0] for c in counts).reshape(teams.shape[:-2])
+        mixed_links = sum(c[1] for c in counts).reshape(teams.shape[:-2])
+        if teams.ndim == 2:
+            return int(links), int(mixed_links)
+        return links, mixed_links
@@ -0,0 +1,138 @@
+# Copyright (C) 2022-present Associació Heuristica <info@heuristica.barcelona>
+#                      and   Dimitri Marinelli <dimi.marin@proton.me>
+#
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# A copy of the GNU Affero General Public License is in the LICENSE file
+# in the source code repository.
+
+""" Bounded history of a simulation
+
+A Trajectory keeps the full teams array of the last few steps only, in a
+ring buffer. Every step is also stored as a delta, the cells that changed
+with their team before and after the step, which for the Schelling dynamics
+is two cells per moved agent. Any older board is rebuilt by undoing the
+deltas from the oldest full state still in the buffer, so a long run costs a
+few full boards plus its moves, not a full board per step.
+
+Boards are identified by board_key, a short hash of their binary encoding,
+which is how SchellingGame.iterate recognizes fixed points and cycles.
+"""
+import hashlib
+from collections import deque
+
+import numpy as np
+
+from dataclasses import dataclass
+from typing import Dict, Optional
+import numpy.typing as npt
+
+from SchellingModel.SchellingGame import SchellingBoard
+from SchellingModel.BoardEncoding import encode_board
+
+
+def board_key(board: SchellingBoard) -> bytes:
+    """Return a 16 bytes hash of the board, see BoardEncoding.encode_board"""
+    return hashlib.blake2b(encode_board(board), digest_size=16).digest()
+
+
+@dataclass
+class StepDelta:
+    """ The cells changed by a step
+
+    Attributes:
+        cells (np.ndarray): flat indices of the changed cells.
+        before (np.ndarray): their teams before the step.
+        after (np.ndarray): their teams after the step.
+    """
+    cells: np.ndarray
+    before: np.ndarray
+    after: np.ndarray
+
+    @classmethod
+    def between(cls, before: np.ndarray, after: np.ndarray) -> "StepDelta":
+        """Return the delta that turns before into after"""
+        cells = np.flatnonzero(before != after).astype(np.int32)
+        return cls(cells, before.flat[cells], after.flat[cells])
+
+    @property
+    def nbytes(self) -> int:
+        return self.cells.nbytes + self.before.nbytes + self.after.nbytes
+
+
+class Trajectory:
+    def __init__(self, teams: npt.ArrayLike, step: int = 0,
+                 n_states: int = 16) -> None:
+        """ The teams of every step of a run, in bounded memory
+
+        Args:
+            teams (npt.ArrayLike): the teams at the first step, copied.
+            step (int, optional): the first step. Defaults to 0.
+            n_states (int, optional): number of full boards kept, the most
+                                        recent ones. Defaults to 16.
+        """
+        if n_states < 1:
+            raise ValueError("at least one full state must be kept")
+
+        self.first_step = step
+        self.states = deque([(step, np.array(teams))], maxlen=n_states)
+        self.deltas: Dict[int, StepDelta] = {}
+
+    @property
+    def last_step(self) -> int:
+        return self.states[-1][0]
+
+    def __len__(self) -> int:
+        return self.last_step - self.first_step + 1
+
+    @property
+    def nbytes(self) -> int:
+        """The memory used by the stored boards and deltas"""
+        return sum(teams.nbytes for _, teams in self.states) + \
+            sum(delta.nbytes for delta in self.deltas.values())
+
+    def append(self, teams: npt.ArrayLike) -> StepDelta:
+        """Record the teams of the next step
+
+        Returns:
+            StepDelta: the cells changed since the previous step
+        """
+        step, previous = self.states[-1]
+        teams = np.array(teams)
+        if teams.shape != previous.shape:
+            raise ValueError("the board does not match the trajectory")
+
+        delta = StepDelta.between(previous, teams)
+        self.deltas[step + 1] = delta
+        self.states.append((step + 1, teams))
+        return delta
+
+    def teams(self, step: Optional[int] = None) -> np.ndarray:
+        """Return the teams at a step, by default the last one
+
+        Steps older than the ring buffer are rebuilt from the deltas.
+        """
+        if step is None:
+            step = self.last_step
+        if not self.first_step <= step <= self.last_step:
+            raise IndexError(f"step {step} is not in the trajectory "
+                             f"({self.first_step}-{self.last_step})")
+
+        oldest, teams = self.states[0]
+        if step >= oldest:
+            return self.states[step - oldest][1].copy()
+
+        teams = teams.copy()
+        for undo in range(oldest, step, -1):
+            delta = self.deltas[undo]
+            teams.flat[delta.cells] = delta.before
+        return teams
@@ -27,8 +27,12 @@ import tensorflow as tf
 import cv2
 
 from SchellingModel.SchellingGame import SchellingBoard
-
-target_size = (75, 75)
+from VisualDetector.ModelRegistry import Predictor, get_predictor
+from VisualDetector.InferenceWorker import get_worker
+# the cell helpers live with the image preprocessing, which does not need
+# tensorflow, and are still importable from here
+from VisualDetector.ImagePreprocessing import target_size, cell_view, \
+    normalize_cells, generate_cell_imgs_vect
 
 
 def generate_cell_imgs(img_corrected, grid_x, grid_y):
@@ -66,13 +70,20 @@ def generate_cell_imgs(img_corrected, grid_x, grid_y):
     return positions, cells
 
 
+def _get_predictor(model, backend="auto"):
+    """The predictor of a model path from the process-wide registry, or the
+    model itself if it is already a Predictor"""
+    if isinstance(model, Predictor):
+        return model
+    return get_predictor(model, backend)
+
+
 def detect_labels(corrected_image,  grid_x, grid_y, model, return_label_img=False):
     labels = {'B_H': 0, 'B_S': 1, 'Empty': 2, 'R_H': 3, 'R_S': 4}
     int2label = {v: k for k, v in labels.items()}
 
 
-    logger.info("loading model")
-    model = tf.keras.models.load_model(model)
+    predictor = _get_predictor(model)
 
     logger.info("loading image")
     positions, cells = generate_cell_imgs(corrected_image, grid_x, grid_y)
@@ -87,7 +98,7 @@ def detect_labels(corrected_image,  grid_x, grid_y, model, return_label_img=Fals
         x = x.reshape((1,) + x.shape)
 
         logger.info(f"predicting {(position[0], position[1])}")
-        classes = model.predict(x)
+        classes = predictor.predict(x)
 
         for key, value in labels.items():
             logger.info(f"{key}: {classes[0][value] :.2%}")
@@ -125,41 +136,6 @@ def detect_labels(corrected_image,  grid_x, grid_y, model, return_label_img=Fals
     return label_matrix
 
 
-def generate_cell_imgs_vect(img_corrected, grid_x, grid_y):
-    #TODO Bug for rectangular images
-
-    # cell_size = int(img_corrected.shape[1] / grid_x)
-    cell_size = target_size[0]
-    # assert cell_size == int(img_corrected.shape[0] / grid_y), \
-    #    "cell size is not the same for x and y"
-
-    target_width = grid_x * target_size[0]
-    target_height = grid_y * target_size[1]
-
-    if (img_corrected.shape[0], img_corrected.shape[1]) != \
-            (target_height, target_width):
-        logger.info(f"resizing image to {(target_width, target_height)}")
-        img_corrected = cv2.resize(img_corrected,
-                                   (target_width, target_height))
-
-    #dataset = img_corrected.reshape(img_corrected.shape[1] // target_size[1],
-    #                                target_size[1],
-    #                                img_corrected.shape[0] // target_size[0],
-    #                                target_size[0], img_corrected.shape[2])
-    dataset = img_corrected.reshape(img_corrected.shape[0] // target_size[0],
-                                    target_size[0],
-                                    img_corrected.shape[1] // target_size[1],
-                                    target_size[1], img_corrected.shape[2])
-    dataset = dataset.swapaxes(1, 2)
-
-    dataset = dataset.reshape(-1, target_size[0], target_size[1],
-                              img_corrected.shape[2])
-
-    logger.info(f"dataset shape: {dataset.shape}")
-
-    return dataset
-
-
 def decode_labels(label_matrix):
     labels = {'B_H': 0, 'B_S': 1, 'Emp': 2, 'R_H': 3, 'R_S': 4}
     int2label = {v: k for k, v in labels.items()}
@@ -181,24 +157,21 @@ def decode_labels(label_matrix):
     return teams, moods
     
 
-def detect_labels_fast(corrected_image,  grid_x, grid_y, model ):
-    # TODO Bug for rectangular images
-
-    logger.info("loading model")
-    model = tf.keras.models.load_model(model)
+def detect_labels_fast(corrected_image,  grid_x, grid_y, model,
+                       backend="auto"):
+    # the sessions of the app share the inference thread of the model
+    predictor = model if isinstance(model, Predictor) \
+        else get_worker(model, backend)
 
     logger.info("loading image")
-    cells = generate_cell_imgs_vect(corrected_image, grid_x, grid_y)
-    # import matplotlib.pylab as plt
-    # plt.figure(figsize=(10, 10))
-    # plt.imshow(cells[20])
-    # plt.savefig("test.png")
-    print(f"cells shape: {cells.shape} and cells[20] shape: {cells[20].shape}")
+    cells = cell_view(corrected_image, grid_x, grid_y)
+    logger.debug(f"cells shape: {cells.shape}")
 
     logger.info(f"predicting all cells at once")
 
-    x = cells / 255
-    class_probabilities = model.predict(x)
+    # a single float32 copy of the pixels, the model input
+    x = normalize_cells(cells)
+    class_probabilities = predictor.predict(x)
 
     most_probable_classes = class_probabilities.argmax(axis=-1)#np.argmax(class_probabilities, axis=1)
     label_matrix = most_probable_classes.reshape((grid_y, grid_x))
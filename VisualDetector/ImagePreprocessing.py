@@ -19,6 +19,9 @@ import cv2
 import numpy as np
 from loguru import logger
 
+# (width, height) of the cell images given to the label prediction models
+target_size = (75, 75)
+
 
 def prepare_img_for_boundary(img, show=False,
                              blurry_kernel_size=5,
@@ -119,6 +122,135 @@ def find_largest_box(img, return_first_n_boxes = 1):
         raise ValueError("No box found in image")
 
 
+def downscale(img, max_side=1024):
+    """Downscale image so that its longest side is at most max_side
+
+    Args:
+        img: image
+        max_side: longest side of the downscaled image in pixels
+
+    Returns:
+        downscaled image, or img itself when already small enough,
+        and the (x, y) scale factors from img to the downscaled image
+
+    """
+    scale = max_side / max(img.shape[0], img.shape[1])
+    if scale >= 1:
+        return img, (1.0, 1.0)
+    size = (max(1, round(img.shape[1] * scale)),
+            max(1, round(img.shape[0] * scale)))
+    small = cv2.resize(img, size, interpolation=cv2.INTER_AREA)
+    # the exact factors differ along the axes by the rounding of the size
+    return small, (small.shape[1] / img.shape[1],
+                   small.shape[0] / img.shape[0])
+
+
+def upscale_box(box, scale):
+    """Map the corners of a box found on an image downscaled by scale
+    back to the original image
+
+    Args:
+        box: (4, 1, 2) corners (x, y) on the downscaled image
+        scale: the (x, y) scale factors returned by downscale
+
+    Returns:
+        (4, 1, 2) float32 corners on the original image
+
+    """
+    # pixel centres: pixel i of the small image covers [i, i + 1) / scale
+    scale = np.asarray(scale, np.float32)
+    return ((np.asarray(box, np.float32) + 0.5) / scale - 0.5).astype(
+        np.float32)
+
+
+def refine_box_corners(img, box, window=15, search_radius=None):
+    """Refine the corners of a box to sub-pixel accuracy
+
+    cornerSubPix runs on a small patch around each corner only, the rest of
+    the image is never converted or filtered.
+
+    Args:
+        img: original image
+        box: (4, 1, 2) corners (x, y) of the box on img
+        window: half side of the cornerSubPix search window in pixels
+        search_radius: half side of the patch cut around each corner,
+                       defaults to twice the window
+
+    Returns:
+        (4, 1, 2) float32 refined corners
+
+    """
+    if search_radius is None:
+        search_radius = 2 * window
+    criteria = (cv2.TERM_CRITERIA_EPS + cv2.TERM_CRITERIA_MAX_ITER, 30, 0.01)
+    height, width = img.shape[:2]
+
+    refined = np.asarray(box, np.float32).reshape(-1, 1, 2).copy()
+    for corner in refined:
+        x, y = corner[0]
+        left = int(max(0, np.floor(x) - search_radius))
+        top = int(max(0, np.floor(y) - search_radius))
+        right = int(min(width, np.ceil(x) + search_radius + 1))
+        bottom = int(min(height, np.ceil(y) + search_radius + 1))
+
+        patch = img[top:bottom, left:right]
+        if patch.ndim == 3:
+            patch = cv2.cvtColor(patch, cv2.COLOR_BGR2GRAY)
+        # the window has to fit in the patch
+        half = min(window, (min(patch.shape) - 5) // 2)
+        if half < 2:
+            logger.warning(f"corner {x:.1f}, {y:.1f} too close to the "
+                           f"image border to be refined")
+            continue
+
+        local = np.array([[[x - left, y - top]]], np.float32)
+        cv2.cornerSubPix(patch, local, (half, half), (-1, -1), criteria)
+        corner[0] = local[0, 0] + (left, top)
+
+    return refined
+
+
+def find_box_downscaled(img, max_side=1024, return_first_n_boxes=1,
+                        refine=False, refine_window=15,
+                        **boundary_options):
+    """Find the largest boxes on a downscaled copy of the image
+
+    The threshold and the contours, the slow part of the boundary detection
+    on a phone photo, run on an image of at most max_side pixels per side.
+    The corners are then mapped back to the original image and optionally
+    refined there with refine_box_corners.
+
+    The kernel sizes of boundary_options are in pixels of the downscaled
+    image.
+
+    Args:
+        img: original image
+        max_side: longest side of the image used for the detection
+        return_first_n_boxes: as in find_largest_box
+        refine: refine the corners to sub-pixel accuracy on img
+        refine_window: half side of the refinement window in pixels of img
+        **boundary_options: passed to prepare_img_for_boundary
+
+    Returns:
+          (4, 1, 2) float32 corners of the largest box on img, or a list of
+          them when return_first_n_boxes > 1
+
+    """
+    small, scale = downscale(img, max_side)
+    logger.info(f"Finding boundary on image downscaled to "
+                f"{small.shape[1]}x{small.shape[0]}")
+
+    threshold_img = prepare_img_for_boundary(small, **boundary_options)
+    found = find_largest_box(threshold_img, return_first_n_boxes)
+    boxes = found if return_first_n_boxes > 1 else [found]
+
+    boxes = [upscale_box(box, scale) for box in boxes]
+    if refine:
+        boxes = [refine_box_corners(img, box, refine_window) for box in boxes]
+
+    return boxes if return_first_n_boxes > 1 else boxes[0]
+
+
 def correct_perspective(img, box, grid_size):
     """Correct perspective of image
 
@@ -164,3 +296,77 @@ def correct_perspective(img, box, grid_size):
     logger.info(f"Corrected perspective of image to size {destination_size}")
 
     return dst
+
+
+def cell_view(img_corrected, grid_x, grid_y):
+    """ The cells of the board as a view of the image, without copies
+
+    The image is resized first if it is not grid_x by grid_y cells of
+    target_size (width, height) pixels.
+
+    Args:
+        img_corrected (np.ndarray): the corrected image of the board,
+                                    (height, width, channels)
+        grid_x (int): number of columns of the board
+        grid_y (int): number of rows of the board
+
+    Returns:
+        read-only (grid_y, grid_x, cell height, cell width, channels) view,
+        cell [y, x] is the cell in row y and column x of the board
+    """
+    cell_width, cell_height = target_size
+    target_width = grid_x * cell_width
+    target_height = grid_y * cell_height
+
+    if (img_corrected.shape[0], img_corrected.shape[1]) != \
+            (target_height, target_width):
+        logger.info(f"resizing image to {(target_width, target_height)}")
+        img_corrected = cv2.resize(img_corrected,
+                                   (target_width, target_height))
+
+    stride_y, stride_x = img_corrected.strides[:2]
+    return np.lib.stride_tricks.as_strided(
+        img_corrected,
+        shape=(grid_y, grid_x, cell_height, cell_width) +
+        img_corrected.shape[2:],
+        strides=(stride_y * cell_height, stride_x * cell_width,
+                 stride_y, stride_x) + img_corrected.strides[2:],
+        writeable=False)
+
+
+def normalize_cells(cells, out=None):
+    """ Scale the cells to [0, 1] in float32, the input of the models
+
+    The cells are divided into out in a single pass, a view of the image
+    like the one of cell_view is never copied as integers first.
+
+    Args:
+        cells (np.ndarray): (..., cell height, cell width, channels) pixels
+                            as integers in [0, 255]
+        out (np.ndarray, optional): float32 (n_cells, cell height,
+                                    cell width, channels) array for the
+                                    result. Defaults to a new array.
+
+    Returns:
+        the (n_cells, cell height, cell width, channels) float32 cells
+    """
+    cell_shape = cells.shape[-3:]
+    n_cells = int(np.prod(cells.shape[:-3], dtype=np.int64))
+    if out is None:
+        out = np.empty((n_cells,) + cell_shape, dtype=np.float32)
+    np.divide(cells, np.float32(255), out=out.reshape(cells.shape),
+              casting="unsafe")
+    return out
+
+
+def generate_cell_imgs_vect(img_corrected, grid_x, grid_y):
+    """ The (n_cells, cell height, cell width, channels) cells of the board
+
+    The cells are in row-major order, a copy of cell_view.
+    """
+    view = cell_view(img_corrected, grid_x, grid_y)
+    dataset = view.reshape((-1,) + view.shape[2:])
+
+    logger.info(f"dataset shape: {dataset.shape}")
+
+    return dataset
@@ -24,7 +24,8 @@ from datetime import datetime
 from loguru import logger
 
 from VisualDetector.ImagePreprocessing import prepare_img_for_boundary, \
-    find_largest_box, correct_perspective
+    find_largest_box, correct_perspective, downscale, upscale_box, \
+    refine_box_corners
 
 
 def parse_grid_string(grid_string):
@@ -67,10 +68,15 @@ def control():
               default=None)
 @click.option('--process-name', '-n', type=str, default=process_name_id())
 @click.option("--cell-size", "-c", type=int, default=None)
+@click.option("--max-side", "-m", type=int, default=0,
+              help="find the boundary on a copy of the image downscaled to "
+                   "this longest side, 0 for the full image")
+@click.option("--refine", "-r", is_flag=True,
+              help="refine the corners of the boundary to sub-pixel accuracy")
 def data_preparation(img_path, show,
                      grid,
                      output_dir, process_name,
-                     cell_size):
+                     cell_size, max_side, refine):
     grid_x, grid_y = parse_grid_string(grid)
 
     # load image
@@ -102,7 +108,9 @@ def data_preparation(img_path, show,
     # save original image
     cv2.imwrite(os.path.join(process_dir, "original.png"), img)
 
-    threshold_img = prepare_img_for_boundary(img, show)
+    boundary_img, scale = downscale(img, max_side) if max_side > 0 \
+        else (img, (1.0, 1.0))
+    threshold_img = prepare_img_for_boundary(boundary_img, show)
 
     threshold_img_file_name = os.path.join(process_dir, "threshold.png")
     cv2.imwrite(threshold_img_file_name, threshold_img)
@@ -110,18 +118,23 @@ def data_preparation(img_path, show,
         f"computed threshold image and saved to {threshold_img_file_name}")
 
     largest_box = find_largest_box(threshold_img)
+    if boundary_img is not img:
+        largest_box = upscale_box(largest_box, scale)
+    if refine:
+        largest_box = refine_box_corners(img, largest_box)
     logger.info(f"Found largest box")
+    contour = np.int32(np.round(largest_box))
 
     # save the mask of the largest_box
     mask = np.zeros((img.shape), np.uint8)
-    cv2.drawContours(mask, [largest_box], 0, 255, -1)
-    cv2.drawContours(mask, [largest_box], 0, 0, 2)
+    cv2.drawContours(mask, [contour], 0, 255, -1)
+    cv2.drawContours(mask, [contour], 0, 0, 2)
     if show:
         cv2.imshow("mask", mask)
     cv2.imwrite(os.path.join(process_dir, "mask.png"), mask)
 
     img2 = img.copy()
-    cv2.drawContours(img2, [largest_box], 0, (0, 255, 0), 3)
+    cv2.drawContours(img2, [contour], 0, (0, 255, 0), 3)
     if show:
         cv2.imshow("boundary", img2)
     cv2.imwrite(os.path.join(process_dir, "contour.png"), img2)
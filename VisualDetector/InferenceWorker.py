@@ -0,0 +1,209 @@
+# Copyright (C) 2022-present Associació Heuristica <info@heuristica.barcelona>
+#                      and   Dimitri Marinelli <dimi.marin@proton.me>
+#
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# A copy of the GNU Affero General Public License is in the LICENSE file
+# in the source code repository.
+
+""" A single inference thread shared by all the sessions of the app
+
+Every Streamlit session runs in its own thread of the same process. Instead
+of calling the model concurrently, which oversubscribes the cores, the
+sessions submit their cells to the InferenceWorker of the model: its thread
+waits up to max_wait seconds after the first request for more requests,
+predicts all the cells collected in one batch, in the chunks of
+Predictor.batch_size, and hands each request its own rows back.
+
+    worker = get_worker("../models/cnn_dataset_1.h5")
+    class_probabilities = worker.predict(normalize_cells(cells))
+
+The worker of get_worker asks the default ModelRegistry for the model at
+every batch, so evicting the model from the registry frees it: the next
+batch loads it again.
+"""
+import functools
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+import numpy as np
+from loguru import logger
+
+from typing import Callable, Dict, Tuple, Union
+
+from VisualDetector.ModelRegistry import Predictor, get_predictor, \
+    model_backend
+
+
+class InferenceWorker:
+    def __init__(self, predictor: Union[Predictor, Callable[[], Predictor]],
+                 max_batch: int = 1024, max_wait: float = 0.01) -> None:
+        """ Predict the cells of concurrent requests in shared batches
+
+        Args:
+            predictor (Predictor): the model, only the worker thread calls
+                    it. A function returning the model is called for every
+                    batch instead, e.g. to get it from a ModelRegistry.
+            max_batch (int, optional): the most cells collected in one
+                    batch, requests stop being collected when it is reached.
+                    A Predictor runs the batch through the model in chunks
+                    of its own batch_size, which bounds the memory of the
+                    activations. Defaults to 1024.
+            max_wait (float, optional): seconds waited after the first
+                    request for more requests. Defaults to 0.01.
+        """
+        self.predictor = predictor
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+
+        self.n_requests = 0
+        self.n_batches = 0
+        self.n_cells = 0
+
+        self._requests = queue.Queue()
+        # no request can be queued after the sentinel of close
+        self._closed = False
+        self._lock = threading.Lock()
+        self._thread = threading.Thread(target=self._run, daemon=True,
+                                        name="InferenceWorker")
+        self._thread.start()
+
+    def submit(self, cells: np.ndarray) -> Future:
+        """Queue cells for prediction
+
+        Returns:
+            Future: its result is the prediction of the cells
+        """
+        if len(cells) == 0:
+            raise ValueError("no cells to predict")
+
+        future = Future()
+        request = (np.asarray(cells, dtype=np.float32), future)
+        with self._lock:
+            if self._closed:
+                raise RuntimeError("the inference worker is closed")
+            self._requests.put(request)
+        return future
+
+    def predict(self, cells: np.ndarray, timeout: float = None) -> np.ndarray:
+        """Predict the cells, waiting for the result"""
+        return self.submit(cells).result(timeout)
+
+    def close(self):
+        """Predict the queued requests and stop the thread"""
+        with self._lock:
+            if not self._closed:
+                self._closed = True
+                self._requests.put(None)
+        self._thread.join()
+
+    def _collect(self):
+        """Wait for a request, then collect more until the batch is full or
+        the deadline of the first one passes
+
+        Returns:
+            tuple: (the requests, False if the worker was closed)
+        """
+        first = self._requests.get()
+        if first is None:
+            return [], False
+
+        requests = [first]
+        n_cells = len(first[0])
+        deadline = time.monotonic() + self.max_wait
+        while n_cells < self.max_batch:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                request = self._requests.get(timeout=timeout)
+            except queue.Empty:
+                break
+            if request is None:
+                return requests, False
+            requests.append(request)
+            n_cells += len(request[0])
+
+        return requests, True
+
+    def _run(self):
+        running = True
+        while running:
+            requests, running = self._collect()
+            if requests:
+                self._predict(requests)
+
+        # close should leave nothing behind the sentinel, never hang on it
+        while True:
+            try:
+                request = self._requests.get_nowait()
+            except queue.Empty:
+                break
+            if request is not None:
+                request[1].set_exception(
+                    RuntimeError("the inference worker is closed"))
+
+    def _predict(self, requests):
+        """Predict the cells of the requests in batches and resolve them"""
+        if len(requests) == 1:
+            cells = requests[0][0]
+        else:
+            cells = np.concatenate([cells for cells, _ in requests])
+        try:
+            predictor = self.predictor() if callable(self.predictor) \
+                else self.predictor
+            predictions = np.concatenate([
+                predictor.predict(cells[first:first + self.max_batch])
+                for first in range(0, len(cells), self.max_batch)])
+        except Exception as e:
+            logger.exception("prediction failed")
+            for _, future in requests:
+                future.set_exception(e)
+            return
+
+        self.n_requests += len(requests)
+        self.n_batches += 1
+        self.n_cells += len(cells)
+        logger.debug(f"predicted {len(cells)} cells of {len(requests)} "
+                     f"requests")
+
+        # each request gets its own rows back
+        offsets = np.cumsum([len(cells) for cells, _ in requests])[:-1]
+        for (_, future), prediction in zip(
+                requests, np.split(predictions, offsets)):
+            future.set_result(prediction)
+
+
+_workers: Dict[Tuple[str, str], InferenceWorker] = {}
+_workers_lock = threading.Lock()
+
+
+def get_worker(path: str, backend: str = "auto", **kwargs) -> InferenceWorker:
+    """Return the process-wide worker of a model, starting it the first time
+
+    Args:
+        path (str): the model file, loaded with the default ModelRegistry
+                    at every batch.
+        backend (str, optional): the backend of the model.
+        **kwargs: passed to InferenceWorker when it is started.
+    """
+    # the key of the model in the registry
+    key = (path, model_backend(path, backend))
+    with _workers_lock:
+        if key not in _workers:
+            # the model is loaded now, so that a missing file fails here
+            get_predictor(*key)
+            _workers[key] = InferenceWorker(
+                functools.partial(get_predictor, *key), **kwargs)
+        return _workers[key]
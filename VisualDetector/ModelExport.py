@@ -0,0 +1,281 @@
+# Copyright (C) 2022-present Associació Heuristica <info@heuristica.barcelona>
+#                      and   Dimitri Marinelli <dimi.marin@proton.me>
+#
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# A copy of the GNU Affero General Public License is in the LICENSE file
+# in the source code repository.
+
+""" Export the label prediction models for CPU inference
+
+The Keras models in models/ are converted to TFLite or ONNX, optionally with
+post-training int8 quantization: the ranges of the activations are
+calibrated on labelled cell images, a directory with one subdirectory of
+75x75 cell images per class (B_H, B_S, Empty, R_H, R_S), as used for the
+training. The exported files are loaded by VisualDetector.ModelRegistry
+like the Keras ones.
+
+The ONNX export needs tf2onnx, its quantization and inference onnxruntime,
+both in requirements.onnx.txt:
+    pip install -r requirements.onnx.txt
+
+run from the repository root:
+    python -m VisualDetector.ModelExport export models/cnn.h5 -f tflite \
+        --quantize --cells-dir cells/
+    python -m VisualDetector.ModelExport compare models/cnn.h5 \
+        models/cnn_int8.tflite --cells-dir cells/
+"""
+import os
+import statistics
+import tempfile
+import time
+
+import click
+import cv2
+import numpy as np
+from loguru import logger
+
+from typing import Dict, List, Tuple
+
+from VisualDetector.ImageLabelPrediction import target_size
+from VisualDetector.ModelRegistry import Predictor, load_model, \
+    load_keras_model, model_backend
+
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg", ".bmp")
+
+
+def load_labelled_cells(directory: str, limit_per_class: int = None,
+                        seed: int = 0) -> Tuple[np.ndarray, np.ndarray,
+                                                List[str]]:
+    """Load the cell images of a directory with one subdirectory per class
+
+    The classes are numbered in alphabetical order, as the Keras directory
+    iterator used for the training does. The images are converted to RGB,
+    resized to target_size and scaled to [0, 1], as in detect_labels_fast.
+
+    Args:
+        directory (str): the directory of the classes.
+        limit_per_class (int, optional): the maximum number of images per
+                class, a random sample of them. Defaults to all.
+        seed (int, optional): seed of the sample.
+
+    Returns:
+        tuple: (float32 cells of shape (N, H, W, 3), class of each cell,
+                class names)
+    """
+    rng = np.random.default_rng(seed)
+    class_names = sorted(name for name in os.listdir(directory)
+                         if os.path.isdir(os.path.join(directory, name)))
+
+    cells, labels = [], []
+    for label, class_name in enumerate(class_names):
+        class_dir = os.path.join(directory, class_name)
+        files = sorted(f for f in os.listdir(class_dir)
+                       if f.lower().endswith(IMAGE_EXTENSIONS))
+        if limit_per_class is not None and len(files) > limit_per_class:
+            files = rng.choice(files, limit_per_class, replace=False)
+
+        for file_name in files:
+            img = cv2.imread(os.path.join(class_dir, file_name))
+            img = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
+            cells.append(cv2.resize(img, target_size))
+            labels.append(label)
+
+    if not cells:
+        raise ValueError(f"no labelled cell images in {directory}")
+    logger.info(f"loaded {len(cells)} cells of {len(class_names)} classes")
+
+    return (np.stack(cells).astype(np.float32) / 255, np.array(labels),
+            class_names)
+
+
+def exported_path(model_path: str, model_format: str, quantize: bool) -> str:
+    """Return the default file of an export, next to the Keras model"""
+    stem = os.path.splitext(model_path)[0]
+    return f"{stem}{'_int8' if quantize else ''}.{model_format}"
+
+
+def export_tflite(model_path: str, output: str,
+                  calibration_cells: np.ndarray = None):
+    """Convert a Keras model to TFLite
+
+    With calibration cells the weights and the activations are quantized to
+    int8, the input and the output stay float32.
+    """
+    import tensorflow as tf
+
+    converter = tf.lite.TFLiteConverter.from_keras_model(
+        load_keras_model(model_path))
+    if calibration_cells is not None:
+        def representative_dataset():
+            for cell in calibration_cells:
+                yield [cell[np.newaxis]]
+
+        converter.optimizations = [tf.lite.Optimize.DEFAULT]
+        converter.representative_dataset = representative_dataset
+        converter.target_spec.supported_ops = \
+            [tf.lite.OpsSet.TFLITE_BUILTINS_INT8]
+
+    with open(output, "wb") as f:
+        f.write(converter.convert())
+
+
+def export_onnx(model_path: str, output: str,
+                calibration_cells: np.ndarray = None):
+    """Convert a Keras model to ONNX
+
+    With calibration cells the model is quantized to int8 by onnxruntime,
+    with quantize and dequantize nodes around the int8 operators.
+    """
+    import tensorflow as tf
+    import tf2onnx
+
+    model = load_keras_model(model_path)
+    signature = (tf.TensorSpec((None,) + tuple(model.input_shape[1:]),
+                               tf.float32, name="input"),)
+    if calibration_cells is None:
+        tf2onnx.convert.from_keras(model, input_signature=signature,
+                                   opset=13, output_path=output)
+        return
+
+    from onnxruntime.quantization import CalibrationDataReader, \
+        QuantFormat, QuantType, quantize_static
+
+    class CellReader(CalibrationDataReader):
+        def __init__(self):
+            self.cells = iter(calibration_cells)
+
+        def get_next(self):
+            cell = next(self.cells, None)
+            return None if cell is None else {"input": cell[np.newaxis]}
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        float_model = os.path.join(tmp_dir, "float.onnx")
+        tf2onnx.convert.from_keras(model, input_signature=signature,
+                                   opset=13, output_path=float_model)
+        quantize_static(float_model, output, CellReader(),
+                        quant_format=QuantFormat.QDQ,
+                        activation_type=QuantType.QInt8,
+                        weight_type=QuantType.QInt8)
+
+
+def compare_models(model_paths: List[str], cells: np.ndarray,
+                   labels: np.ndarray, batch_size: int = 100,
+                   repeat: int = 5) -> List[Dict]:
+    """Compare the accuracy and the latency of models on the same cells
+
+    The first model is the reference of the agreement, the fraction of the
+    cells where a model predicts the same class.
+
+    Args:
+        model_paths (List[str]): the model files, any backend.
+        cells (np.ndarray): the cells, as returned by load_labelled_cells.
+        labels (np.ndarray): the true class of the cells.
+        batch_size (int, optional): cells per prediction, a board has about
+                                    a hundred. Defaults to 100.
+        repeat (int, optional): timed passes over all the cells.
+
+    Returns:
+        List[Dict]: one row per model
+    """
+    rows, reference = [], None
+    for path in model_paths:
+        start = time.perf_counter()
+        predictor = Predictor(load_model(path), path)
+        predictor.warm_up(min(batch_size, len(cells)))
+        load_time = time.perf_counter() - start
+
+        batch_times, predictions = [], None
+        for _ in range(repeat):
+            classes = []
+            for first in range(0, len(cells), batch_size):
+                start = time.perf_counter()
+                probabilities = predictor.predict(
+                    cells[first:first + batch_size])
+                batch_times.append(time.perf_counter() - start)
+                classes.append(probabilities.argmax(axis=-1))
+            predictions = np.concatenate(classes)
+
+        if reference is None:
+            reference = predictions
+        rows.append({"model": os.path.basename(path),
+                     "backend": model_backend(path),
+                     "size_mb": os.path.getsize(path) / 2 ** 20,
+                     "load_s": load_time,
+                     "accuracy": float(np.mean(predictions == labels)),
+                     "agreement": float(np.mean(predictions == reference)),
+                     "ms_per_batch": statistics.median(batch_times) * 1e3})
+    return rows
+
+
+@click.group()
+def control():
+    """ export the label prediction models for CPU inference """
+    pass
+
+
+@control.command()
+@click.argument("model-path", type=click.Path(exists=True))
+@click.option("--format", "-f", "model_format",
+              type=click.Choice(["tflite", "onnx"]), default="tflite")
+@click.option("--quantize", "-q", is_flag=True,
+              help="int8 quantization, needs --cells-dir")
+@click.option("--cells-dir", "-c", type=click.Path(exists=True),
+              default=None, help="labelled cells for the calibration")
+@click.option("--n-calibration", type=int, default=100,
+              help="calibration cells per class")
+@click.option("--output", "-o", type=click.Path(), default=None,
+              help="by default next to the model, e.g. cnn_int8.tflite")
+def export(model_path, model_format, quantize, cells_dir, n_calibration,
+           output):
+    """ convert a Keras model to TFLite or ONNX """
+    if quantize and cells_dir is None:
+        raise click.BadParameter("the quantization needs --cells-dir")
+    if output is None:
+        output = exported_path(model_path, model_format, quantize)
+
+    calibration_cells = None
+    if quantize:
+        calibration_cells, _, _ = load_labelled_cells(
+            cells_dir, limit_per_class=n_calibration)
+
+    if model_format == "tflite":
+        export_tflite(model_path, output, calibration_cells)
+    else:
+        export_onnx(model_path, output, calibration_cells)
+    logger.info(f"{model_path} exported to {output} "
+                f"({os.path.getsize(output) / 2 ** 20:.2f} MB)")
+
+
+@control.command()
+@click.argument("model-paths", type=click.Path(exists=True), nargs=-1,
+                required=True)
+@click.option("--cells-dir", "-c", type=click.Path(exists=True),
+              required=True, help="labelled cells")
+@click.option("--batch-size", "-b", type=int, default=100)
+@click.option("--repeat", "-r", type=int, default=5)
+def compare(model_paths, cells_dir, batch_size, repeat):
+    """ accuracy and latency of models, the first one is the reference """
+    cells, labels, _ = load_labelled_cells(cells_dir)
+    rows = compare_models(model_paths, cells, labels, batch_size, repeat)
+
+    print(f"{'model':>40} {'backend':>7} {'MB':>6} {'load s':>7} "
+          f"{'accuracy':>8} {'agree':>6} {'ms/batch':>9}")
+    for row in rows:
+        print(f"{row['model']:>40} {row['backend']:>7} "
+              f"{row['size_mb']:>6.2f} {row['load_s']:>7.2f} "
+              f"{row['accuracy']:>8.2%} {row['agreement']:>6.1%} "
+              f"{row['ms_per_batch']:>9.2f}")
+
+
+if __name__ == "__main__":
+    control()
@@ -0,0 +1,281 @@
+# Copyright (C) 2022-present Associació Heuristica <info@heuristica.barcelona>
+#                      and   Dimitri Marinelli <dimi.marin@proton.me>
+#
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# A copy of the GNU Affero General Public License is in the LICENSE file
+# in the source code repository.
+
+""" Process-wide registry of the label prediction models
+
+Loading a Keras model reads the .h5 file and rebuilds the graph, which takes
+much longer than predicting the cells of a board. The registry loads every
+model once per process, runs a dummy batch through it so that the first real
+prediction does not pay for the graph setup either, and keeps the most
+recently used models in memory:
+
+    predictor = get_predictor("../models/cnn_dataset_1.h5")
+    class_probabilities = predictor.predict(cells / 255)
+
+Streamlit reruns the script in the same process, so all the reruns and all
+the uploads share the models of default_registry. A model is kept once per
+path and backend.
+
+The models can be Keras files or their TFLite and ONNX exports (see
+VisualDetector.ModelExport), the backend is chosen from the extension of
+the file or explicitly, e.g. from the [Model] section of config.ini.
+TFLite runs with tflite_runtime if installed, otherwise with tensorflow;
+ONNX needs onnxruntime, from requirements.onnx.txt.
+"""
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+from loguru import logger
+
+from typing import Callable, List
+
+
+MODEL_BACKENDS = ("keras", "tflite", "onnx")
+
+
+def model_backend(path: str, backend: str = "auto") -> str:
+    """Return the backend of a model file, by its extension for auto"""
+    if backend == "auto":
+        extension = os.path.splitext(path)[1].lower()
+        backend = {".tflite": "tflite", ".onnx": "onnx"}.get(extension,
+                                                            "keras")
+    if backend not in MODEL_BACKENDS:
+        raise ValueError(f"backend should be auto or one of {MODEL_BACKENDS}")
+    return backend
+
+
+def load_model(path: str, backend: str = "auto"):
+    """Load a model with the backend of its file, see model_backend"""
+    backend = model_backend(path, backend)
+    if backend == "tflite":
+        return TFLiteModel(path)
+    if backend == "onnx":
+        return OnnxModel(path)
+    return load_keras_model(path)
+
+
+def load_keras_model(path: str):
+    """Load a Keras model, without compiling it: it is only used to predict"""
+    import tensorflow as tf
+
+    return tf.keras.models.load_model(path, compile=False)
+
+
+class TFLiteModel:
+    def __init__(self, path: str) -> None:
+        """ A TFLite model called like a Keras model
+
+        Quantized inputs and outputs are converted from and to float with
+        the scale and zero point of the model.
+        """
+        try:
+            from tflite_runtime.interpreter import Interpreter
+        except ImportError:
+            import tensorflow as tf
+            Interpreter = tf.lite.Interpreter
+
+        self.interpreter = Interpreter(model_path=path)
+        self.interpreter.allocate_tensors()
+        self._input = self.interpreter.get_input_details()[0]
+        self._output = self.interpreter.get_output_details()[0]
+
+    @property
+    def input_shape(self) -> tuple:
+        return (None,) + tuple(int(d) for d in self._input["shape"][1:])
+
+    def __call__(self, batch: np.ndarray, training=False) -> np.ndarray:
+        batch = np.asarray(batch)
+        if tuple(self._input["shape"]) != batch.shape:
+            self.interpreter.resize_tensor_input(self._input["index"],
+                                                 batch.shape)
+            self.interpreter.allocate_tensors()
+            self._input = self.interpreter.get_input_details()[0]
+            self._output = self.interpreter.get_output_details()[0]
+
+        scale, zero_point = self._input["quantization"]
+        if scale > 0:
+            batch = np.round(batch / scale + zero_point)
+        self.interpreter.set_tensor(self._input["index"],
+                                    batch.astype(self._input["dtype"]))
+        self.interpreter.invoke()
+
+        output = self.interpreter.get_tensor(self._output["index"])
+        scale, zero_point = self._output["quantization"]
+        if scale > 0:
+            output = (output.astype(np.float32) - zero_point) * scale
+        return output
+
+
+class OnnxModel:
+    def __init__(self, path: str) -> None:
+        """ An ONNX model run by onnxruntime, called like a Keras model """
+        import onnxruntime
+
+        self.session = onnxruntime.InferenceSession(
+            path, providers=["CPUExecutionProvider"])
+        self._input = self.session.get_inputs()[0]
+
+    @property
+    def input_shape(self) -> tuple:
+        return (None,) + tuple(self._input.shape[1:])
+
+    def __call__(self, batch: np.ndarray, training=False) -> np.ndarray:
+        return self.session.run(None, {self._input.name:
+                                       np.asarray(batch, np.float32)})[0]
+
+
+class Predictor:
+    def __init__(self, model, path: str = None,
+                 batch_size: int = 64) -> None:
+        """ A loaded model ready to predict
+
+        Args:
+            model: a Keras, TFLiteModel or OnnxModel model, or any callable
+                    with an input_shape attribute that maps a batch to class
+                    probabilities.
+            path (str, optional): where the model was loaded from.
+            batch_size (int, optional): the most inputs given to the model
+                    at once, which bounds the memory of its activations.
+                    Defaults to 64.
+        """
+        if batch_size < 1:
+            raise ValueError("batch_size should be at least 1")
+        self.model = model
+        self.path = path
+        self.batch_size = batch_size
+
+    @property
+    def input_shape(self) -> tuple:
+        """The shape of one input, without the batch axis"""
+        return tuple(self.model.input_shape[1:])
+
+    def predict(self, batch: np.ndarray) -> np.ndarray:
+        """Return the class probabilities of a batch of inputs
+
+        The model is called directly: for the few hundred cells of a board
+        model.predict spends more time setting up its data pipeline than
+        predicting. Like model.predict, it is called on chunks of batch_size
+        inputs.
+        """
+        batch = np.asarray(batch, dtype=np.float32)
+        if len(batch) <= self.batch_size:
+            return np.asarray(self.model(batch, training=False))
+        return np.concatenate([
+            np.asarray(self.model(batch[first:first + self.batch_size],
+                                  training=False))
+            for first in range(0, len(batch), self.batch_size)])
+
+    def warm_up(self, batch_size: int = 1):
+        """Predict a batch of zeros, which builds the graph of the model"""
+        self.predict(np.zeros((batch_size,) + self.input_shape,
+                              dtype=np.float32))
+
+
+class ModelRegistry:
+    def __init__(self, max_models: int = 2,
+                 loader: Callable = load_model,
+                 warm_up_batch: int = 1,
+                 batch_size: int = 64) -> None:
+        """ The models loaded in this process, least recently used first
+
+        Args:
+            max_models (int, optional): the models kept in memory, loading
+                    one more evicts the least recently used. Defaults to 2.
+            loader (Callable, optional): loads the model at a path with a
+                    backend. Defaults to load_model.
+            warm_up_batch (int, optional): size of the dummy batch run after
+                    loading, 0 to skip the warm up. Defaults to 1.
+            batch_size (int, optional): batch_size of the predictors.
+                    Defaults to 64.
+        """
+        if max_models < 1:
+            raise ValueError("the registry should keep at least one model")
+
+        self.max_models = max_models
+        self.loader = loader
+        self.warm_up_batch = warm_up_batch
+        self.batch_size = batch_size
+        self._predictors = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __contains__(self, path: str) -> bool:
+        return path in self.paths()
+
+    def __len__(self) -> int:
+        return len(self._predictors)
+
+    def paths(self) -> List[str]:
+        """Return the paths of the loaded models, least recently used first"""
+        return [path for path, _ in self._predictors]
+
+    def get(self, path: str, backend: str = "auto") -> Predictor:
+        """Return the predictor of the model at path, loading it only the
+        first time
+
+        Args:
+            path (str): the model file.
+            backend (str, optional): "keras", "tflite", "onnx" or "auto",
+                                        from the extension of the file.
+        """
+        # the same file can be loaded with different backends
+        backend = model_backend(path, backend)
+        key = (path, backend)
+        with self._lock:
+            if key in self._predictors:
+                self._predictors.move_to_end(key)
+                return self._predictors[key]
+
+            start = time.perf_counter()
+            predictor = Predictor(self.loader(path, backend), path,
+                                  self.batch_size)
+            if self.warm_up_batch > 0:
+                predictor.warm_up(self.warm_up_batch)
+            logger.info(f"{backend} model {path} loaded in "
+                        f"{time.perf_counter() - start:.2f} s")
+
+            self._predictors[key] = predictor
+            while len(self._predictors) > self.max_models:
+                (evicted, evicted_backend), _ = self._predictors.popitem(
+                    last=False)
+                logger.info(f"{evicted_backend} model {evicted} evicted")
+            return predictor
+
+    def evict(self, path: str, backend: str = "auto") -> bool:
+        """Forget the model at path loaded with backend
+
+        Returns:
+            bool: False if the model was not loaded
+        """
+        key = (path, model_backend(path, backend))
+        with self._lock:
+            return self._predictors.pop(key, None) is not None
+
+    def clear(self):
+        """Forget all the models"""
+        with self._lock:
+            self._predictors.clear()
+
+
+default_registry = ModelRegistry()
+
+
+def get_predictor(path: str, backend: str = "auto") -> Predictor:
+    """Return the predictor of a model from the default registry"""
+    return default_registry.get(path, backend)
@@ -0,0 +1,78 @@
+# Copyright (C) 2022-present Associació Heuristica <info@heuristica.barcelona>
+#                      and   Dimitri Marinelli <dimi.marin@proton.me>
+#
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# A copy of the GNU Affero General Public License is in the LICENSE file
+# in the source code repository.
+
+""" board kernels with every available compute backend
+
+run from the repository root:
+    python -m benchmarks.bench_backends
+"""
+import time
+
+import click
+
+from SchellingModel.SchellingGame import SchellingBoard
+from SchellingModel.Backends import available_backends
+from SchellingModel.Kernels import team_masks
+
+
+def best_time(func, repeat):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+@click.command()
+@click.option("--sizes", "-s", type=str, default="20,50,200,1000",
+              help="comma separated list of board sides")
+@click.option("--radius", "-r", type=int, default=1)
+@click.option("--repeat", type=int, default=5)
+@click.option("--seed", type=int, default=1234)
+def benchmark(sizes, radius, repeat, seed):
+    """ time neighbours, happiness and links on square boards """
+    backends = {name: backend()
+                for name, backend in available_backends().items()}
+    if "numba" not in backends:
+        print("numba is not installed, only the numpy backend is timed")
+
+    print(f"{'size':>6} {'backend':>8} {'neighbours':>12} {'happy':>10} "
+          f"{'links':>10}")
+    for size in [int(s) for s in sizes.split(",")]:
+        board = SchellingBoard.random(size, size, seed=seed, radius=radius)
+        team_index = board.team_index()
+        masks = team_masks(team_index, len(board.team_names))
+        for name, backend in backends.items():
+            # the first call compiles the numba loops
+            neighbours = backend.neighbour_counts(masks, board.kernel)
+            backend.happy_mask(neighbours, team_index)
+            backend.link_counts(team_index, kernel=board.kernel)
+
+            t_neighbours = best_time(
+                lambda: backend.neighbour_counts(masks, board.kernel), repeat)
+            t_happy = best_time(
+                lambda: backend.happy_mask(neighbours, team_index), repeat)
+            t_links = best_time(
+                lambda: backend.link_counts(team_index, kernel=board.kernel),
+                repeat)
+            print(f"{size:>6} {name:>8} {t_neighbours * 1e3:>10.2f}ms "
+                  f"{t_happy * 1e3:>8.2f}ms {t_links * 1e3:>8.2f}ms")
+
+
+if __name__ == "__main__":
+    benchmark()
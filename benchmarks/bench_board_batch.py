@@ -0,0 +1,66 @@
+# Copyright (C) 2022-present Associació Heuristica <info@heuristica.barcelona>
+#                      and   Dimitri Marinelli <dimi.marin@proton.me>
+#
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# A copy of the GNU Affero General Public License is in the LICENSE file
+# in the source code repository.
+
+""" compare the analysis of a match board by board and as a BoardBatch
+
+run from the repository root:
+    python -m benchmarks.bench_board_batch
+"""
+import time
+
+import click
+import numpy as np
+
+from SchellingModel.SchellingGame import SchellingBoard
+from SchellingModel.BoardBatch import BoardBatch
+
+
+@click.command()
+@click.option("--n-boards", "-n", type=int, default=2000)
+@click.option("--grid", "-g", type=str, default="20x20",
+              help="grid size in format n_columns x n_rows")
+@click.option("--seed", type=int, default=1234)
+def benchmark(n_boards, grid, seed):
+    """ time the happiness, segregation and wrong moods of a match """
+    grid_x, grid_y = [int(i) for i in grid.split("x")]
+    rng = np.random.default_rng(seed)
+    teams = rng.integers(0, 3, size=(n_boards, grid_y, grid_x))
+    moods = rng.choice([1, -1], size=teams.shape) * (teams > 0)
+
+    start = time.perf_counter()
+    for t, m in zip(teams, moods):
+        board = SchellingBoard(t, m)
+        board.happyness()
+        board.segregation()
+        np.sum(board.find_wrong_position())
+    loop_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    batch = BoardBatch(teams, moods)
+    batch.happyness()
+    batch.segregation()
+    batch.count_wrong_moods()
+    batch_time = time.perf_counter() - start
+
+    print(f"{n_boards} boards of {grid_x}x{grid_y}")
+    print(f"board by board: {loop_time:.3f} s")
+    print(f"BoardBatch:     {batch_time:.3f} s"
+          f" ({loop_time / batch_time:.0f}x faster)")
+
+
+if __name__ == "__main__":
+    benchmark()
@@ -0,0 +1,180 @@
+# Copyright (C) 2022-present Associació Heuristica <info@heuristica.barcelona>
+#                      and   Dimitri Marinelli <dimi.marin@proton.me>
+#
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# A copy of the GNU Affero General Public License is in the LICENSE file
+# in the source code repository.
+
+""" timing of the public SchellingBoard methods, saved as JSON
+
+Every method is timed on fresh random boards of every size and number of
+teams, so the neighbour and happiness caches of the board never help. The
+results are written as JSON together with the environment they ran in;
+--compare prints the ratio to the timings of a previous run.
+
+run from the repository root:
+    python -m benchmarks.bench_board_suite -o before.json
+    python -m benchmarks.bench_board_suite -o after.json --compare before.json
+"""
+import json
+import platform
+import statistics
+import subprocess
+import time
+
+import click
+import numpy as np
+
+from SchellingModel.SchellingGame import SchellingBoard
+from SchellingModel.Backends import get_backend
+
+# name: function of the board and of a second board of the same size
+METHODS = {
+    "happyness": lambda sb, other: sb.happyness(),
+    "segregation": lambda sb, other: sb.segregation(),
+    "find_wrong_position": lambda sb, other: sb.find_wrong_position(),
+    "to_str_matrix": lambda sb, other: sb.to_str_matrix(),
+    "count_agents_teams": lambda sb, other: sb.count_agents_teams(),
+    "count_empty_cells": lambda sb, other: sb.count_empty_cells(),
+    "count_team_agents": lambda sb, other: sb.count_team_agents(1),
+    "empty_positions": lambda sb, other: sb.empty_positions(),
+    "team_positions": lambda sb, other: sb.team_positions(1),
+    "mood_positions": lambda sb, other: sb.mood_positions("H"),
+    "team_index": lambda sb, other: sb.team_index(),
+    "mood_index": lambda sb, other: sb.mood_index(),
+    "neighbours_tensor": lambda sb, other: sb.neighbours_tensor(),
+    "same_team_neighbours": lambda sb, other: sb.same_team_neighbours(1),
+    "model_happy_cells": lambda sb, other: sb.model_happy_cells(1),
+    "model_happy_mask": lambda sb, other: sb.model_happy_mask(),
+    "model_happy_tensor": lambda sb, other: sb.model_happy_tensor(),
+    "model_moods": lambda sb, other: sb.model_moods(),
+    "teams_str": lambda sb, other: sb.teams_str(),
+    "moods_str": lambda sb, other: sb.moods_str(),
+    "get_all_classes_str": lambda sb, other: sb.get_all_classes_str(),
+    "get_status_cell_str": lambda sb, other: sb.get_status_cell_str(0, 0),
+    "to_codes": lambda sb, other: sb.to_codes(),
+    "from_codes": lambda sb, other: SchellingBoard.from_codes(
+        other.to_codes(), team_names=other.team_names),
+    "analyze": lambda sb, other: sb.analyze(),
+    "diff": lambda sb, other: sb.diff(other),
+}
+
+SIZES = (20, 50, 200, 1000)
+N_TEAMS = (2, 3, 4, 5)
+
+
+def make_boards(size, n_teams, seed):
+    """Return two random boards, the agents show their model mood except a
+    few"""
+    rng = np.random.default_rng(seed)
+    boards = []
+    for _ in range(2):
+        sb = SchellingBoard.random(size, size, n_teams=n_teams, seed=rng)
+        moods = sb.model_moods()
+        flip = rng.random(moods.shape) < 0.1
+        sb.moods = np.where(flip, -moods, moods)
+        boards.append(sb)
+    return boards
+
+
+def time_method(func, size, n_teams, repeat, seed):
+    """Return the timings of func in seconds, each on new boards"""
+    times = []
+    for _ in range(repeat):
+        sb, other = make_boards(size, n_teams, seed)
+        start = time.perf_counter()
+        func(sb, other)
+        times.append(time.perf_counter() - start)
+    return times
+
+
+def environment():
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"],
+                                capture_output=True, text=True,
+                                check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {"commit": commit,
+            "date": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "machine": platform.machine(),
+            "processor": platform.processor(),
+            "backend": get_backend().name}
+
+
+def _parse_list(values, cast=str):
+    return [cast(v) for v in values.split(",")]
+
+
+@click.command()
+@click.option("--sizes", "-s", type=str,
+              default=",".join(str(s) for s in SIZES),
+              help="comma separated list of board sides")
+@click.option("--n-teams", "-n", type=str,
+              default=",".join(str(n) for n in N_TEAMS),
+              help="comma separated list of numbers of teams")
+@click.option("--methods", "-m", type=str, default=",".join(METHODS),
+              help="comma separated list of methods")
+@click.option("--repeat", "-r", type=int, default=5)
+@click.option("--seed", type=int, default=1234)
+@click.option("--output", "-o", type=click.Path(),
+              default="bench_board_suite.json")
+@click.option("--compare", "-c", type=click.Path(exists=True), default=None,
+              help="results of a previous run")
+def benchmark(sizes, n_teams, methods, repeat, seed, output, compare):
+    """ time the SchellingBoard methods on square boards """
+    methods = _parse_list(methods)
+    unknown = set(methods) - set(METHODS)
+    if unknown:
+        raise click.BadParameter(f"unknown methods {sorted(unknown)}")
+
+    previous = {}
+    if compare is not None:
+        with open(compare) as f:
+            previous = {(r["method"], r["size"], r["n_teams"]): r
+                        for r in json.load(f)["results"]}
+
+    results = []
+    print(f"{'method':>22} {'size':>5} {'teams':>5} {'best':>11} "
+          f"{'median':>11}")
+    for size in _parse_list(sizes, int):
+        for teams in _parse_list(n_teams, int):
+            for method in methods:
+                times = time_method(METHODS[method], size, teams, repeat,
+                                    seed)
+                result = {"method": method,
+                          "size": size,
+                          "n_teams": teams,
+                          "repeat": repeat,
+                          "best": min(times),
+                          "median": statistics.median(times)}
+                results.append(result)
+
+                line = f"{method:>22} {size:>5} {teams:>5} " \
+                       f"{result['best'] * 1e3:>9.3f}ms " \
+                       f"{result['median'] * 1e3:>9.3f}ms"
+                before = previous.get((method, size, teams))
+                if before is not None:
+                    line += f" {result['best'] / before['best']:>6.2f}x"
+                print(line)
+
+    with open(output, "w") as f:
+        json.dump({"environment": environment(), "results": results}, f,
+                  indent=1)
+    print(f"results saved to {output}")
+
+
+if __name__ == "__main__":
+    benchmark()
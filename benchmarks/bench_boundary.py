@@ -0,0 +1,84 @@
+# Copyright (C) 2022-present Associació Heuristica <info@heuristica.barcelona>
+#                      and   Dimitri Marinelli <dimi.marin@proton.me>
+#
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# A copy of the GNU Affero General Public License is in the LICENSE file
+# in the source code repository.
+
+
+""" boundary detection latency on full resolution vs downscaled photos
+
+run from the repository root on uploaded pictures of the board:
+    python -m benchmarks.bench_boundary photo1.jpg photo2.jpg
+"""
+import time
+
+import click
+import cv2
+import numpy as np
+
+from VisualDetector.ImagePreprocessing import prepare_img_for_boundary, \
+    find_largest_box, find_box_downscaled
+
+
+def timed(func, repeat):
+    """ median time in ms of func and its last result """
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        times.append(time.perf_counter() - start)
+    return np.median(times) * 1000, result
+
+
+def corner_distance(box, reference):
+    """ largest distance in pixels between the matched corners of two boxes """
+    box = np.asarray(box, np.float64).reshape(-1, 2)
+    reference = np.asarray(reference, np.float64).reshape(-1, 2)
+    distances = np.linalg.norm(box[:, None] - reference[None], axis=-1)
+    return distances.min(axis=1).max()
+
+
+@click.command()
+@click.argument("img_paths", nargs=-1, required=True,
+                type=click.Path(exists=True))
+@click.option("--max-sides", "-m", type=str, default="512,1024,1600",
+              help="comma separated longest sides of the detection image")
+@click.option("--repeat", "-r", type=int, default=5)
+def benchmark(img_paths, max_sides, repeat):
+    """ time the boundary detection of each picture """
+    max_sides = [int(side) for side in max_sides.split(",")]
+
+    for img_path in img_paths:
+        img = cv2.imread(img_path)
+        print(f"{img_path} {img.shape[1]}x{img.shape[0]}")
+
+        full_ms, full_box = timed(
+            lambda: find_largest_box(prepare_img_for_boundary(img)), repeat)
+        print(f"{'full':>12} {full_ms:9.1f} ms")
+
+        for side in max_sides:
+            for refine in (False, True):
+                try:
+                    ms, box = timed(lambda: find_box_downscaled(
+                        img, side, refine=refine), repeat)
+                except ValueError:
+                    print(f"{side:>6}{' +sub' if refine else '':<6} no box")
+                    continue
+                print(f"{side:>6}{' +sub' if refine else '':<6} {ms:9.1f} ms "
+                      f"({full_ms / ms:5.1f}x) corners within "
+                      f"{corner_distance(box, full_box):.1f} px")
+
+
+if __name__ == "__main__":
+    benchmark()
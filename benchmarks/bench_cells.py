@@ -0,0 +1,82 @@
+# Copyright (C) 2022-present Associació Heuristica <info@heuristica.barcelona>
+#                      and   Dimitri Marinelli <dimi.marin@proton.me>
+#
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# A copy of the GNU Affero General Public License is in the LICENSE file
+# in the source code repository.
+
+
+""" memory and time of cutting a board image into normalized model inputs
+
+The copied cells divided by 255 in float64, as detect_labels_fast used to
+prepare them, against normalize_cells on the cell_view of the image.
+
+run from the repository root:
+    python -m benchmarks.bench_cells
+"""
+import time
+import tracemalloc
+
+import click
+import numpy as np
+
+from VisualDetector.ImagePreprocessing import target_size, cell_view, \
+    normalize_cells
+
+
+def copied_cells(img, grid_x, grid_y):
+    """ the reshaped copy of the cells divided in float64 """
+    cell_width, cell_height = target_size
+    cells = img.reshape(grid_y, cell_height, grid_x, cell_width, 3)
+    cells = cells.swapaxes(1, 2).reshape(-1, cell_height, cell_width, 3)
+    return cells / 255
+
+
+def viewed_cells(img, grid_x, grid_y):
+    return normalize_cells(cell_view(img, grid_x, grid_y))
+
+
+def measure(func, img, grid_x, grid_y, repeat):
+    """ median time in ms and peak of the memory allocated in MB """
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(img, grid_x, grid_y)
+        times.append(time.perf_counter() - start)
+
+    tracemalloc.start()
+    func(img, grid_x, grid_y)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return np.median(times) * 1000, peak / 2 ** 20
+
+
+@click.command()
+@click.option("--grids", "-g", type=str, default="20x20,50x30,50x50",
+              help="comma separated grids, columns x rows")
+@click.option("--repeat", "-r", type=int, default=5)
+def benchmark(grids, repeat):
+    """ compare the two ways of preparing the cells of a board """
+    print(f"{'grid':>7} {'method':>7} {'ms':>9} {'peak MB':>9}")
+    for grid in grids.split(","):
+        grid_x, grid_y = (int(n) for n in grid.split("x"))
+        img = np.random.default_rng(0).integers(
+            0, 256, (grid_y * target_size[1], grid_x * target_size[0], 3),
+            dtype=np.uint8)
+        for name, func in [("copy", copied_cells), ("view", viewed_cells)]:
+            ms, peak = measure(func, img, grid_x, grid_y, repeat)
+            print(f"{grid:>7} {name:>7} {ms:9.1f} {peak:9.1f}")
+
+
+if __name__ == "__main__":
+    benchmark()
@@ -0,0 +1,62 @@
+# Copyright (C) 2022-present Associació Heuristica <info@heuristica.barcelona>
+#                      and   Dimitri Marinelli <dimi.marin@proton.me>
+#
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# A copy of the GNU Affero General Public License is in the LICENSE file
+# in the source code repository.
+
+""" batched replicas against a loop of SchellingGame
+
+run from the repository root:
+    python -m benchmarks.bench_ensemble
+"""
+import time
+
+import click
+from loguru import logger
+
+from SchellingModel.SchellingGame import SchellingBoard, SchellingGame
+from SchellingModel.Ensemble import SchellingEnsemble
+
+
+@click.command()
+@click.option("--size", "-s", type=int, default=30)
+@click.option("--replicas", "-r", type=str, default="10,100,500",
+              help="comma separated list of ensemble sizes")
+@click.option("--n-steps", "-n", type=int, default=30)
+@click.option("--seed", type=int, default=1234)
+def benchmark(size, replicas, n_steps, seed):
+    """ run n_steps on all the replicas, batched and one at a time """
+    logger.remove()
+    board = SchellingBoard.random(size, size, seed=seed)
+
+    print(f"{'replicas':>9} {'loop [s]':>10} {'batch [s]':>10} "
+          f"{'speedup':>8}")
+    for n_replicas in [int(r) for r in replicas.split(",")]:
+        start = time.perf_counter()
+        for ix in range(n_replicas):
+            game = SchellingGame.from_board(board, seed=ix)
+            game.run(n_steps, stop_when_stable=False)
+        loop_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        SchellingEnsemble(board, n_replicas, seed=seed).run(
+            n_steps, stop_when_stable=False)
+        batch_time = time.perf_counter() - start
+
+        print(f"{n_replicas:>9} {loop_time:>10.3f} {batch_time:>10.3f} "
+              f"{loop_time / batch_time:>8.1f}")
+
+
+if __name__ == "__main__":
+    benchmark()
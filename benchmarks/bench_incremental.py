@@ -0,0 +1,84 @@
+# Copyright (C) 2022-present Associació Heuristica <info@heuristica.barcelona>
+#                      and   Dimitri Marinelli <dimi.marin@proton.me>
+#
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# A copy of the GNU Affero General Public License is in the LICENSE file
+# in the source code repository.
+
+""" single agent moves per second, incremental vs full recomputation
+
+run from the repository root:
+    python -m benchmarks.bench_incremental
+"""
+import time
+
+import click
+import numpy as np
+
+from SchellingModel.SchellingGame import SchellingBoard
+from SchellingModel.IncrementalBoard import IncrementalSchellingBoard
+
+
+def random_moves(board, n_moves, rng):
+    """Yield valid (source, destination) pairs, moving agents at random"""
+    occupied = np.flatnonzero(board.team_index() > 0)
+    empty = np.flatnonzero(board.empty_positions())
+    for _ in range(n_moves):
+        i = rng.integers(occupied.size)
+        j = rng.integers(empty.size)
+        source, destination = occupied[i], empty[j]
+        occupied[i], empty[j] = destination, source
+        yield (np.unravel_index(source, board.teams.shape),
+               np.unravel_index(destination, board.teams.shape))
+
+
+@click.command()
+@click.option("--size", "-s", type=int, default=500, help="board side")
+@click.option("--n-moves", "-n", type=int, default=20000)
+@click.option("--n-full-moves", type=int, default=50,
+              help="moves timed with the full recomputation")
+@click.option("--seed", type=int, default=1234)
+def benchmark(size, n_moves, n_full_moves, seed):
+    """ time random single agent moves on a square board """
+    board = SchellingBoard.random(size, size, seed=seed)
+
+    # full recomputation: new teams, then the neighbours and the happy mask
+    rng = np.random.default_rng(seed)
+    full = SchellingBoard.random(size, size, seed=seed)
+    start = time.perf_counter()
+    for source, destination in random_moves(full, n_full_moves, rng):
+        teams = full.teams.copy()
+        teams[destination] = teams[source]
+        teams[source] = full.empty_value
+        full.teams = teams
+        full.model_happy_mask()
+    full_rate = n_full_moves / (time.perf_counter() - start)
+
+    rng = np.random.default_rng(seed)
+    incremental = IncrementalSchellingBoard.from_board(board)
+    incremental.model_happy_mask()
+    start = time.perf_counter()
+    for source, destination in random_moves(incremental, n_moves, rng):
+        incremental.move(source, destination)
+    incremental_rate = n_moves / (time.perf_counter() - start)
+
+    assert incremental.check_consistency()
+
+    print(f"{size}x{size} board")
+    print(f"full recomputation: {full_rate:>10.0f} moves/s")
+    print(f"incremental:        {incremental_rate:>10.0f} moves/s"
+          f" ({incremental_rate / full_rate:.0f}x faster)")
+
+
+if __name__ == "__main__":
+    benchmark()
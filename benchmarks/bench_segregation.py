@@ -0,0 +1,99 @@
+# Copyright (C) 2022-present Associació Heuristica <info@heuristica.barcelona>
+#                      and   Dimitri Marinelli <dimi.marin@proton.me>
+#
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# A copy of the GNU Affero General Public License is in the LICENSE file
+# in the source code repository.
+
+""" compare the array-shift segregation with the former double loop
+
+run from the repository root:
+    python -m benchmarks.bench_segregation
+"""
+import timeit
+
+import click
+import numpy as np
+
+from SchellingModel.SchellingGame import SchellingBoard
+
+
+def loop_segregation(teams, empty_value=0):
+    """the cell by cell implementation SchellingBoard.segregation used to have"""
+    links = 0
+    mixed_links = 0
+    for i in range(teams.shape[0]):
+        for j in range(teams.shape[1]):
+            if teams[i, j] != empty_value:
+                if j + 1 <= teams.shape[1] - 1:
+                    if teams[i, j] == teams[i, j + 1]:
+                        links += 1
+                    elif teams[i, j + 1] != empty_value:
+                        mixed_links += 1
+                        links += 1
+                if i + 1 <= teams.shape[0] - 1:
+                    if teams[i, j] == teams[i + 1, j]:
+                        links += 1
+                    elif teams[i + 1, j] != empty_value:
+                        mixed_links += 1
+                        links += 1
+                if j + 1 <= teams.shape[1] - 1 and i + 1 <= teams.shape[0] - 1:
+                    if teams[i, j] == teams[i + 1, j + 1]:
+                        links += 1
+                    elif teams[i + 1, j + 1] != empty_value:
+                        mixed_links += 1
+                        links += 1
+                if j - 1 >= 0 and i + 1 <= teams.shape[0] - 1:
+                    if teams[i, j] == teams[i + 1, j - 1]:
+                        links += 1
+                    elif teams[i + 1, j - 1] != empty_value:
+                        mixed_links += 1
+                        links += 1
+
+    if links > 0:
+        return 1 - mixed_links / links
+    else:
+        return -1
+
+
+def best_time(func, repeat):
+    return min(timeit.repeat(func, number=1, repeat=repeat))
+
+
+@click.command()
+@click.option("--sizes", "-s", type=str, default="20,100,1000",
+              help="comma separated list of board sides")
+@click.option("--repeat", "-r", type=int, default=3)
+@click.option("--seed", type=int, default=1234)
+def benchmark(sizes, repeat, seed):
+    """ time the segregation of random square boards """
+    rng = np.random.default_rng(seed)
+
+    print(f"{'size':>11} {'loop [s]':>12} {'vectorized [s]':>15} {'speedup':>9}")
+    for size in [int(s) for s in sizes.split(",")]:
+        teams = rng.integers(0, 3, size=(size, size))
+        board = SchellingBoard(teams=teams)
+
+        assert board.segregation() == loop_segregation(teams)
+
+        # the loop is very slow on large boards, one run is enough there
+        loop_time = best_time(lambda: loop_segregation(teams),
+                              repeat if size < 500 else 1)
+        vect_time = best_time(board.segregation, repeat)
+
+        print(f"{size:>5}x{size:<5} {loop_time:>12.6f} {vect_time:>15.6f}"
+              f" {loop_time / vect_time:>8.0f}x")
+
+
+if __name__ == "__main__":
+    benchmark()
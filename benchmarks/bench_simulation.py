@@ -0,0 +1,48 @@
+# Copyright (C) 2022-present Associació Heuristica <info@heuristica.barcelona>
+#                      and   Dimitri Marinelli <dimi.marin@proton.me>
+#
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# A copy of the GNU Affero General Public License is in the LICENSE file
+# in the source code repository.
+
+""" steps per second of the Schelling dynamics
+
+run from the repository root:
+    python -m benchmarks.bench_simulation
+"""
+import click
+
+from SchellingModel.SchellingGame import SchellingGame
+
+
+@click.command()
+@click.option("--sizes", "-s", type=str, default="20,50,200,1000",
+              help="comma separated list of board sides")
+@click.option("--n-steps", "-n", type=int, default=50)
+@click.option("--threshold", "-t", type=float, default=0.5)
+@click.option("--dynamics", "-d", type=click.Choice(["random",
+                                                     "best_response"]),
+              default="random")
+@click.option("--seed", type=int, default=1234)
+def benchmark(sizes, n_steps, threshold, dynamics, seed):
+    """ run a fixed number of steps on random square boards """
+    print(f"{'size':>11} {'steps/s':>10}")
+    for size in [int(s) for s in sizes.split(",")]:
+        game = SchellingGame(size, size, threshold=threshold, seed=seed,
+                             dynamics=dynamics)
+        game.run(n_steps, stop_when_stable=False, stop_on_cycle=False)
+        print(f"{size:>5}x{size:<5} {game.steps_per_second:>10.1f}")
+
+
+if __name__ == "__main__":
+    benchmark()
@@ -0,0 +1,62 @@
+# Copyright (C) 2022-present Associació Heuristica <info@heuristica.barcelona>
+#                      and   Dimitri Marinelli <dimi.marin@proton.me>
+#
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# A copy of the GNU Affero General Public License is in the LICENSE file
+# in the source code repository.
+
+""" simulation steps on a large board, single process vs tiled
+
+run from the repository root:
+    python -m benchmarks.bench_tiling
+"""
+import os
+import time
+
+import click
+
+from SchellingModel.SchellingGame import SchellingGame
+from SchellingModel.Backends import set_backend
+
+
+def steps_per_second(size, n_steps, seed):
+    game = SchellingGame(size, size, seed=seed)
+    game.step()
+    start = time.perf_counter()
+    for _ in range(n_steps):
+        game.step()
+    return n_steps / (time.perf_counter() - start)
+
+
+@click.command()
+@click.option("--size", "-s", type=int, default=2000, help="board side")
+@click.option("--n-steps", "-n", type=int, default=5)
+@click.option("--tile-size", "-t", type=int, default=256)
+@click.option("--seed", type=int, default=1234)
+def benchmark(size, n_steps, tile_size, seed):
+    """ time the steps with 1, 2, 4, ... worker processes """
+    set_backend("numpy")
+    base = steps_per_second(size, n_steps, seed)
+    print(f"{'numpy':>8} {base:8.2f} steps/s")
+
+    n_workers = 1
+    while n_workers <= os.cpu_count():
+        set_backend("tiled", n_workers=n_workers, tile_size=tile_size)
+        rate = steps_per_second(size, n_steps, seed)
+        print(f"{n_workers:>8} {rate:8.2f} steps/s ({rate / base:.2f}x)")
+        n_workers *= 2
+    set_backend("numpy")
+
+
+if __name__ == "__main__":
+    benchmark()
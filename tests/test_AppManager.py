@@ -2,8 +2,10 @@ from unittest import TestCase
 import os
 import shutil
 
+from sqlalchemy import inspect, text
+
 from DataApp.AppManager import AppManager
-from DataApp.init_database import init_db
+from DataApp.init_database import init_db, pack_boards
 
 class TestAppManager(TestCase):
 
@@ -36,3 +38,20 @@ class TestAppManager(TestCase):
         app_manager.init_db_connection()
         print("app_manager created")
         assert app_manager is not None # check if object is not None
+
+    def testAppManager_upgrade_db(self) -> None:
+        # a database created before the packed boards
+        app_manager = AppManager()
+        app_manager.init_db_connection()
+        with app_manager.db_engine.begin() as connection:
+            connection.execute(text(
+                "ALTER TABLE picture_table DROP COLUMN picture_board_packed"))
+        app_manager.db_engine.dispose()
+
+        # connecting adds the column back
+        app_manager = AppManager()
+        app_manager.init_db_connection()
+        columns = [c["name"] for c in
+                   inspect(app_manager.db_engine).get_columns("picture_table")]
+        assert "picture_board_packed" in columns
+        assert pack_boards() == 0
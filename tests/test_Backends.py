@@ -0,0 +1,55 @@
+from unittest import TestCase
+from SchellingModel.Backends import NumpyBackend, NumbaBackend, \
+    get_backend, set_backend, available_backends
+from SchellingModel.Kernels import neighbourhood_kernel, team_masks
+
+import numpy as np
+
+
+class TestBackends(TestCase):
+
+    def test_selection(self):
+        backend = get_backend()
+        assert backend.name in available_backends()
+        assert get_backend() is backend
+
+        try:
+            assert set_backend("numpy").name == "numpy"
+            assert isinstance(get_backend(), NumpyBackend)
+            self.assertRaises(ValueError, set_backend, "cuda")
+        finally:
+            set_backend(backend.name)
+
+    def test_numba_loops(self):
+        # without numba the loops run as plain Python, same results
+        rng = np.random.default_rng(1234)
+        numpy_backend, numba_backend = NumpyBackend(), NumbaBackend()
+        for boundary in ["constant", "wrap"]:
+            for neighbourhood, radius in [("moore", 1), ("moore", 2),
+                                          ("von_neumann", 2)]:
+                kernel = neighbourhood_kernel(neighbourhood, radius)
+                teams = rng.integers(0, 4, size=(2, 6, 7))
+                masks = team_masks(teams, 3)
+
+                expected = numpy_backend.neighbour_counts(masks, kernel,
+                                                          boundary)
+                counts = numba_backend.neighbour_counts(masks, kernel,
+                                                        boundary)
+                assert counts.dtype == expected.dtype
+                assert (counts == expected).all()
+
+                for threshold in [0.5, [0.3, 0.6, 0.7]]:
+                    assert (numba_backend.happy_mask(counts, teams, threshold)
+                            == numpy_backend.happy_mask(counts, teams,
+                                                        threshold)).all()
+
+                links, mixed = numba_backend.link_counts(
+                    teams, kernel=kernel, boundary=boundary)
+                expected_links, expected_mixed = numpy_backend.link_counts(
+                    teams, kernel=kernel, boundary=boundary)
+                assert (links == expected_links).all()
+                assert (mixed == expected_mixed).all()
+                assert numba_backend.link_counts(
+                    teams[0], kernel=kernel, boundary=boundary) == \
+                    numpy_backend.link_counts(
+                        teams[0], kernel=kernel, boundary=boundary)
@@ -0,0 +1,110 @@
+from unittest import TestCase
+from SchellingModel.SchellingGame import SchellingBoard
+from SchellingModel.BoardBatch import BoardBatch
+
+import numpy as np
+
+
+class TestBoardBatch(TestCase):
+
+    @staticmethod
+    def random_boards(n_boards=12, shape=(7, 9), seed=1234):
+        rng = np.random.default_rng(seed)
+        teams = rng.integers(0, 3, size=(n_boards,) + shape)
+        moods = rng.choice([1, -1], size=teams.shape) * (teams > 0)
+        # a board without agents and one with a single team
+        teams[0] = 0
+        moods[0] = 0
+        teams[1][teams[1] == 2] = 1
+        return teams, moods
+
+    def test__init__(self):
+        self.assertRaises(ValueError, BoardBatch, np.zeros((3, 3)))
+
+        teams, moods = self.random_boards()
+        self.assertRaises(AssertionError, BoardBatch, teams, moods[:, 1:])
+
+        batch = BoardBatch(teams, moods)
+        assert len(batch) == 12
+        assert (batch[3].teams == teams[3]).all()
+
+    def test_from_boards(self):
+        teams, moods = self.random_boards()
+        boards = [SchellingBoard(t, m) for t, m in zip(teams, moods)]
+        batch = BoardBatch.from_boards(boards)
+
+        assert batch.teams.shape == (12, 7, 9)
+        assert (batch.moods == moods).all()
+
+    def test_matches_single_boards(self):
+        teams, moods = self.random_boards()
+        batch = BoardBatch(teams, moods)
+
+        happiness = batch.happyness()
+        segregation = batch.segregation()
+        wrong_moods = batch.find_wrong_position()
+        counts = batch.count_agents_teams()
+
+        for ix in range(len(batch)):
+            board = SchellingBoard(teams[ix], moods[ix])
+            analysis = board.analyze()
+
+            for team, value in analysis.happiness.items():
+                assert np.isclose(happiness[team][ix], value)
+            for team, value in analysis.counts.items():
+                assert counts[team][ix] == value
+            assert np.isclose(segregation[ix], analysis.segregation)
+            assert (wrong_moods[ix] == analysis.wrong_moods).all()
+            assert batch.count_wrong_moods()[ix] == analysis.n_wrong_moods
+
+        assert segregation[0] == -1
+        assert happiness["total"][0] == -1
+        assert happiness["R"][1] == -1
+
+    def test_threshold(self):
+        teams, moods = self.random_boards()
+        batch = BoardBatch(teams, moods)
+        happiness = batch.happyness()
+
+        batch.threshold = 0.9
+        strict = batch.happyness()
+        for ix in range(len(batch)):
+            board = SchellingBoard(teams[ix], moods[ix], threshold=0.9)
+            assert np.isclose(strict["total"][ix],
+                              board.happyness()["total"])
+        assert (strict["total"] <= happiness["total"]).all()
+        assert (strict["total"] < happiness["total"]).any()
+
+        self.assertRaises(ValueError, setattr, batch, "threshold",
+                          [0.5, 0.5, 0.5])
+
+    def test_neighbourhoods(self):
+        teams, moods = self.random_boards()
+        batch = BoardBatch(teams, moods, boundary="wrap", radius=3)
+
+        happiness = batch.happyness()
+        segregation = batch.segregation()
+        neighbours = batch.neighbours_tensor()
+        assert neighbours.dtype == np.int_
+        for ix in range(len(batch)):
+            board = batch[ix]
+            assert board.boundary == "wrap" and board.radius == 3
+            assert (neighbours[ix] == board.neighbours_tensor()).all()
+            assert np.isclose(segregation[ix], board.segregation())
+            assert np.isclose(happiness["total"][ix],
+                              board.happyness()["total"])
+
+    def test_diff(self):
+        teams, moods = self.random_boards()
+        diff = BoardBatch(teams, moods).diff()
+        assert diff.vacated.shape == (11, 7, 9)
+
+        for ix in range(11):
+            single = SchellingBoard(teams[ix], moods[ix]).diff(
+                SchellingBoard(teams[ix + 1], moods[ix + 1]))
+            assert (diff.vacated[ix] == single.vacated[0]).all()
+            assert (diff.mood_flips[ix] == single.mood_flips[0]).all()
+            assert (diff.n_moves[ix] == single.n_moves[0]).all()
+            for team, moves in diff.match_moves(ix).items():
+                assert len(moves) == single.n_moves[0][
+                    single.team_names.index(team)]
@@ -0,0 +1,75 @@
+from unittest import TestCase
+from SchellingModel.SchellingGame import SchellingBoard
+from SchellingModel.BoardEncoding import bits_per_cell, pack_codes, \
+    unpack_codes, encode_board, decode_board, decode_boards, \
+    parse_board_str, board_str_to_packed, HEADER
+
+import numpy as np
+
+
+class TestBoardEncoding(TestCase):
+
+    @staticmethod
+    def random_board(shape=(7, 9), seed=1234, n_teams=2):
+        rng = np.random.default_rng(seed)
+        teams = rng.integers(0, n_teams + 1, size=shape)
+        teams.flat[:n_teams + 1] = np.arange(n_teams + 1)
+        moods = rng.choice([1, -1], size=shape) * (teams > 0)
+        team_names = ["B", "R", "G", "Y"][:n_teams]
+        return SchellingBoard(teams, moods, team_names=team_names)
+
+    def test_bits_per_cell(self):
+        assert bits_per_cell(2, 2) == 3
+        assert bits_per_cell(1, 2) == 2
+        assert bits_per_cell(4, 2) == 4
+
+    def test_round_trip(self):
+        for n_teams in range(1, 5):
+            sb = self.random_board(n_teams=n_teams)
+            data = encode_board(sb)
+            n_bits = bits_per_cell(n_teams, 2)
+            assert len(data) == HEADER.size + (63 * n_bits + 7) // 8
+
+            board = decode_board(data, team_names=sb.team_names)
+            assert (board.teams == sb.teams).all()
+            assert (board.moods == sb.moods).all()
+
+        codes, n_teams, n_moods = unpack_codes(pack_codes([[0, 6]], 3, 1))
+        assert codes.tolist() == [[0, 6]]
+        assert (n_teams, n_moods) == (3, 1)
+
+    def test_invalid_data(self):
+        data = encode_board(self.random_board())
+        self.assertRaises(ValueError, unpack_codes, b"XX" + data[2:])
+        self.assertRaises(ValueError, unpack_codes, data[:-1])
+        self.assertRaises(ValueError, unpack_codes, data[:4])
+        # 7 is not a valid code for 2 teams with 2 moods
+        self.assertRaises(ValueError, unpack_codes, pack_codes([[7]], 2, 2))
+        self.assertRaises(ValueError, decode_board, data,
+                          team_names=["B", "R", "G"])
+
+    def test_decode_boards(self):
+        boards = [self.random_board(seed=seed) for seed in range(10)]
+        batch = decode_boards([encode_board(sb) for sb in boards],
+                              team_names=["B", "R"])
+
+        assert batch.teams.shape == (10, 7, 9)
+        for ix, sb in enumerate(boards):
+            assert (batch.teams[ix] == sb.teams).all()
+            assert (batch.moods[ix] == sb.moods).all()
+
+        other = self.random_board(shape=(3, 3))
+        self.assertRaises(ValueError, decode_boards,
+                          [encode_board(boards[0]), encode_board(other)])
+
+    def test_parse_board_str(self):
+        sb = self.random_board()
+        board_str = np.array2string(sb.to_str_matrix(), separator=",")
+        assert (parse_board_str(board_str) == sb.to_codes()).all()
+        assert board_str_to_packed(board_str) == encode_board(sb)
+
+        # numpy summarizes large arrays, they can not be recovered
+        sb = self.random_board(shape=(40, 40))
+        board_str = np.array2string(sb.to_str_matrix(), separator=",")
+        assert parse_board_str(board_str) is None
+        assert board_str_to_packed(board_str) is None
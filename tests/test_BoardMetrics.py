@@ -0,0 +1,96 @@
+from unittest import TestCase
+from SchellingModel.SchellingGame import SchellingBoard
+from SchellingModel.BoardBatch import BoardBatch
+from SchellingModel.BoardMetrics import board_metrics, cluster_labels, \
+    cluster_size_distribution, interface_length, dissimilarity_index, \
+    morans_i
+
+import numpy as np
+
+
+class TestBoardMetrics(TestCase):
+
+    def test_cluster_size_distribution(self):
+        board_teams = np.array([[1, 1, 0, 2],
+                                [0, 0, 1, 2],
+                                [1, 0, 0, 0]])
+        distribution = cluster_size_distribution(board_teams, 2)
+        # team 1: a cluster of 3 (diagonal contact) and a single agent
+        assert distribution.tolist() == [[0, 1, 0, 1], [0, 0, 1, 0]]
+        distribution = cluster_size_distribution(board_teams, 2,
+                                                 connectivity=4)
+        assert distribution[0].tolist() == [0, 2, 1]
+
+        # on a torus the corners touch
+        corners = np.array([[1, 0, 1],
+                            [0, 0, 0],
+                            [1, 0, 1]])
+        assert cluster_size_distribution(corners, 1).tolist() == \
+            [[0, 4]]
+        assert cluster_size_distribution(corners, 1, 4, "wrap").tolist() == \
+            [[0, 0, 0, 0, 1]]
+
+        self.assertRaises(ValueError, cluster_labels, corners[np.newaxis], 6)
+
+    def test_clusters_do_not_cross_boards(self):
+        stack = np.ones((3, 4, 4), dtype=int)
+        labels, n_labels = cluster_labels(stack == 1)
+        assert n_labels == 3
+        assert cluster_size_distribution(stack, 1)[:, 0, 16].tolist() == \
+            [1, 1, 1]
+
+    def test_interface_length(self):
+        board_teams = np.array([[1, 2],
+                                [0, 1]])
+        assert interface_length(board_teams) == 2
+        assert interface_length(board_teams, boundary="wrap") == 4
+
+    def test_dissimilarity_index(self):
+        rng = np.random.default_rng(1234)
+        board_teams = rng.integers(0, 3, size=(9, 12))
+        # the classic two group index
+        a = (board_teams == 1).reshape(3, 3, 4, 3).sum(axis=(1, 3))
+        b = (board_teams == 2).reshape(3, 3, 4, 3).sum(axis=(1, 3))
+        expected = 0.5 * np.abs(a / a.sum() - b / b.sum()).sum()
+        assert np.isclose(dissimilarity_index(board_teams, 2), expected)
+
+        # fully separated blocks and a single team
+        separated = np.repeat([[1, 1, 1, 2, 2, 2]], 3, axis=0)
+        assert np.isclose(dissimilarity_index(separated, 2), 1)
+        assert dissimilarity_index(np.ones((3, 3), dtype=int), 2) == -1
+
+    def test_morans_i(self):
+        # stripes of one team next to each other are strongly clustered
+        stripes = np.repeat([[1, 1, 1, 2, 2, 2]], 6, axis=0)
+        assert (morans_i(stripes, 2) > 0.5).all()
+        # a checkerboard with von Neumann neighbours is perfectly dispersed
+        checkerboard = np.indices((6, 6)).sum(axis=0) % 2 + 1
+        kernel = np.array([[0, 1, 0], [1, 0, 1], [0, 1, 0]])
+        assert np.allclose(morans_i(checkerboard, 2, kernel=kernel), -1)
+        # a single team is not a dispersed board, I is not defined
+        assert np.isnan(morans_i(np.ones((3, 3), dtype=int), 2)).all()
+
+    def test_board_metrics(self):
+        rng = np.random.default_rng(1234)
+        teams = rng.integers(0, 4, size=(5, 10, 8))
+        batch = BoardBatch(teams, team_names=["R", "B", "G"])
+        metrics = board_metrics(batch)
+
+        assert metrics.largest_cluster.shape == (5, 3)
+        assert metrics.morans_i.shape == (5, 3)
+        for ix in range(5):
+            single = board_metrics(batch[ix])
+            assert (single.largest_cluster[0] ==
+                    metrics.largest_cluster[ix]).all()
+            assert np.allclose(single.morans_i[0], metrics.morans_i[ix],
+                               equal_nan=True)
+            assert single.interface_length[0] == \
+                metrics.interface_length[ix]
+            # every agent is in exactly one cluster
+            assert np.allclose(metrics.mean_cluster_size[ix] *
+                               metrics.n_clusters[ix],
+                               np.bincount(teams[ix].ravel(),
+                                           minlength=4)[1:])
+
+        sb = SchellingBoard.random(10, 10, seed=1, boundary="wrap")
+        assert board_metrics(sb).largest_cluster.shape == (1, 2)
@@ -41,6 +41,8 @@ class TestConfigManager(TestCase):
         self.assertEqual(config.db.db_type, 'postgres')
         self.assertIsNone(config.db.path)
         self.assertEqual(config.db.connection["port"], "2")
+        self.assertEqual(config.model_path, "../models/cnn_int8.tflite")
+        self.assertEqual(config.model_backend, "tflite")
 
 
 
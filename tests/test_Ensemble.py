@@ -0,0 +1,56 @@
+from unittest import TestCase
+from SchellingModel.SchellingGame import SchellingBoard
+from SchellingModel.Ensemble import SchellingEnsemble, relocate_agents_batch
+
+import numpy as np
+
+
+class TestSchellingEnsemble(TestCase):
+
+    def test__init__(self):
+        sb = SchellingBoard.random(8, 6, seed=1)
+        ensemble = SchellingEnsemble(sb, 5, seed=2)
+        assert ensemble.teams.shape == (5, 6, 8)
+        assert (ensemble.teams == sb.teams).all()
+        self.assertRaises(ValueError, SchellingEnsemble, sb, 0)
+
+    def test_relocate_agents_batch(self):
+        rng = np.random.default_rng(1)
+        teams = rng.integers(0, 3, size=(10, 6, 7))
+        movers = (teams > 0) & (rng.random(teams.shape) < 0.5)
+        empty = teams == 0
+        rngs = [np.random.default_rng(s) for s in range(10)]
+
+        new_teams, moved = relocate_agents_batch(teams, movers, empty, rngs)
+        for ix in range(10):
+            # the agents are only moved, never created or destroyed
+            assert (np.bincount(new_teams[ix].ravel(), minlength=3) ==
+                    np.bincount(teams[ix].ravel(), minlength=3)).all()
+            assert moved[ix] == min(movers[ix].sum(), empty[ix].sum())
+            changed = new_teams[ix] != teams[ix]
+            assert (movers[ix] | empty[ix])[changed].all()
+
+    def test_run(self):
+        sb = SchellingBoard.random(12, 10, seed=1)
+        history = SchellingEnsemble(sb, 8, seed=2).run(
+            10, stop_when_stable=False)
+
+        assert history.happiness.shape == (11, 8)
+        assert (history.step == np.arange(11)).all()
+        assert (history.moved[0] == 0).all()
+        # all the replicas start from the same board
+        assert np.allclose(history.happiness[0], sb.happyness()["total"])
+        assert np.allclose(history.segregation[0], sb.segregation())
+
+        bands = history.bands("segregation", (5, 50, 95))
+        assert bands.shape == (3, 11)
+        assert (bands[0] <= bands[1]).all() and (bands[1] <= bands[2]).all()
+
+    def test_replica_streams(self):
+        # a replica does not depend on the size of the ensemble
+        sb = SchellingBoard.random(12, 10, seed=1)
+        small = SchellingEnsemble(sb, 2, seed=3)
+        large = SchellingEnsemble(sb, 6, seed=3)
+        small.run(5, stop_when_stable=False)
+        large.run(5, stop_when_stable=False)
+        assert (small.teams == large.teams[:2]).all()
@@ -0,0 +1,89 @@
+from unittest import TestCase
+from SchellingModel.SchellingGame import SchellingBoard, SchellingGame
+from SchellingModel.BoardBatch import BoardBatch
+from SchellingModel.HappinessRules import HappinessRule, compile_rules, \
+    rule_happy_mask, is_rule
+
+import pickle
+import numpy as np
+
+
+class TestHappinessRules(TestCase):
+
+    def test_evaluate(self):
+        rule = HappinessRule("own >= 3 and others <= 2")
+        assert rule.evaluate(3, 2)
+        assert not rule.evaluate(2, 0)
+        assert not rule.evaluate(4, 3)
+
+        assert HappinessRule("fraction >= 0.5").evaluate(0, 0)
+        assert HappinessRule("1 <= own < 3").evaluate([0, 1, 2, 3],
+                                                      0).tolist() == \
+            [False, True, True, False]
+        assert HappinessRule("not total").evaluate(0, 0)
+
+    def test_invalid_rules(self):
+        for expression in ["__import__('os')", "own.real", "x > 1",
+                           "own >=", "'a' < own", "[own]"]:
+            self.assertRaises(ValueError, HappinessRule, expression)
+
+    def test_combine(self):
+        rule = HappinessRule.at_least_own(3) & \
+            ~HappinessRule.at_most_strangers(1)
+        assert rule.expression == "(own >= 3) and (not (others <= 1))"
+        assert rule.evaluate(3, 2) and not rule.evaluate(3, 1)
+
+        rule = HappinessRule("own > 5") | HappinessRule("others == 0")
+        assert rule.evaluate(1, 0) and rule.evaluate(6, 3)
+        assert pickle.loads(pickle.dumps(rule)) == rule
+
+    def test_compile(self):
+        table = compile_rules(HappinessRule("own >= 2 * others"), 9)
+        assert table.shape == (9, 9)
+        assert table[4, 2] and not table[3, 2]
+
+        tables = compile_rules([HappinessRule("own >= 2"), 0.5], 9)
+        assert tables.shape == (2, 9, 9)
+        assert (tables[1] == HappinessRule.fraction_own(0.5).table(9)).all()
+
+        assert is_rule(HappinessRule("own > 1"))
+        assert is_rule([0.3, HappinessRule("own > 1")])
+        assert not is_rule([0.3, 0.5])
+
+    def test_same_as_threshold(self):
+        sb = SchellingBoard.random(30, 20, n_teams=3, seed=1)
+        for threshold in [0.5, 0.3, [0.3, 0.6, 0.7]]:
+            sb.threshold = threshold
+            expected = sb.model_happy_mask()
+            expected_tensor = sb.model_happy_tensor()
+
+            sb.threshold = HappinessRule.fraction_own(threshold) \
+                if np.ndim(threshold) == 0 else \
+                [HappinessRule.fraction_own(t) for t in threshold]
+            sb.teams = sb.teams
+            assert (sb.model_happy_mask() == expected).all()
+            assert (sb.model_happy_tensor() == expected_tensor).all()
+
+    def test_board(self):
+        sb = SchellingBoard.random(30, 20, n_teams=2, seed=1)
+        neighbours = sb.neighbours_tensor()
+        team_index = sb.team_index()
+        own = np.take_along_axis(neighbours,
+                                 np.maximum(team_index - 1, 0)[np.newaxis],
+                                 axis=0)[0]
+        others = neighbours.sum(axis=0) - own
+
+        rules = [HappinessRule("own >= 3"), HappinessRule("others <= 2")]
+        expected = np.where(team_index == 1, own >= 3, others <= 2) & \
+            (team_index > 0)
+        assert (rule_happy_mask(neighbours, team_index, rules) ==
+                expected).all()
+
+        batch = BoardBatch(np.stack([sb.teams] * 2), threshold=rules)
+        assert (batch.model_happy_mask() == expected).all()
+
+    def test_game(self):
+        rule = HappinessRule("own >= 2 or others == 0")
+        history = SchellingGame(30, 30, threshold=rule, seed=1).run(200)
+        assert history[-1]["moved"] == 0
+        assert history[-1]["happiness"] == 1
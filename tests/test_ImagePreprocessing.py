@@ -0,0 +1,147 @@
+from unittest import TestCase
+from VisualDetector.ImagePreprocessing import prepare_img_for_boundary, \
+    find_largest_box, downscale, upscale_box, refine_box_corners, \
+    find_box_downscaled, target_size, cell_view, normalize_cells, \
+    generate_cell_imgs_vect
+
+import cv2
+import numpy as np
+
+
+def board_picture(corners, shape=(1500, 2000)):
+    """ a dark board on a light background, corners with sub-pixel shift """
+    img = np.full(shape + (3,), 200, np.uint8)
+    cv2.fillPoly(img, [np.int32(np.round(corners * 16))], (60, 60, 60),
+                 lineType=cv2.LINE_AA, shift=4)
+    return img
+
+
+def corner_distance(box, corners):
+    box = np.asarray(box, np.float64).reshape(-1, 2)
+    distances = np.linalg.norm(box[:, None] - corners[None], axis=-1)
+    return distances.min(axis=1).max()
+
+
+class TestImagePreprocessing(TestCase):
+    corners = np.array([[305.3, 210.7], [1725.6, 265.2],
+                        [1690.4, 1305.9], [270.8, 1240.1]])
+
+    def test_downscale(self):
+        img = np.zeros((1500, 2000, 3), np.uint8)
+        small, scale = downscale(img, 500)
+        assert small.shape == (375, 500, 3)
+        assert scale == (0.25, 0.25)
+
+        same, scale = downscale(img, 4000)
+        assert same is img and scale == (1.0, 1.0)
+
+    def test_upscale_box(self):
+        box = np.array([[[0, 0]], [[9, 0]], [[9, 4]], [[0, 4]]], np.int32)
+        upscaled = upscale_box(box, (0.25, 0.5))
+        assert upscaled.dtype == np.float32
+        assert upscaled.reshape(-1, 2).tolist() == [[1.5, 0.5], [37.5, 0.5],
+                                                    [37.5, 8.5], [1.5, 8.5]]
+
+    def test_find_box_downscaled(self):
+        img = board_picture(self.corners)
+        full = find_largest_box(prepare_img_for_boundary(img))
+
+        box = find_box_downscaled(img, 500)
+        assert box.shape == (4, 1, 2)
+        assert corner_distance(box, self.corners) < 8
+        assert corner_distance(box, full) < 8
+
+        refined = find_box_downscaled(img, 500, refine=True)
+        assert corner_distance(refined, self.corners) < 2
+
+        boxes = find_box_downscaled(img, 500, return_first_n_boxes=3)
+        assert isinstance(boxes, list) and len(boxes) > 0
+
+    def test_refine_box_corners(self):
+        img = board_picture(self.corners)
+        rough = (self.corners + [[4, -3], [-3, 4], [3, 3], [-4, -4]])
+        refined = refine_box_corners(img, rough.reshape(-1, 1, 2))
+        assert refined.shape == (4, 1, 2)
+        assert corner_distance(refined, self.corners) < 1.5
+
+        # the corners of an image too small for the window are left as
+        # they are
+        border = np.array([[[0, 0]], [[7, 0]], [[7, 7]], [[0, 7]]],
+                          np.float32)
+        refined = refine_box_corners(img[:8, :8], border, window=15)
+        assert (refined == border).all()
+        assert refined is not border
+
+
+def board_cells(grid_x, grid_y):
+    """ an image of the board, every pixel has the index of its cell and
+    its row and column inside the cell """
+    cell_width, cell_height = target_size
+    rows = np.arange(grid_y * cell_height)[:, None]
+    columns = np.arange(grid_x * cell_width)[None, :]
+    index = rows // cell_height * 10 + columns // cell_width
+    return np.stack(np.broadcast_arrays(index, rows % cell_height,
+                                        columns % cell_width),
+                    axis=-1).astype(np.uint8)
+
+
+def reshape_cells(img_corrected, grid_x, grid_y):
+    """ the cells as generate_cell_imgs_vect cut them before the view """
+    dataset = img_corrected.reshape(img_corrected.shape[0] // target_size[0],
+                                    target_size[0],
+                                    img_corrected.shape[1] // target_size[1],
+                                    target_size[1], img_corrected.shape[2])
+    dataset = dataset.swapaxes(1, 2)
+    return dataset.reshape(-1, target_size[0], target_size[1],
+                           img_corrected.shape[2])
+
+
+class TestCellView(TestCase):
+
+    def test_rectangular(self):
+        cell_width, cell_height = target_size
+        img = board_cells(3, 2)
+        cells = cell_view(img, 3, 2)
+
+        assert cells.shape == (2, 3, cell_height, cell_width, 3)
+        assert np.shares_memory(cells, img)
+        assert not cells.flags.writeable
+        for y in range(2):
+            for x in range(3):
+                block = img[y * cell_height:(y + 1) * cell_height,
+                            x * cell_width:(x + 1) * cell_width]
+                assert (cells[y, x] == block).all()
+                assert (cells[y, x, ..., 0] == 10 * y + x).all()
+
+        # row-major order, as the label matrix of detect_labels_fast
+        dataset = generate_cell_imgs_vect(img, 3, 2)
+        assert dataset.shape == (6, cell_height, cell_width, 3)
+        assert dataset[:, 0, 0, 0].tolist() == [0, 1, 2, 10, 11, 12]
+
+    def test_resize(self):
+        img = board_cells(3, 2)
+        small = cv2.resize(img, (img.shape[1] // 2, img.shape[0] // 2),
+                           interpolation=cv2.INTER_NEAREST)
+        cells = cell_view(small, 3, 2)
+        assert cells.shape == (2, 3, target_size[1], target_size[0], 3)
+        assert not np.shares_memory(cells, small)
+        assert (cells[1, 2, 5:-5, 5:-5, 0] == 12).all()
+
+    def test_square_matches_reshape(self):
+        img = board_cells(4, 4)
+        assert (generate_cell_imgs_vect(img, 4, 4) ==
+                reshape_cells(img, 4, 4)).all()
+
+    def test_normalize_cells(self):
+        img = board_cells(3, 2)
+        img[0, 0] = 255
+        cells = normalize_cells(cell_view(img, 3, 2))
+
+        assert cells.dtype == np.float32
+        assert cells.shape == (6, target_size[1], target_size[0], 3)
+        assert cells.min() >= 0 and cells.max() == 1
+        assert np.allclose(cells, reshape_cells(img, 3, 2) / 255)
+
+        out = np.empty_like(cells)
+        assert normalize_cells(cell_view(img, 3, 2), out) is out
+        assert (out == cells).all()
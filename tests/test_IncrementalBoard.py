@@ -0,0 +1,62 @@
+from unittest import TestCase
+from SchellingModel.SchellingGame import SchellingBoard
+from SchellingModel.IncrementalBoard import IncrementalSchellingBoard
+
+import numpy as np
+
+
+class TestIncrementalSchellingBoard(TestCase):
+
+    def test_move(self):
+        board_teams = np.array([[1, 1, 0],
+                                [2, 0, 2],
+                                [0, 1, 2]])
+        board_moods = np.array([[1, 1, 0],
+                                [-1, 0, 1],
+                                [0, 1, -1]])
+        sb = IncrementalSchellingBoard(teams=board_teams, moods=board_moods)
+        sb.model_happy_mask()
+
+        sb.move((0, 0), (1, 1))
+        assert sb.teams[0, 0] == 0 and sb.teams[1, 1] == 1
+        assert sb.moods[0, 0] == 0 and sb.moods[1, 1] == 1
+        # the original arrays are not touched
+        assert board_teams[0, 0] == 1
+        assert sb.check_consistency()
+
+        self.assertRaises(ValueError, sb.move, (0, 0), (0, 2))
+        self.assertRaises(ValueError, sb.move, (0, 1), (1, 0))
+
+    def test_random_moves(self):
+        rng = np.random.default_rng(1234)
+        sb = IncrementalSchellingBoard.from_board(
+            SchellingBoard.random(17, 11, n_teams=3, density=0.7, seed=1))
+
+        for ix in range(300):
+            source = rng.choice(np.argwhere(sb.team_index() > 0))
+            destination = rng.choice(np.argwhere(sb.empty_positions()))
+            sb.move(source, destination)
+            if ix % 50 == 0:
+                assert sb.check_consistency()
+
+        assert sb.check_consistency()
+
+        fresh = SchellingBoard(teams=sb.teams.copy(),
+                               team_names=sb.team_names)
+        assert sb.happyness() == fresh.happyness()
+
+    def test_neighbourhoods(self):
+        rng = np.random.default_rng(1234)
+        for boundary, neighbourhood, radius in [("wrap", "moore", 1),
+                                                ("constant", "moore", 3),
+                                                ("wrap", "von_neumann", 2),
+                                                ("wrap", "moore", 6)]:
+            # radius 6 is larger than the board, cells repeat in the window
+            sb = IncrementalSchellingBoard.random(
+                9, 8, n_teams=3, density=0.6, seed=1, boundary=boundary,
+                neighbourhood=neighbourhood, radius=radius)
+            for _ in range(30):
+                source = rng.choice(np.argwhere(sb.team_index() > 0))
+                destination = rng.choice(np.argwhere(sb.empty_positions()))
+                sb.move(source, destination)
+            assert sb.check_consistency()
@@ -0,0 +1,154 @@
+from unittest import TestCase
+from concurrent.futures import Future, ThreadPoolExecutor
+import threading
+import time
+from VisualDetector.InferenceWorker import InferenceWorker, get_worker
+from VisualDetector.ModelRegistry import default_registry
+
+import numpy as np
+
+
+class SumPredictor:
+    """Predicts the sum of every cell, records the batch sizes"""
+
+    def __init__(self, delay=0):
+        self.batches = []
+        self.delay = delay
+
+    def predict(self, batch):
+        time.sleep(self.delay)
+        self.batches.append(len(batch))
+        if np.isnan(batch).any():
+            raise ValueError("bad cells")
+        return batch.reshape(len(batch), -1).sum(axis=1, keepdims=True)
+
+
+class TestInferenceWorker(TestCase):
+
+    def test_coalesce(self):
+        predictor = SumPredictor()
+        worker = InferenceWorker(predictor, max_batch=1000, max_wait=0.2)
+        try:
+            requests = [np.full((n, 2, 2), n, dtype=np.float32)
+                        for n in range(1, 21)]
+            with ThreadPoolExecutor(max_workers=20) as executor:
+                results = list(executor.map(worker.predict, requests))
+
+            for n, result in zip(range(1, 21), results):
+                assert result.shape == (n, 1)
+                assert (result == 4 * n).all()
+
+            assert worker.n_requests == 20
+            assert worker.n_cells == sum(range(1, 21))
+            assert worker.n_batches < 20
+            assert sum(predictor.batches) == worker.n_cells
+        finally:
+            worker.close()
+
+    def test_max_batch(self):
+        predictor = SumPredictor()
+        worker = InferenceWorker(predictor, max_batch=8, max_wait=0.01)
+        try:
+            result = worker.predict(np.ones((20, 2, 2)))
+            assert (result == 4).all() and len(result) == 20
+            assert predictor.batches == [8, 8, 4]
+        finally:
+            worker.close()
+
+    def test_errors(self):
+        worker = InferenceWorker(SumPredictor(), max_wait=0.01)
+        future = worker.submit(np.full((2, 2, 2), np.nan))
+        self.assertRaises(ValueError, future.result, 5)
+        # the worker keeps working after a failed batch
+        assert (worker.predict(np.ones((1, 2, 2)), timeout=5) == 4).all()
+        self.assertRaises(ValueError, worker.submit, np.ones((0, 2, 2)))
+
+        worker.close()
+        self.assertRaises(RuntimeError, worker.submit, np.ones((1, 2, 2)))
+
+    def test_close_while_submitting(self):
+        worker = InferenceWorker(SumPredictor(delay=0.01), max_wait=0.001)
+        futures = []
+
+        def submit():
+            while True:
+                try:
+                    futures.append(worker.submit(np.ones((1, 2, 2))))
+                except RuntimeError:
+                    return
+
+        thread = threading.Thread(target=submit)
+        thread.start()
+        time.sleep(0.05)
+        worker.close()
+        thread.join()
+
+        # every accepted request is predicted, none is left waiting
+        assert len(futures) > 0
+        for future in futures:
+            assert (future.result(timeout=5) == 4).all()
+        worker.close()
+
+    def test_close_fails_leftovers(self):
+        worker = InferenceWorker(SumPredictor(), max_wait=0.01)
+        worker._requests.put(None)
+        future = Future()
+        worker._requests.put((np.ones((1, 2, 2), np.float32), future))
+        worker.close()
+        self.assertRaises(RuntimeError, future.result, 5)
+
+
+class SumModel:
+    input_shape = (None, 2, 2)
+
+    def __init__(self):
+        self.batches = []
+
+    def __call__(self, batch, training=False):
+        self.batches.append(len(batch))
+        return batch.reshape(len(batch), -1).sum(axis=1, keepdims=True)
+
+
+class TestGetWorker(TestCase):
+
+    def setUp(self):
+        self.loaded = []
+
+        def loader(path, backend):
+            self.loaded.append((path, backend))
+            return SumModel()
+
+        self.loader = default_registry.loader
+        self.batch_size = default_registry.batch_size
+        default_registry.loader = loader
+        default_registry.clear()
+
+    def tearDown(self):
+        default_registry.loader = self.loader
+        default_registry.batch_size = self.batch_size
+        default_registry.clear()
+
+    def test_model_batches(self):
+        default_registry.batch_size = 16
+        worker = get_worker("chunks.h5", max_wait=0.2)
+        requests = [np.ones((n, 2, 2)) for n in (30, 40, 50)]
+        with ThreadPoolExecutor(max_workers=3) as executor:
+            results = list(executor.map(worker.predict, requests))
+        assert [len(result) for result in results] == [30, 40, 50]
+
+        # the requests are merged, the model gets chunks of batch_size
+        model = default_registry.get("chunks.h5").model
+        assert sum(model.batches) == 120 + 1
+        assert max(model.batches) == 16
+
+    def test_eviction_frees_the_model(self):
+        worker = get_worker("sum.h5", max_wait=0.001)
+        assert get_worker("sum.h5", "keras") is worker
+        assert (worker.predict(np.ones((3, 2, 2)), timeout=5) == 4).all()
+        assert self.loaded == [("sum.h5", "keras")]
+
+        # the worker does not keep the evicted model alive
+        assert default_registry.evict("sum.h5")
+        assert (worker.predict(np.ones((1, 2, 2)), timeout=5) == 4).all()
+        assert self.loaded == [("sum.h5", "keras")] * 2
+        assert "sum.h5" in default_registry
@@ -99,6 +99,47 @@ class TestMatchManager(TestCase):
         #assert mm.get_open_game("A") is not None
 
 
+    def test_pack_board_status(self):
+        import numpy as np
+        from SchellingModel.SchellingGame import SchellingBoard
+        from SchellingModel.BoardEncoding import encode_board
+
+        mm = MatchManager(self.app_manager.db_engine)
+        mm.create_match(["A"], ["free"], [42])
+
+        sb = SchellingBoard.random(6, 5, seed=1)
+        sb.moods = np.where(sb.teams > 0, 1, 0)
+        happiness = sb.happyness()
+        common = dict(user_id="a", pic_hash="pic_hash", pic_path="pic_path",
+                      upload_time=None, board_name="A", img_box=None,
+                      segregation=sb.segregation(), happiness=happiness)
+
+        # an old row stored as text only, and a new one with the packed board
+        mm.save_image_db(board_codes=sb.to_codes(),
+                         code_labels=sb.code_labels(), **common)
+        mm.save_image_db(board_status_str=np.array2string(
+                             sb.to_str_matrix(), separator=","),
+                         board_packed=encode_board(sb), **common)
+
+        # a malformed board in between does not stop the conversion, but it
+        # leaves a gap before the last picture
+        mm.save_image_db(board_status_str="[['B_H','R_S'],['B_H']]",
+                         **common)
+        mm.save_image_db(board_status_str=np.array2string(
+                             sb.to_str_matrix(), separator=","),
+                         board_packed=encode_board(sb), **common)
+
+        assert mm.pack_board_status() == 1
+        og = mm.get_open_game(mm.get_board("A"))
+        packed = [pic.picture_board_packed for pic in og.pictures]
+        assert packed == [encode_board(sb)] * 2 + [None, encode_board(sb)]
+
+        batch = mm.board_batch(og)
+        assert len(batch) == 3
+        assert (batch.teams == sb.teams).all()
+        assert (batch.segregation() == sb.segregation()).all()
+        assert mm.move_counts(og).tolist() == [0]
+
 
     #
     # def test__init_db_session(self):
@@ -0,0 +1,98 @@
+from unittest import TestCase
+from VisualDetector.ModelRegistry import ModelRegistry, Predictor, \
+    model_backend
+
+import numpy as np
+
+
+class CountingModel:
+    """A model that records the batches it predicts"""
+    input_shape = (None, 4, 4, 3)
+
+    def __init__(self, path):
+        self.path = path
+        self.calls = []
+
+    def __call__(self, batch, training=False):
+        self.calls.append(batch.shape)
+        return np.ones((batch.shape[0], 5)) / 5
+
+
+class TestModelRegistry(TestCase):
+
+    def setUp(self):
+        self.loaded = []
+
+        def loader(path, backend):
+            self.loaded.append(path)
+            return CountingModel(path)
+
+        self.registry = ModelRegistry(max_models=2, loader=loader,
+                                      warm_up_batch=3)
+
+    def test_load_once(self):
+        predictor = self.registry.get("a.h5")
+        assert isinstance(predictor, Predictor)
+        assert predictor.input_shape == (4, 4, 3)
+        # warmed up with a dummy batch
+        assert predictor.model.calls == [(3, 4, 4, 3)]
+
+        assert self.registry.get("a.h5") is predictor
+        assert self.loaded == ["a.h5"]
+
+        probabilities = predictor.predict(np.zeros((7, 4, 4, 3)))
+        assert probabilities.shape == (7, 5)
+
+    def test_batch_size(self):
+        registry = ModelRegistry(loader=lambda path, backend:
+                                 CountingModel(path),
+                                 warm_up_batch=0, batch_size=4)
+        predictor = registry.get("a.h5")
+        assert predictor.batch_size == 4
+
+        # the model never sees more than batch_size inputs at once
+        probabilities = predictor.predict(np.zeros((10, 4, 4, 3)))
+        assert probabilities.shape == (10, 5)
+        assert predictor.model.calls == [(4, 4, 4, 3), (4, 4, 4, 3),
+                                         (2, 4, 4, 3)]
+        self.assertRaises(ValueError, Predictor, predictor.model,
+                          batch_size=0)
+
+    def test_eviction(self):
+        self.registry.get("a.h5")
+        self.registry.get("b.h5")
+        self.registry.get("a.h5")
+        self.registry.get("c.h5")
+        # b was the least recently used
+        assert self.registry.paths() == ["a.h5", "c.h5"]
+        assert "b.h5" not in self.registry
+
+        assert self.registry.evict("a.h5")
+        assert not self.registry.evict("a.h5")
+        assert len(self.registry) == 1
+
+        self.registry.get("a.h5")
+        assert self.loaded == ["a.h5", "b.h5", "c.h5", "a.h5"]
+
+        self.registry.clear()
+        assert len(self.registry) == 0
+        self.assertRaises(ValueError, ModelRegistry, max_models=0)
+
+    def test_backend_key(self):
+        keras = self.registry.get("a.h5")
+        onnx = self.registry.get("a.h5", "onnx")
+        assert onnx is not keras
+        assert self.registry.get("a.h5", "keras") is keras
+        assert self.registry.get("a.h5", "onnx") is onnx
+        assert self.loaded == ["a.h5", "a.h5"]
+
+        assert self.registry.evict("a.h5", "onnx")
+        assert "a.h5" in self.registry
+        assert self.registry.get("a.h5", "auto") is keras
+
+    def test_model_backend(self):
+        assert model_backend("models/cnn.h5") == "keras"
+        assert model_backend("models/cnn_int8.tflite") == "tflite"
+        assert model_backend("models/cnn.ONNX") == "onnx"
+        assert model_backend("models/cnn.h5", "onnx") == "onnx"
+        self.assertRaises(ValueError, model_backend, "cnn.h5", "torch")
@@ -0,0 +1,54 @@
+import tempfile
+from unittest import TestCase
+from SchellingModel.ParameterSweep import sweep_points, point_key, \
+    run_point, run_sweep, ResultStore
+
+
+class TestParameterSweep(TestCase):
+
+    def setUp(self) -> None:
+        self.tmp_dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self) -> None:
+        self.tmp_dir.cleanup()
+
+    def test_sweep_points(self):
+        points = sweep_points([0.3, 0.5], [0.8], [10, 20], [2, 3],
+                              n_repeats=2)
+        assert len(points) == 16
+        assert len({point_key(p) for p in points}) == 16
+        # the key does not depend on the order of the parameters
+        assert point_key(dict(reversed(points[0].items()))) == \
+            point_key(points[0])
+
+    def test_run_point(self):
+        params = sweep_points([0.5], [0.8], [10], [2])[0]
+        result = run_point(params)
+        assert result["threshold"] == 0.5
+        assert result["converged"]
+        assert result["happiness"] == 1.0
+        # each point is reproducible
+        assert run_point(params)["segregation"] == result["segregation"]
+
+    def test_result_store(self):
+        store = ResultStore(self.tmp_dir.name)
+        params = sweep_points([0.5], [0.8], [10], [2])[0]
+        assert params not in store
+        assert store.get(params) is None
+
+        store.put(params, {"segregation": 0.7})
+        assert params in store
+        assert store.get(params) == {"segregation": 0.7}
+        assert len(store) == 1
+
+    def test_run_sweep(self):
+        store = ResultStore(self.tmp_dir.name)
+        points = sweep_points([0.3, 0.6], [0.8], [10], [2, 3])
+        assert run_sweep(points[:2], store, n_workers=1) == 2
+        # the sweep resumes from the points already in the store
+        assert run_sweep(points, store, n_workers=2) == 2
+        assert run_sweep(points, store, n_workers=2) == 0
+
+        table = store.to_dataframe()
+        assert len(table) == 4
+        assert {"threshold", "n_teams", "segregation"} <= set(table.columns)
@@ -1,7 +1,10 @@
 from unittest import TestCase
-from SchellingModel.SchellingGame import SchellingBoard
+from SchellingModel.SchellingGame import SchellingBoard, SchellingGame, \
+    best_response_moves
+from SchellingModel.Kernels import neighbourhood_kernel
 
 import numpy as np
+from fractions import Fraction
 
 
 class TestSchellingBoard(TestCase):
@@ -238,3 +241,436 @@ class TestSchellingBoard(TestCase):
         segregation = sb.segregation()
         assert  np.isclose(segregation, 2/11)
 
+
+    def test_segregation_matches_loop(self):
+        def loop_segregation(teams, empty_value=0):
+            links = 0
+            mixed_links = 0
+            n_rows, n_cols = teams.shape
+            for i in range(n_rows):
+                for j in range(n_cols):
+                    if teams[i, j] == empty_value:
+                        continue
+                    for di, dj in [(0, 1), (1, 0), (1, 1), (1, -1)]:
+                        ni, nj = i + di, j + dj
+                        if 0 <= ni < n_rows and 0 <= nj < n_cols:
+                            if teams[i, j] == teams[ni, nj]:
+                                links += 1
+                            elif teams[ni, nj] != empty_value:
+                                mixed_links += 1
+                                links += 1
+            return 1 - mixed_links / links if links > 0 else -1
+
+        rng = np.random.default_rng(1234)
+        for shape in [(1, 1), (1, 7), (6, 1), (5, 8), (13, 9)]:
+            board_teams = rng.integers(0, 4, size=shape)
+            sb = SchellingBoard(teams=board_teams,
+                                team_names=["Red", "Blue", "Green"])
+            assert sb.segregation() == loop_segregation(board_teams)
+
+        # no links at all
+        sb = SchellingBoard(teams=np.array([[1, 0, 2], [0, 0, 0]]))
+        assert sb.segregation() == -1
+
+    def test_neighbours_tensor(self):
+        sb = self.default_sb()
+        neighbours = sb.neighbours_tensor()
+        assert neighbours.shape == (3, 3, 4)
+
+        # the top left Red agent touches Blue (twice) and nobody else
+        assert neighbours[:, 0, 0].tolist() == [0, 2, 0]
+        assert (sb.same_team_neighbours("Blue") == neighbours[1]).all()
+
+        # signed counts, whatever the dtype of the kernels
+        assert neighbours.dtype == np.int_
+        assert sb.same_team_neighbours(1).dtype == np.int_
+        assert (sb.same_team_neighbours(1) - 5).max() < 0
+
+        # the counts are cached until the teams are reassigned
+        counts = sb._neighbour_counts()
+        assert sb._neighbour_counts() is counts
+        assert (sb.neighbours_tensor() == neighbours).all()
+        sb.teams = np.zeros_like(sb.teams)
+        assert sb._neighbour_counts() is not counts
+        assert not sb.neighbours_tensor().any()
+
+    def test_model_happy_mask(self):
+        board_teams = [[1, 1, 2, 2],
+                       [1, 1, 2, 2],
+                       [1, 0, 0, 2]]
+        board_moods = [[1, 1, 1, -1],
+                       [1, -1, 1, 1],
+                       [1, 0, 0, 1]]
+        sb = SchellingBoard(teams=np.array(board_teams),
+                            moods=np.array(board_moods))
+
+        assert sb.model_happy_mask().tolist() == [
+            [True, True, True, True],
+            [True, True, True, True],
+            [True, False, False, True]]
+        assert sb.find_wrong_position().tolist() == [
+            [False, False, False, True],
+            [False, True, False, False],
+            [False, False, False, False]]
+        assert sb.happyness() == {"B": 1.0, "R": 1.0, "total": 1.0}
+
+    def test_analyze(self):
+        sb = self.default_sb()
+        analysis = sb.analyze()
+
+        assert analysis.counts == sb.count_agents_teams()
+        assert analysis.happiness == sb.happyness()
+        assert analysis.segregation == sb.segregation()
+        assert (analysis.wrong_moods == sb.find_wrong_position()).all()
+        assert analysis.n_wrong_moods == np.sum(sb.find_wrong_position())
+        assert (analysis.labels == sb.to_str_matrix()).all()
+
+        # without moods there is nothing to check
+        sb = SchellingBoard(teams=sb.teams, team_names=sb.team_names)
+        assert sb.analyze().wrong_moods is None
+        assert sb.analyze().n_wrong_moods == 0
+
+    def test_threshold(self):
+        board_teams = [[1, 1, 2],
+                       [1, 1, 2],
+                       [2, 2, 2]]
+        sb = SchellingBoard(teams=np.array(board_teams))
+        # the centre has 3 of 8 neighbours of its team
+        assert not sb.model_happy_mask()[1, 1]
+        sb.threshold = 0.3
+        assert sb.model_happy_mask()[1, 1]
+
+    def test_team_thresholds(self):
+        rng = np.random.default_rng(1234)
+        thresholds = [0.3, 0.5, 0.7, 1 / 3]
+        board_teams = rng.integers(0, 5, size=(15, 12))
+        sb = SchellingBoard(teams=board_teams, team_names=list("ABCD"),
+                            threshold=thresholds)
+
+        neighbours = sb.neighbours_tensor()
+        happy_cells = sb.model_happy_mask()
+        for y in range(board_teams.shape[0]):
+            for x in range(board_teams.shape[1]):
+                team = board_teams[y, x]
+                if team == 0:
+                    assert not happy_cells[y, x]
+                    continue
+                mine = neighbours[team - 1, y, x]
+                total = neighbours[:, y, x].sum()
+                # compare fractions with exact arithmetic
+                expected = total == 0 or \
+                    Fraction(int(mine), int(total)) >= \
+                    Fraction(thresholds[team - 1]).limit_denominator(10)
+                assert happy_cells[y, x] == expected
+
+        for ix, team in enumerate("ABCD"):
+            assert (sb.model_happy_tensor()[ix] ==
+                    sb.model_happy_cells(team)).all()
+            assert (sb.model_happy_cells(team)[board_teams == ix + 1] ==
+                    happy_cells[board_teams == ix + 1]).all()
+
+        self.assertRaises(ValueError, SchellingBoard, board_teams,
+                          team_names=list("ABCD"), threshold=[0.5, 0.5])
+
+    def test_random(self):
+        sb = SchellingBoard.random(10, 8, density=0.5, seed=1)
+        assert sb.teams.shape == (8, 10)
+        assert sb.count_empty_cells() == 40
+        assert sb.count_team_agents("B") == sb.count_team_agents("R") == 20
+
+
+    def test_to_codes(self):
+        sb = self.default_sb()
+        codes = sb.to_codes()
+        assert codes.dtype == np.int8
+        assert (sb.codes_to_labels(codes) == sb.to_str_matrix()).all()
+        assert (sb.labels_to_codes(sb.to_str_matrix()) == codes).all()
+
+        # the agents with a mood come in the order of get_all_classes_str
+        assert sb.code_labels().tolist() == [
+            "", "RH", "RS", "BH", "BS", "GH", "GS", "R", "B", "G"]
+
+        self.assertRaises(ValueError, sb.labels_to_codes, [["BH", "XS"]])
+        sb = SchellingBoard(teams=sb.teams, team_names=["Red", "Rose", "B"])
+        self.assertRaises(ValueError, sb.labels_to_codes, [["RH"]])
+
+    def test_from_codes(self):
+        sb = self.default_sb()
+        board = SchellingBoard.from_codes(sb.to_codes(),
+                                          team_names=sb.team_names)
+        assert (board.teams == sb.teams).all()
+        assert (board.moods == sb.moods).all()
+
+        # agents without a mood keep their team
+        sb = SchellingBoard.random(6, 5, n_teams=3, seed=1)
+        board = SchellingBoard.from_codes(sb.to_codes(),
+                                          team_names=sb.team_names)
+        assert (board.teams == sb.teams).all()
+        assert (board.moods == 0).all()
+
+        self.assertRaises(ValueError, SchellingBoard.from_codes, [[0, 7]])
+        self.assertRaises(ValueError, SchellingBoard.from_codes, [[-1, 0]])
+
+
+    def test_diff(self):
+        before = SchellingBoard(teams=np.array([[1, 0, 2],
+                                                [0, 1, 2]]),
+                                moods=np.array([[1, 0, 1],
+                                                [0, -1, 1]]))
+        after = SchellingBoard(teams=np.array([[0, 1, 2],
+                                               [0, 1, 0]]),
+                               moods=np.array([[0, 1, -1],
+                                               [0, 1, 1]]))
+        diff = before.diff(after)
+
+        assert diff.vacated[0].tolist() == [[True, False, False],
+                                            [False, False, True]]
+        assert diff.occupied[0].tolist() == [[False, True, False],
+                                             [False, False, False]]
+        assert not diff.replaced.any()
+        assert diff.mood_flips[0].tolist() == [[False, False, True],
+                                               [False, True, False]]
+        # B moved once, an R agent disappeared
+        assert diff.left.tolist() == [[1, 1]]
+        assert diff.arrived.tolist() == [[1, 0]]
+        assert diff.total_moves.tolist() == [1]
+
+        moves = diff.match_moves()
+        assert moves["B"].tolist() == [[[0, 0], [0, 1]]]
+        assert moves["R"].shape == (0, 2, 2)
+
+    def test_diff_matching(self):
+        # the pairing prefers short moves
+        before = SchellingBoard(teams=np.array([[1, 0, 0, 0, 1, 2]]))
+        after = SchellingBoard(teams=np.array([[0, 1, 0, 1, 0, 2]]))
+        moves = before.diff(after).match_moves()
+        assert sorted(moves["B"].tolist()) == [[[0, 0], [0, 1]],
+                                               [[0, 4], [0, 3]]]
+
+    @staticmethod
+    def loop_neighbours(teams, n_teams, kernel, boundary):
+        """count the neighbours cell by cell"""
+        n_rows, n_cols = teams.shape
+        radius = kernel.shape[0] // 2
+        neighbours = np.zeros((n_teams,) + teams.shape, dtype=int)
+        for i in range(n_rows):
+            for j in range(n_cols):
+                for di in range(-radius, radius + 1):
+                    for dj in range(-radius, radius + 1):
+                        if not kernel[di + radius, dj + radius]:
+                            continue
+                        ni, nj = i + di, j + dj
+                        if boundary == "wrap":
+                            ni, nj = ni % n_rows, nj % n_cols
+                        elif not (0 <= ni < n_rows and 0 <= nj < n_cols):
+                            continue
+                        if teams[ni, nj] > 0:
+                            neighbours[teams[ni, nj] - 1, i, j] += 1
+        return neighbours
+
+    def test_neighbourhood_kernel(self):
+        assert (neighbourhood_kernel() == np.array([[1, 1, 1],
+                                                    [1, 0, 1],
+                                                    [1, 1, 1]])).all()
+        assert neighbourhood_kernel("moore", 2).sum() == 24
+        assert neighbourhood_kernel("von_neumann", 1).sum() == 4
+        assert neighbourhood_kernel("von_neumann", 2).sum() == 12
+        self.assertRaises(ValueError, neighbourhood_kernel, "hex")
+        self.assertRaises(ValueError, neighbourhood_kernel, "moore", 0)
+        self.assertRaises(ValueError, SchellingBoard,
+                          np.array([[1, 2]]), boundary="reflect")
+
+    def test_neighbourhoods(self):
+        rng = np.random.default_rng(1234)
+        board_teams = rng.integers(0, 4, size=(9, 11))
+        # radius 3 and 4 go through the FFT convolution
+        for boundary in ["constant", "wrap"]:
+            for neighbourhood, radius in [("moore", 1), ("moore", 3),
+                                          ("von_neumann", 2),
+                                          ("von_neumann", 4)]:
+                sb = SchellingBoard(teams=board_teams,
+                                    team_names=["R", "B", "G"],
+                                    boundary=boundary,
+                                    neighbourhood=neighbourhood,
+                                    radius=radius)
+                expected = self.loop_neighbours(board_teams, 3, sb.kernel,
+                                                boundary)
+                assert (sb.neighbours_tensor() == expected).all()
+
+    def test_neighbourhood_segregation(self):
+        def loop_links(teams, kernel, boundary):
+            # every ordered pair of neighbouring agents, then halved
+            neighbours = self.loop_neighbours(teams, 3, kernel, boundary)
+            links = mixed_links = 0
+            for team in range(1, 4):
+                around = neighbours[:, teams == team]
+                links += around.sum()
+                mixed_links += around.sum() - around[team - 1].sum()
+            return links // 2, mixed_links // 2
+
+        rng = np.random.default_rng(1234)
+        board_teams = rng.integers(0, 4, size=(8, 10))
+        for boundary in ["constant", "wrap"]:
+            for radius in [1, 2, 3]:
+                sb = SchellingBoard(teams=board_teams,
+                                    team_names=["R", "B", "G"],
+                                    boundary=boundary, radius=radius)
+                links, mixed_links = loop_links(board_teams, sb.kernel,
+                                                boundary)
+                assert np.isclose(sb.segregation(),
+                                  1 - mixed_links / links)
+                assert sb.analyze().segregation == sb.segregation()
+
+        # a torus has more links than the flat board
+        flat = SchellingBoard(teams=board_teams, team_names=["R", "B", "G"])
+        torus = SchellingBoard(teams=board_teams, team_names=["R", "B", "G"],
+                               boundary="wrap")
+        assert flat.segregation() != torus.segregation()
+
+    def test_set_neighbourhood(self):
+        sb = self.default_sb()
+        neighbours = sb.neighbours_tensor()
+        sb.set_neighbourhood("von_neumann", 1, "wrap")
+        assert not np.array_equal(sb.neighbours_tensor(), neighbours)
+        assert sb.neighbours_tensor().sum(axis=0).max() <= 4
+        assert sb.neighbourhood_kwargs() == {"neighbourhood": "von_neumann",
+                                             "radius": 1,
+                                             "boundary": "wrap"}
+
+
+class TestSchellingGame(TestCase):
+
+    def test_from_board(self):
+        sb = SchellingBoard.random(12, 10, seed=1)
+        game = SchellingGame.from_board(sb, threshold=0.3, seed=1)
+
+        assert game.threshold == 0.3
+        assert game.n_teams == 2
+        assert (game.grid_x, game.grid_y) == (12, 10)
+        assert game.board is not sb
+        assert (game.board.teams == sb.teams).all()
+
+    def test_step(self):
+        game = SchellingGame(20, 15, density=0.8, seed=1)
+        counts = game.board.count_agents_teams()
+
+        unhappy = np.count_nonzero(game.unhappy_agents())
+        record = game.step()
+
+        assert record["step"] == 1
+        assert record["moved"] == min(unhappy, counts["Empty"])
+        assert game.board.count_agents_teams() == counts
+        assert record["happiness"] == game.board.happyness()["total"]
+        assert record["segregation"] == game.board.segregation()
+        assert (game.board.moods == game.board.model_moods()).all()
+
+    def test_run(self):
+        history = SchellingGame(30, 30, seed=1).run(500)
+        assert history[0]["step"] == 0
+        assert history[-1]["moved"] == 0
+        assert history[-1]["happiness"] == 1
+        assert history[-1]["segregation"] > history[0]["segregation"]
+
+        # same seed, same dynamics
+        assert SchellingGame(30, 30, seed=1).run(500) == history
+
+    def test_iterate(self):
+        game = SchellingGame(30, 30, seed=1)
+        records = game.iterate()
+        first = next(records)
+        assert first["step"] == 0 and first["period"] is None
+
+        history = [first] + list(records)
+        assert history[-1]["moved"] == 0
+        assert history[-1]["period"] == 1
+        assert all(r["period"] is None for r in history[1:-1])
+        assert [{k: v for k, v in r.items() if k != "period"}
+                for r in history] == \
+            [{k: v for k, v in r.items() if k != "period"}
+             for r in SchellingGame(30, 30, seed=1).run(500)]
+
+        # a small board comes back to the same state
+        game = SchellingGame(4, 1, density=0.5, seed=3)
+        history = list(game.iterate(1000, stop_on_cycle=True, n_states=2))
+        period = history[-1]["period"]
+        assert period is not None
+        assert (game.trajectory.teams(game.time - period) ==
+                game.board.teams).all()
+
+    def test_stop_on_cycle(self):
+        # a deterministic run that falls into a cycle of two boards
+        def game():
+            return SchellingGame(30, 30, threshold=0.8, density=0.97,
+                                 dynamics="best_response", seed=0)
+
+        history = game().run(300)
+        assert len(history) < 300
+        assert history[-1]["period"] == 2
+        assert history[-1]["moved"] > 0
+
+        assert len(game().run(300, stop_on_cycle=False)) == 301
+        # only the cycles up to max_period steps are detected
+        assert game().run(300, max_period=2)[-1]["period"] == 2
+        history = game().run(300, max_period=1)
+        assert len(history) == 301
+        assert all(record["period"] is None for record in history)
+        self.assertRaises(ValueError, game().run, 10, max_period=0)
+        # random relocation does not stop on a board seen again by default
+        history = SchellingGame(4, 1, density=0.5, seed=3).run(100)
+        assert len(history) == 101
+
+    def test_best_response_moves(self):
+        neighbours = np.array([[[0, 2, 1, 0]],
+                               [[1, 1, 3, 0]]])
+        happy = np.zeros(neighbours.shape, dtype=bool)
+        happy[1, 0, 1] = True
+        team_index = np.array([[1, 0, 0, 2]])
+
+        # both teams want cell 1, it is worth more to team 2
+        sources, destinations = best_response_moves(
+            neighbours, happy, team_index,
+            movers=team_index > 0, empty=team_index == 0)
+        assert sources.tolist() == [0, 3]
+        assert destinations.tolist() == [2, 1]
+
+        # nothing better than its position for the agent of team 2
+        sources, destinations = best_response_moves(
+            neighbours, np.zeros_like(happy), team_index,
+            movers=team_index == 2, empty=team_index == 0)
+        assert sources.size == 0 and destinations.size == 0
+
+    def test_best_response(self):
+        game = SchellingGame(30, 30, n_teams=3, seed=1,
+                             dynamics="best_response")
+        counts = game.board.count_agents_teams()
+        empty = game.board.empty_positions()
+        movers = game.unhappy_agents()
+        record = game.step()
+
+        assert 0 < record["moved"] <= np.count_nonzero(movers)
+        assert game.board.count_agents_teams() == counts
+        arrived = game.board.empty_positions() != empty
+        assert np.count_nonzero(arrived & empty) == record["moved"]
+        assert not (arrived & ~empty & ~movers).any()
+
+        # the moves do not depend on the random generator
+        history = SchellingGame(30, 30, n_teams=3, seed=1,
+                                dynamics="best_response").run(300)
+        game = SchellingGame(30, 30, n_teams=3, seed=1,
+                             dynamics="best_response")
+        game.rng = np.random.default_rng(2)
+        assert game.run(300) == history
+        assert history[-1]["moved"] == 0
+        assert history[-1]["segregation"] > history[0]["segregation"]
+
+        self.assertRaises(ValueError, SchellingGame, 10, 10,
+                          dynamics="shortest")
+
+    def test_many_teams(self):
+        for n_teams in [3, 4, 5]:
+            game = SchellingGame(30, 30, n_teams=n_teams,
+                                 threshold=[0.3] * n_teams, seed=1)
+            counts = game.board.count_agents_teams()
+            history = game.run(300)
+            assert game.board.count_agents_teams() == counts
+            assert history[-1]["happiness"] == 1
@@ -0,0 +1,80 @@
+from unittest import TestCase
+from SchellingModel.SchellingGame import SchellingGame
+from SchellingModel.Backends import NumpyBackend, get_backend, set_backend
+from SchellingModel.Kernels import neighbourhood_kernel, team_masks
+from SchellingModel.Tiling import TiledBackend, tile_bounds, tile_window
+
+import numpy as np
+
+
+class TestTiling(TestCase):
+
+    def test_tile_bounds(self):
+        tiles = tile_bounds(5, 7, 3)
+        assert tiles[0] == (0, 3, 0, 3)
+        assert tiles[-1] == (3, 5, 6, 7)
+
+        covered = np.zeros((5, 7), dtype=int)
+        for y0, y1, x0, x1 in tiles:
+            covered[y0:y1, x0:x1] += 1
+        assert (covered == 1).all()
+
+    def test_tile_window(self):
+        array = np.arange(20).reshape(4, 5)
+        window = tile_window(array, (0, 2, 0, 2), (1, 1), fill=-1)
+        assert window.tolist() == [[-1, -1, -1, -1],
+                                   [-1, 0, 1, 2],
+                                   [-1, 5, 6, 7],
+                                   [-1, 10, 11, 12]]
+
+        window = tile_window(array, (0, 2, 0, 2), (1, 1), boundary="wrap")
+        assert window.tolist() == [[19, 15, 16, 17],
+                                   [4, 0, 1, 2],
+                                   [9, 5, 6, 7],
+                                   [14, 10, 11, 12]]
+
+    def test_same_as_numpy(self):
+        rng = np.random.default_rng(1234)
+        numpy_backend = NumpyBackend()
+        tiled_backend = TiledBackend(n_workers=2, tile_size=7, min_cells=0)
+        try:
+            for boundary in ["constant", "wrap"]:
+                for neighbourhood, radius in [("moore", 1), ("moore", 3),
+                                              ("von_neumann", 2)]:
+                    kernel = neighbourhood_kernel(neighbourhood, radius)
+                    teams = rng.integers(0, 4, size=(2, 19, 23))
+                    masks = team_masks(teams, 3)
+
+                    counts = tiled_backend.neighbour_counts(masks, kernel,
+                                                            boundary)
+                    expected = numpy_backend.neighbour_counts(masks, kernel,
+                                                              boundary)
+                    assert counts.dtype == expected.dtype
+                    assert (counts == expected).all()
+
+                    for threshold in [0.5, [0.3, 0.6, 0.7]]:
+                        assert (tiled_backend.happy_mask(
+                            counts, teams, threshold) ==
+                            numpy_backend.happy_mask(
+                                counts, teams, threshold)).all()
+
+                    links, mixed = tiled_backend.link_counts(
+                        teams, kernel=kernel, boundary=boundary)
+                    expected_links, expected_mixed = \
+                        numpy_backend.link_counts(teams, kernel=kernel,
+                                                  boundary=boundary)
+                    assert (links == expected_links).all()
+                    assert (mixed == expected_mixed).all()
+        finally:
+            tiled_backend.close()
+
+    def test_game(self):
+        history = SchellingGame(40, 30, seed=1, boundary="wrap").run(5)
+
+        backend = get_backend()
+        try:
+            set_backend("tiled", n_workers=2, tile_size=16, min_cells=0)
+            assert SchellingGame(40, 30, seed=1,
+                                 boundary="wrap").run(5) == history
+        finally:
+            set_backend(backend.name)
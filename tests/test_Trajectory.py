@@ -0,0 +1,47 @@
+from unittest import TestCase
+from SchellingModel.SchellingGame import SchellingBoard, SchellingGame
+from SchellingModel.Trajectory import Trajectory, StepDelta, board_key
+
+import numpy as np
+
+
+class TestTrajectory(TestCase):
+
+    def test_board_key(self):
+        sb = SchellingBoard.random(10, 10, seed=1)
+        other = SchellingBoard(sb.teams.copy())
+        assert board_key(sb) == board_key(other)
+        assert len(board_key(sb)) == 16
+
+        other.teams[other.teams == 1] = 2
+        other.moods = other.model_moods()
+        assert board_key(sb) != board_key(other)
+
+    def test_step_delta(self):
+        before = np.array([[0, 1], [2, 1]])
+        after = np.array([[1, 0], [2, 1]])
+        delta = StepDelta.between(before, after)
+        assert delta.cells.tolist() == [0, 1]
+        assert delta.before.tolist() == [0, 1]
+        assert delta.after.tolist() == [1, 0]
+
+    def test_teams(self):
+        game = SchellingGame(20, 20, seed=1)
+        boards = [game.board.teams.copy()]
+        trajectory = Trajectory(game.board.teams, n_states=3)
+        for _ in range(10):
+            game.step()
+            boards.append(game.board.teams.copy())
+            trajectory.append(game.board.teams)
+
+        assert len(trajectory) == 11
+        assert len(trajectory.states) == 3
+        for step, teams in enumerate(boards):
+            assert (trajectory.teams(step) == teams).all()
+        assert (trajectory.teams() == boards[-1]).all()
+        self.assertRaises(IndexError, trajectory.teams, 11)
+
+        # less memory than keeping all the boards
+        assert trajectory.nbytes < sum(teams.nbytes for teams in boards)
+        self.assertRaises(ValueError, trajectory.append, np.zeros((3, 3)))
+        self.assertRaises(ValueError, Trajectory, boards[0], n_states=0)